@@ -0,0 +1,85 @@
+"""Compares yacc's parse tables (dicts of dicts) with compact_tables=True (arrays).
+
+    python benchmarks/bench_compact_tables.py
+
+Prints, for each bundled grammar, the memory the parse tables take once loaded from the
+cache (measured with tracemalloc, so Python 3 only), the size of their cache entry, the time
+to load them (best of 10), and the time to parse the test samples with each (best of 3),
+checking that the trees are the same.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import codecs
+import pickle
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from plyplus import Grammar, cache
+from plyplus.engine_ply import _parser_to_tab
+from plyplus.compact_tables import CompactTables
+
+GRAMMARS_DIR = os.path.join(ROOT, 'plyplus', 'grammars')
+PYTHON_SAMPLES = [os.path.join(ROOT, 'plyplus', 'test', 'python_sample1.py'),
+                  os.path.join(ROOT, 'plyplus', 'test', 'python_sample2.py'),
+                  os.path.join(ROOT, 'plyplus', 'strees.py')]
+
+def _read(filename):
+    with codecs.open(filename, encoding='iso-8859-1') as f:
+        return f.read()
+
+def loaded_size(data):
+    "The memory taken by the object pickled in data, once loaded"
+    tracemalloc.start()
+    obj = pickle.loads(data)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return size
+
+def load_time(data):
+    elapsed = []
+    for _ in range(10):
+        start = time.time()
+        pickle.loads(data)
+        elapsed.append(time.time() - start)
+    return min(elapsed)
+
+def parse_time(grammar, texts):
+    elapsed = []
+    for _ in range(3):
+        start = time.time()
+        trees = [grammar.parse(text) for text in texts]
+        elapsed.append(time.time() - start)
+    return min(elapsed), trees
+
+def compare(name, grammar_text, texts):
+    print(name)
+    g = Grammar(grammar_text)
+    tab = _parser_to_tab(g._grammar.engine.parser)
+    for kind, tables in (('dicts', tab), ('arrays', CompactTables(tab))):
+        data = pickle.dumps(tables, pickle.HIGHEST_PROTOCOL)
+        print('    %-7s %8.1fK in memory %8.1fK cached   loads in %6.2fms' % (
+              kind, loaded_size(data) / 1024.0, len(data) / 1024.0, load_time(data) * 1000))
+
+    if texts:
+        compact = Grammar(grammar_text, compact_tables=True)
+        dicts_time, dicts_trees = parse_time(g, texts)
+        arrays_time, arrays_trees = parse_time(compact, texts)
+        print('    parsing the samples: dicts %.0fms, arrays %.0fms, %s' % (
+              dicts_time * 1000, arrays_time * 1000, 'same trees' if dicts_trees == arrays_trees else 'DIFFERENT TREES'))
+
+def main():
+    cache.set_cache_dir(None)
+
+    compare('config.g', _read(os.path.join(GRAMMARS_DIR, 'config.g')), [])
+    compare('selector.g', _read(os.path.join(GRAMMARS_DIR, 'selector.g')), [])
+    compare('python.g', _read(os.path.join(GRAMMARS_DIR, 'python.g')), [_read(filename) for filename in PYTHON_SAMPLES])
+
+if __name__ == '__main__':
+    main()
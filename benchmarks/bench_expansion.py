@@ -0,0 +1,97 @@
+"""Compares the 'inline' and 'factored' expansion modes of the ? and * operators.
+
+    python benchmarks/bench_expansion.py [grammar_file [sample_file ...]]
+
+Prints, for each mode, the build time, the size of the parse tables and the number of
+LALR conflicts. Then checks that both modes give the same trees for the sample files.
+By default it compares python.g, parsing the python samples of the tests, and a rule
+with many optional clauses (which 'inline' turns into 2^k alternatives).
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import codecs
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from plyplus import Grammar, cache
+from plyplus.engine_ply import yacc
+
+MODES = ('inline', 'factored')
+
+DEFAULT_GRAMMAR = os.path.join(ROOT, 'plyplus', 'grammars', 'python.g')
+DEFAULT_SAMPLES = [os.path.join(ROOT, 'plyplus', 'test', 'python_sample1.py'),
+                   os.path.join(ROOT, 'plyplus', 'test', 'python_sample2.py'),
+                   os.path.join(ROOT, 'plyplus', 'strees.py')]
+
+
+_tables = []
+_LRGeneratedTable = yacc.LRGeneratedTable
+def _counting_table(*args, **kwargs):
+    "Keeps the tables yacc generates, to count their conflicts (yacc only reports them in debug mode)"
+    table = _LRGeneratedTable(*args, **kwargs)
+    _tables.append(table)
+    return table
+
+def _read(filename):
+    with codecs.open(filename, encoding='iso-8859-1') as f:
+        return f.read()
+
+def build(grammar_text, mode):
+    cache.clear()
+    del _tables[:]
+    start = time.time()
+    g = Grammar(grammar_text, expansion_mode=mode)
+    elapsed = time.time() - start
+    table = _tables[-1]     # the tables of plyplus' own grammar parser may be generated first
+    return g, elapsed, len(table.sr_conflicts) + len(table.rr_conflicts)
+
+CLAUSES = 10   # C0 to C9, so that no keyword is a prefix of another
+
+def clauses_grammar(k):
+    names = ['c%d' % i for i in range(k)]
+    return '\n'.join(['start: SELECT NAME %s SEMI;' % ' '.join('%s?' % name for name in names)]
+                   + ["%s: '%s' NAME (COMMA NAME)*;" % (name, name.upper()) for name in names]
+                   + ["SELECT: 'SELECT';", "NAME: '[a-z]+';", "COMMA: ',';", "SEMI: ';';", "WS: '[ \\t\\n]+' (%ignore);"])
+
+def clauses_sample(k):
+    return 'SELECT x %s;' % ' '.join('C%d a, b' % i for i in range(0, k, 2))
+
+def compare(grammar_text, samples):
+    grammars = {}
+    print('%-8s %10s %8s %10s %8s %12s %10s' % ('mode', 'build', 'states', 'actions', 'gotos', 'productions', 'conflicts'))
+    for mode in MODES:
+        g, elapsed, conflicts = build(grammar_text, mode)
+        sizes = g._grammar.engine.table_sizes()
+        print('%-8s %8.0fms %8d %10d %8d %12d %10d' % (mode, elapsed * 1000, sizes['states'], sizes['actions'],
+                                                     sizes['gotos'], sizes['productions'], conflicts))
+        grammars[mode] = g
+
+    for name, text in samples:
+        trees = []
+        for mode in MODES:
+            start = time.time()
+            trees.append(grammars[mode].parse(text))
+            print('%-8s parsed %s in %.0fms' % (mode, name, (time.time() - start) * 1000))
+        print('same tree' if trees[0] == trees[1] else 'DIFFERENT TREES')
+
+def main():
+    cache.set_cache_dir(None)   # always build
+    yacc.LRGeneratedTable = _counting_table
+
+    if len(sys.argv) > 1:
+        compare(_read(sys.argv[1]), [(os.path.basename(filename), _read(filename)) for filename in sys.argv[2:]])
+        return
+
+    print(os.path.basename(DEFAULT_GRAMMAR))
+    compare(_read(DEFAULT_GRAMMAR), [(os.path.basename(filename), _read(filename)) for filename in DEFAULT_SAMPLES])
+    print()
+    print('a rule with %d optional clauses' % CLAUSES)
+    compare(clauses_grammar(CLAUSES), [('clauses', clauses_sample(CLAUSES))])
+
+if __name__ == '__main__':
+    main()
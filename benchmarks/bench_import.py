@@ -0,0 +1,57 @@
+"""Measures the cost of importing plyplus in a fresh process.
+
+Each measurement runs in its own interpreter, so nothing is shared between runs
+except plyplus' on-disk cache. With --cold, every run also gets an empty cache
+(a fresh TMPDIR), like a newly started container.
+
+Usage: python benchmarks/bench_import.py [--cold] [runs]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ('import plyplus', 'import plyplus'),
+    ('import + Grammar()', 'import plyplus; plyplus.Grammar("start: A; A: \'a\';")'),
+    ('import + select()', 'import plyplus; plyplus.Grammar("start: A; A: \'a\';").parse("a").select("start")'),
+]
+
+TIMER = '''
+import time
+_start = time.time()
+%s
+print(time.time() - _start)
+'''
+
+def measure(code, runs, cold):
+    times = []
+    for _ in range(runs):
+        env = dict(os.environ)
+        if cold:
+            env['TMPDIR'] = tempfile.mkdtemp()
+        try:
+            out = subprocess.check_output([sys.executable, '-c', TIMER % code], cwd=ROOT, env=env, stderr=subprocess.STDOUT)
+        finally:
+            if cold:
+                shutil.rmtree(env['TMPDIR'])
+        times.append(float(out.decode('ascii').strip().splitlines()[-1]))
+    return min(times)
+
+def main():
+    args = sys.argv[1:]
+    cold = '--cold' in args
+    if cold:
+        args.remove('--cold')
+    runs = int(args[0]) if args else 20
+
+    for name, code in CASES:
+        print('%-20s %7.1f ms (best of %d%s)' % (name, measure(code, runs, cold) * 1000, runs, ', cold cache' if cold else ''))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Compares making the parse tables with ply.yacc, and with plyplus's own LALR(1) builder (lalr_builder='native'),
+and with its LR(1) mode (lr_method='lr1').
+
+    python benchmarks/bench_lalr.py [grammar_file ...]
+
+Prints, for each grammar and expansion mode, the time it took to make the tables (the
+'build parser' phase, best of 3) with each builder, the number of LALR states, whether
+both builders made the same tables, and the time and number of states of the LR(1) tables. By default it uses the bundled grammars.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import codecs
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from plyplus import Grammar, cache
+from plyplus.engine_ply import _parser_to_tab
+
+GRAMMARS_DIR = os.path.join(ROOT, 'plyplus', 'grammars')
+REPEAT = 3
+
+def _read(filename):
+    with codecs.open(filename, encoding='utf-8') as f:
+        return f.read()
+
+def build(grammar_text, **options):
+    elapsed = []
+    for _ in range(REPEAT):
+        cache.clear()   # the builder isn't part of the key, since the tables are the same
+        g = Grammar(grammar_text, **options)
+        elapsed.append(dict(g._grammar.timings)['build parser'])
+    return g._grammar.engine, min(elapsed)
+
+def compare(name, grammar_text):
+    print(name)
+    for expansion_mode in ('inline', 'factored'):
+        yacc_engine, yacc_time = build(grammar_text, expansion_mode=expansion_mode, lalr_builder='yacc')
+        native_engine, native_time = build(grammar_text, expansion_mode=expansion_mode, lalr_builder='native')
+        lr1_engine, lr1_time = build(grammar_text, expansion_mode=expansion_mode, lr_method='lr1')
+        same = _parser_to_tab(yacc_engine.parser) == _parser_to_tab(native_engine.parser)
+        print('    %-9s yacc %8.0fms   native %8.0fms   %5.1fx   %6d states   %s' % (
+              expansion_mode, yacc_time * 1000, native_time * 1000, yacc_time / native_time,
+              yacc_engine.table_sizes()['states'], 'same tables' if same else 'DIFFERENT TABLES'))
+        print('    %-9s lr1  %8.0fms %40d states' % ('', lr1_time * 1000, lr1_engine.table_sizes()['states']))
+
+def main():
+    cache.set_cache_dir(None)   # always build
+
+    if len(sys.argv) > 1:
+        for filename in sys.argv[1:]:
+            compare(os.path.basename(filename), _read(filename))
+        return
+
+    for name in ('config.g', 'selector.g', 'python.g'):
+        compare(name, _read(os.path.join(GRAMMARS_DIR, name)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Compares the throughput of the ply engine and of the lalr_fast engine (a parse loop generated for the grammar).
+
+    python benchmarks/bench_lalr_fast.py [grammar_file [sample_file ...]]
+
+Prints, for each sample and engine, the parse time (best of 5) and the throughput, with and
+without optimize=True, and checks that both engines give the same trees.
+By default it compares python.g on the python samples of the tests, and the grammar of
+examples/json.py on a generated document.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import random
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from plyplus import Grammar, cache
+from bench_optimize import PYTHON_GRAMMAR, PYTHON_SAMPLES, _read, json_grammar, json_sample
+
+REPEAT = 5
+ENGINES = ('ply', 'lalr_fast')
+
+def parse_time(grammar, text):
+    elapsed = []
+    for _ in range(REPEAT):
+        start = time.time()
+        grammar.parse(text)
+        elapsed.append(time.time() - start)
+    return min(elapsed)
+
+def compare(grammar_text, samples):
+    for optimize in (False, True):
+        grammars = dict((engine, Grammar(grammar_text, engine=engine, optimize=optimize)) for engine in ENGINES)
+        for sample_name, text in samples:
+            times = {}
+            for engine in ENGINES:
+                times[engine] = parse_time(grammars[engine], text)
+                print('    %-9s %-20s %-10s %8.1fms %8.0f KB/s' % (
+                      'optimize' if optimize else 'default', sample_name, engine,
+                      times[engine] * 1000, len(text) / 1024.0 / times[engine]))
+            same = grammars['ply'].parse(text) == grammars['lalr_fast'].parse(text)
+            print('    %-9s %-20s %.2fx, %s' % ('', '', times['ply'] / times['lalr_fast'], 'same tree' if same else 'DIFFERENT TREES'))
+
+def main():
+    cache.set_cache_dir(None)   # always build
+
+    if len(sys.argv) > 1:
+        print(os.path.basename(sys.argv[1]))
+        compare(_read(sys.argv[1]), [(os.path.basename(filename), _read(filename)) for filename in sys.argv[2:]])
+        return
+
+    print('python.g')
+    compare(_read(PYTHON_GRAMMAR), [(os.path.basename(filename), _read(filename)) for filename in PYTHON_SAMPLES])
+    print('examples/json.py')
+    compare(json_grammar(), [('generated json', json_sample(random.Random(0)))])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Compares building grammars with and without optimize=True (inlining the rules whose nodes are always expanded).
+
+    python benchmarks/bench_optimize.py [grammar_file [sample_file ...]]
+
+Prints, for each grammar, the inlined rules, and with and without optimize: the build time,
+the number of productions, and for each sample, the parse time (best of 3) and the number
+of reductions. Then checks that both give the same trees.
+By default it compares python.g on the python samples of the tests, and the grammar of
+examples/json.py on a generated document.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import time
+import json
+import random
+import codecs
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from plyplus import Grammar, cache
+
+REPEAT = 3
+
+PYTHON_GRAMMAR = os.path.join(ROOT, 'plyplus', 'grammars', 'python.g')
+PYTHON_SAMPLES = [os.path.join(ROOT, 'plyplus', 'test', 'python_sample1.py'),
+                  os.path.join(ROOT, 'plyplus', 'test', 'python_sample2.py'),
+                  os.path.join(ROOT, 'plyplus', 'strees.py')]
+
+def _read(filename):
+    with codecs.open(filename, encoding='iso-8859-1') as f:
+        return f.read()
+
+def json_grammar():
+    "The grammar of examples/json.py (which is python 2 only, so it isn't imported)"
+    return re.search(r'Grammar\(r"""(.*?)"""\)', _read(os.path.join(ROOT, 'examples', 'json.py')), re.S).group(1)
+
+def json_sample(rnd, depth=4):
+    def value(depth):
+        kind = rnd.choice(['object', 'array'] if depth else ['string', 'number', 'true', 'null'])
+        if kind == 'object':
+            return dict(('key%d' % i, value(depth - 1)) for i in range(rnd.randint(1, 5)))
+        if kind == 'array':
+            return [value(depth - 1) for _ in range(rnd.randint(1, 5))]
+        return {'string': 'text', 'number': rnd.random() * 100, 'true': True, 'null': None}[kind]
+    return json.dumps([value(depth) for _ in range(50)], indent=1)
+
+def count_reductions(grammar):
+    counter = [0]
+    for production in grammar._grammar.engine.parser.productions:
+        if production.callable:
+            def counting(p, callable=production.callable):
+                counter[0] += 1
+                callable(p)
+            production.callable = counting
+    return counter
+
+def compare(grammar_text, samples):
+    trees = {}
+    for optimize in (False, True):
+        start = time.time()
+        g = Grammar(grammar_text, optimize=optimize)
+        elapsed = time.time() - start
+        name = 'optimize' if optimize else 'default'
+        if optimize:
+            print('    inlined: %s' % ' '.join(g._grammar.inlined_rules))
+        print('    %-9s built in %.0fms, %d productions' % (name, elapsed * 1000, g._grammar.engine.table_sizes()['productions']))
+
+        for sample_name, text in samples:
+            elapsed = []
+            for _ in range(REPEAT):
+                start = time.time()
+                g.parse(text)
+                elapsed.append(time.time() - start)
+            reductions = count_reductions(g)
+            trees[optimize, sample_name] = g.parse(text)
+            print('    %-9s %-20s %8.0fms %10d reductions' % (name, sample_name, min(elapsed) * 1000, reductions[0]))
+
+    for sample_name, _ in samples:
+        print('    %s: %s' % (sample_name, 'same tree' if trees[False, sample_name] == trees[True, sample_name] else 'DIFFERENT TREES'))
+
+def main():
+    cache.set_cache_dir(None)   # always build
+
+    if len(sys.argv) > 1:
+        print(os.path.basename(sys.argv[1]))
+        compare(_read(sys.argv[1]), [(os.path.basename(filename), _read(filename)) for filename in sys.argv[2:]])
+        return
+
+    print('python.g')
+    compare(_read(PYTHON_GRAMMAR), [(os.path.basename(filename), _read(filename)) for filename in PYTHON_SAMPLES])
+    print('examples/json.py')
+    compare(json_grammar(), [('generated json', json_sample(random.Random(0)))])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Compares building permutation rules by expansion, and as a checked list.
+
+    python benchmarks/bench_perm.py [max_members]
+
+Prints, for each number of members, the build time and the size of the parse tables
+with each method. Expansion is skipped when it would take too long.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from plyplus import Grammar, cache
+from plyplus.plyplus import ExpandOper_Visitor
+
+MAX_EXPANDED = 7    # 8! alternatives take minutes to build
+
+def perm_grammar(n):
+    names = ['f%d' % i for i in range(n)]
+    return '\n'.join(['start: %s ^^ SEMI;' % ' ^ '.join(name + ('?' if i % 2 else '') for i, name in enumerate(names))]
+                   + ["%s: '%s' NUM;" % (name, name) for name in names]
+                   + ["NUM: '[0-9]+';", "SEMI: ';';", "WS: '[ \\t]+' (%ignore);"])
+
+def build(n, expand):
+    ExpandOper_Visitor.PERM_EXPANSION_LIMIT = n if expand else 0
+    cache.clear()   # the limit isn't part of the key
+    start = time.time()
+    g = Grammar(perm_grammar(n))
+    elapsed = time.time() - start
+    text = ';'.join('f%d %d' % (i, i) for i in reversed(range(n)))
+    g.parse(text)
+    return elapsed, g._grammar.engine.table_sizes()
+
+def main():
+    max_members = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    cache.set_cache_dir(None)   # always build
+
+    print('%-8s %-10s %10s %8s %10s %12s' % ('members', 'method', 'build', 'states', 'actions', 'productions'))
+    for n in range(2, max_members + 1):
+        for expand in (True, False):
+            if expand and n > MAX_EXPANDED:
+                continue
+            elapsed, sizes = build(n, expand)
+            print('%-8d %-10s %8.0fms %8d %10d %12d' % (n, 'expand' if expand else 'list', elapsed * 1000,
+                                                     sizes['states'], sizes['actions'], sizes['productions']))
+
+if __name__ == '__main__':
+    main()
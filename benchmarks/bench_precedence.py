@@ -0,0 +1,113 @@
+"""Compares an expression grammar written as a cascade of rules, with one using precedence declarations.
+
+    python benchmarks/bench_precedence.py [expressions]
+
+Parses many arithmetic expressions with both, and prints the parse time (best of 3), the
+number of reductions, and the number of trees created. Both grammars give the same trees.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from plyplus import Grammar, cache
+from plyplus.strees import STree
+
+# As in examples/calc.py, with an operator for each rule, so that the trees compare
+CASCADE = r"""
+    start: expr;
+
+    @expr: add_level;
+    ?add_level: add | sub | mul_level;
+    add: add_level '\+' mul_level;
+    sub: add_level '-' mul_level;
+    ?mul_level: mul | div | atom;
+    mul: mul_level '\*' atom;
+    div: mul_level '/' atom;
+    @atom: neg | number | '\(' expr '\)';
+    neg: '-' atom;
+
+    number: '[\d.]+';
+    WS: '[ \t]+' (%ignore);
+"""
+
+PRECEDENCE = r"""
+    start: expr;
+
+    @expr: add | sub | mul | div | neg | number | '\(' expr '\)';
+    add: expr '\+' expr;
+    sub: expr '-' expr;
+    mul: expr '\*' expr;
+    div: expr '/' expr;
+    neg: '-' expr %prec UMINUS;
+
+    %left: '\+' '-';
+    %left: '\*' '/';
+    %right: UMINUS;
+
+    number: '[\d.]+';
+    WS: '[ \t]+' (%ignore);
+"""
+
+REPEAT = 3
+
+class CountingSTree(STree):
+    created = 0
+    def __init__(self, *args, **kwargs):
+        CountingSTree.created += 1
+        STree.__init__(self, *args, **kwargs)
+
+def expression(rnd, terms=10):
+    parts = []
+    for i in range(terms):
+        if i:
+            parts.append(rnd.choice('+-*/'))
+        term = str(rnd.randint(1, 99))
+        if rnd.random() < 0.1:
+            term = '-' + term
+        if rnd.random() < 0.1:
+            term = '(%s %s %d)' % (term, rnd.choice('+-*/'), rnd.randint(1, 99))
+        parts.append(term)
+    return ' '.join(parts)
+
+def count_reductions(grammar):
+    counter = [0]
+    for production in grammar._grammar.engine.parser.productions:
+        if production.callable:
+            def counting(p, callable=production.callable):
+                counter[0] += 1
+                callable(p)
+            production.callable = counting
+    return counter
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    cache.set_cache_dir(None)
+    rnd = random.Random(0)
+    texts = [expression(rnd) for _ in range(count)]
+
+    trees = []
+    print('%-11s %10s %12s %10s' % ('grammar', 'parse', 'reductions', 'trees'))
+    for name, grammar_text in (('cascade', CASCADE), ('precedence', PRECEDENCE)):
+        g = Grammar(grammar_text, tree_class=CountingSTree)
+        elapsed = []
+        for _ in range(REPEAT):
+            start = time.time()
+            for text in texts:
+                g.parse(text)
+            elapsed.append(time.time() - start)
+
+        reductions = count_reductions(g)
+        CountingSTree.created = 0
+        trees.append([g.parse(text) for text in texts])
+        print('%-11s %8.0fms %12d %10d' % (name, min(elapsed) * 1000, reductions[0], CountingSTree.created))
+
+    print('same tree' if trees[0] == trees[1] else 'DIFFERENT TREES')
+
+if __name__ == '__main__':
+    main()
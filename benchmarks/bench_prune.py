@@ -0,0 +1,70 @@
+"""Compares building grammars with and without pruning the rules and tokens that start can't reach.
+
+    python benchmarks/bench_prune.py [grammar_file ...]
+
+Prints, for each grammar, what was pruned, and the build time, the number of LALR states and
+productions, and the number of tokens (the alternatives of the lexer's master regexp) either way.
+yacc only makes states for what start reaches, so the gain is in the productions and the lexer.
+By default it uses the bundled grammars, and python.g restricted to expressions
+(as when a big grammar is reused for a part of its language).
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import codecs
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from plyplus import Grammar, cache
+from plyplus.plyplus import _Grammar
+
+GRAMMARS_DIR = os.path.join(ROOT, 'plyplus', 'grammars')
+
+def _read(filename):
+    with codecs.open(filename, encoding='utf-8') as f:
+        return f.read()
+
+def expressions_grammar():
+    "python.g, parsing expressions only (without the postlex, which handles statements)"
+    text = _read(os.path.join(GRAMMARS_DIR, 'python.g'))
+    text = text.split('###')[0]
+    return text.replace('start: (NEWLINE|stmt)+;', 'start: testlist NEWLINE?;', 1)
+
+def build(grammar_text, prune):
+    _Grammar.PRUNE_UNREACHABLE = prune
+    cache.clear()   # PRUNE_UNREACHABLE isn't part of the key
+    start = time.time()
+    g = Grammar(grammar_text)
+    elapsed = time.time() - start
+    return g._grammar, elapsed
+
+def compare(name, grammar_text):
+    print(name)
+    for prune in (False, True):
+        grammar, elapsed = build(grammar_text, prune)
+        sizes = grammar.engine.table_sizes()
+        print('    %-10s %8.0fms %8d states %8d productions %6d tokens' % ('pruned' if prune else 'unpruned', elapsed * 1000,
+                                                                     sizes['states'], sizes['productions'], sizes['tokens']))
+    if grammar.pruned_rules:
+        print('    rules left out:  %s' % ' '.join(grammar.pruned_rules))
+    if grammar.pruned_tokens:
+        print('    tokens left out: %s' % ' '.join(grammar.pruned_tokens))
+
+def main():
+    cache.set_cache_dir(None)   # always build
+
+    if len(sys.argv) > 1:
+        for filename in sys.argv[1:]:
+            compare(os.path.basename(filename), _read(filename))
+        return
+
+    for name in ('config.g', 'selector.g', 'python.g'):
+        compare(name, _read(os.path.join(GRAMMARS_DIR, name)))
+    compare('python.g, expressions only', expressions_grammar())
+
+if __name__ == '__main__':
+    main()
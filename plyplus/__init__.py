@@ -17,7 +17,8 @@ except OSError:
 
 from .strees import SVisitor, STransformer, is_stree
 from .common import PlyplusException, GrammarException, TokenizeError, ParseError
-from .plyplus import Grammar
+from .plyplus import Grammar, analyze
+from .reloading import ReloadingGrammar
 
 from . import selector
 selector.install()
@@ -0,0 +1,177 @@
+"""Command-line tools for plyplus.
+
+    python -m plyplus compile a.g [b.g ...] -o DIR
+                                        Build grammars into the cache directory DIR,
+                                        and report how long each phase took, and what it made
+                                        (with --profile, also the memory and the LALR conflicts)
+    python -m plyplus analyze a.g [b.g ...]
+                                        Estimate what building grammars would make, without building
+                                        them, and warn about the slow ones (then exits with status 1)
+
+    python -m plyplus cache list        List the cache entries, most recently used first
+    python -m plyplus cache stats       Show the size of the cache
+    python -m plyplus cache evict       Evict entries to fit the limits (--max-size, --max-entries)
+    python -m plyplus cache clear       Remove all the entries
+
+Use --dir to manage a cache directory other than the default one.
+
+Processes started with PLYPLUS_CACHE_DIR=DIR then load the compiled grammars from
+the cache, instead of building them (as long as they open the same grammar files,
+with the same options).
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import time
+import codecs
+import shutil
+import argparse
+import tempfile
+
+from . import cache
+from .plyplus import Grammar, analyze, format_build_report, format_analysis
+
+
+def _format_size(size):
+    for unit in ('B', 'K', 'M'):
+        if size < 1024:
+            return '%d%s' % (size, unit)
+        size /= 1024.0
+    return '%.1fG' % size
+
+def _format_time(t):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+
+def _print_entries(entries):
+    for entry in entries:
+        print('%-50s %8s %6d  %s' % (entry.name, _format_size(entry.size), entry.hits, _format_time(entry.last_used)))
+
+
+def _print_report(grammar, output_dir):
+    print(format_build_report(grammar.build_report()))
+    # The files of the subgrammars are named after the grammar's
+    for name in sorted(os.listdir(output_dir)):
+        if name.startswith((grammar.tab_filename + '.', grammar.tab_filename + '_')):
+            print('    %-50s %8s' % (name, _format_size(os.path.getsize(os.path.join(output_dir, name)))))
+
+def compile_grammars(args):
+    options = {
+        'engine': args.engine,
+        'just_lex': args.just_lex,
+        'auto_filter_tokens': not args.no_auto_filter_tokens,
+        'keep_empty_trees': not args.no_keep_empty_trees,
+        'ignore_postproc': args.ignore_postproc,
+        'expansion_mode': args.expansion_mode,
+        'optimize': args.optimize,
+        'profile': args.profile,
+        'lalr_builder': args.lalr_builder,
+        'compact_tables': args.compact_tables,
+        'lr_method': args.lr_method,
+        'start': args.start or 'start',
+    }
+
+    cache.set_cache_dir(args.output)
+    cache.set_limits(None, None)    # keep everything we compile
+    for filename in args.grammars:
+        # Built in an empty cache directory, so that it's really built, and then moved into place
+        build_dir = tempfile.mkdtemp(dir=args.output, prefix='compile-')
+        cache.set_cache_dir(build_dir)
+        try:
+            with codecs.open(filename, encoding='utf-8') as f:
+                grammar = Grammar(f, cache_grammar=True, **options)
+            for name in os.listdir(build_dir):
+                if name != cache.INDEX and not name.endswith('.lock'):
+                    cache.replace(os.path.join(build_dir, name), os.path.join(args.output, name))
+        finally:
+            cache.set_cache_dir(args.output)
+            shutil.rmtree(build_dir)
+
+        _print_report(grammar._grammar, args.output)
+
+def analyze_grammars(args):
+    warnings = False
+    for filename in args.grammars:
+        with codecs.open(filename, encoding='utf-8') as f:
+            report = analyze(f, expansion_mode=args.expansion_mode, optimize=args.optimize)
+        print(format_analysis(report))
+        warnings = warnings or _has_warnings(report)
+    return 1 if warnings else 0
+
+def _has_warnings(report):
+    return bool(report['warnings']) or any(_has_warnings(subreport) for subreport in report['subgrammars'].values())
+
+
+def cache_list(args):
+    print('%-50s %8s %6s  %s' % ('NAME', 'SIZE', 'HITS', 'LAST USED'))
+    _print_entries(cache.entries())
+
+def cache_stats(args):
+    stats = cache.stats()
+    print('Directory:   %s' % stats['cache_dir'])
+    print('Entries:     %d' % stats['entries'])
+    print('Size:        %s' % _format_size(stats['size']))
+    print('Hits:        %d' % sum(entry.hits for entry in cache.entries()))
+    print('Max size:    %s' % (_format_size(stats['max_size']) if stats['max_size'] is not None else 'unlimited'))
+    print('Max entries: %s' % (stats['max_entries'] if stats['max_entries'] is not None else 'unlimited'))
+
+def cache_evict(args):
+    max_size, max_entries = cache.get_limits()
+    if args.max_size is not None:
+        max_size = cache.parse_size(args.max_size)
+    if args.max_entries is not None:
+        max_entries = args.max_entries
+    _print_entries(cache.evict(max_size, max_entries))
+
+def cache_clear(args):
+    _print_entries(cache.clear())
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m plyplus')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    compile_parser = commands.add_parser('compile', help='build grammars into a cache directory')
+    compile_parser.add_argument('grammars', nargs='+', metavar='GRAMMAR_FILE')
+    compile_parser.add_argument('-o', '--output', required=True, metavar='DIR', help='cache directory to write to')
+    compile_parser.add_argument('--engine', default='ply', choices=('ply', 'lalr_fast', 'pearley'))
+    compile_parser.add_argument('--just-lex', action='store_true')
+    compile_parser.add_argument('--no-auto-filter-tokens', action='store_true')
+    compile_parser.add_argument('--no-keep-empty-trees', action='store_true')
+    compile_parser.add_argument('--ignore-postproc', action='store_true')
+    compile_parser.add_argument('--expansion-mode', default='inline', choices=('inline', 'factored'))
+    compile_parser.add_argument('--optimize', action='store_true', help='inline the rules whose nodes are always expanded')
+    compile_parser.add_argument('--profile', action='store_true', help='also report the memory each phase allocated, and the LALR conflicts')
+    compile_parser.add_argument('--lalr-builder', default='yacc', choices=('yacc', 'native'), help='what makes the parse tables')
+    compile_parser.add_argument('--compact-tables', action='store_true', help='keep the parse tables in arrays')
+    compile_parser.add_argument('--lr-method', default='lalr', choices=('lalr', 'lr1'), help='make LALR(1) or LR(1) parse tables')
+    compile_parser.add_argument('--start', action='append', metavar='RULE', help='a rule that parsing can start with (default: start)')
+    compile_parser.set_defaults(func=compile_grammars)
+
+    analyze_parser = commands.add_parser('analyze', help='estimate the size of grammars, without building them')
+    analyze_parser.add_argument('grammars', nargs='+', metavar='GRAMMAR_FILE')
+    analyze_parser.add_argument('--expansion-mode', default='inline', choices=('inline', 'factored'))
+    analyze_parser.add_argument('--optimize', action='store_true', help='inline the rules whose nodes are always expanded')
+    analyze_parser.set_defaults(func=analyze_grammars)
+
+    cache_parser = commands.add_parser('cache', help='manage the grammar cache')
+    cache_parser.add_argument('--dir', help='cache directory (default: %s)' % cache.get_cache_dir())
+    cache_commands = cache_parser.add_subparsers(dest='cache_command')
+    cache_commands.required = True
+    cache_commands.add_parser('list', help='list the entries, most recently used first').set_defaults(func=cache_list)
+    cache_commands.add_parser('stats', help='show the size of the cache').set_defaults(func=cache_stats)
+    evict_parser = cache_commands.add_parser('evict', help='evict the least recently used entries')
+    evict_parser.add_argument('--max-size', help='e.g. 50M (default: the configured limit)')
+    evict_parser.add_argument('--max-entries', type=int, help='(default: the configured limit)')
+    evict_parser.set_defaults(func=cache_evict)
+    cache_commands.add_parser('clear', help='remove all the entries').set_defaults(func=cache_clear)
+
+    args = parser.parse_args(args)
+    if getattr(args, 'dir', None):
+        cache.set_cache_dir(args.dir)
+    return args.func(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""Generates the tables plyplus needs for its own grammars, to ship them inside the package.
+
+These are the tables of the grammar language (grammar_lexer and grammar_parser) and
+of selector.g. Without them, every new process (or container, since they would
+otherwise live in a temp directory) has to generate them again.
+
+setup.py runs this when building the package. At runtime, tables that don't match
+the running plyplus or PLY are ignored, and generated (and cached) as usual.
+
+Usage:
+
+    python -m plyplus.bootstrap [package_dir]
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import shutil
+
+from . import cache, grammars
+from . import grammar_lexer, grammar_parser
+from .plyplus import Grammar
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def build_tables(package_dir=PACKAGE_DIR):
+    "Writes the tables into package_dir. Returns the list of files written"
+    written = []
+
+    grammar_lexer.write_lextab(package_dir)
+    written.append(os.path.join(package_dir, grammar_lexer.LEX_TAB_MODULE + '.py'))
+
+    parsetab = os.path.join(package_dir, grammar_parser.YACC_TAB_MODULE + '.py')
+    grammar_parser.write_parsetab(package_dir)
+    if not os.path.exists(parsetab):
+        # PLY doesn't write the tables when it already loaded up-to-date ones from this package
+        shutil.copy(os.path.join(PACKAGE_DIR, grammar_parser.YACC_TAB_MODULE + '.py'), parsetab)
+    written.append(parsetab)
+
+    # selector.g is loaded with cache_grammar, so we write its cache entry
+    tables_dir = os.path.join(package_dir, os.path.basename(cache.BUNDLED_DIR))
+    if not os.path.isdir(tables_dir):
+        os.mkdir(tables_dir)
+    with grammars.open('selector.g') as f:
+        grammar = Grammar(f)._grammar
+    entry = os.path.join(tables_dir, grammar.tab_filename + '.plyplus')
+    cache._write(entry, grammar.serialize())
+    written.append(entry)
+
+    return written
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) > 1:
+        print("Usage: python -m plyplus.bootstrap [package_dir]", file=sys.stderr)
+        return 1
+
+    for path in build_tables(*args):
+        print(path)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
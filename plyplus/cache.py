@@ -0,0 +1,457 @@
+"""Storage for built grammars and their tables, keyed by content.
+
+Everything plyplus caches (PLY's parse tables, the lexer tables, and the built
+grammar when cache_grammar is set) is stored under names derived from a single
+key, computed by cache_key(). The key only depends on things that affect the
+result of the build, so it stays the same across processes and machines.
+
+Processes can share the cache directory safely: get() makes one of them build a
+missing entry while the others wait for it, and entries are written atomically,
+so a partially-written file is never loaded.
+
+The directory defaults to $PLYPLUS_CACHE_DIR, or PLYPLUS_DIR if it isn't set. Use
+set_cache_dir() to change it, or set it to None (or $PLYPLUS_CACHE_DIR to ':memory:')
+to keep the cache in memory only, e.g. on read-only filesystems.
+
+The cache directory is kept under a size limit (DEFAULT_MAX_SIZE, or
+$PLYPLUS_CACHE_MAX_SIZE and $PLYPLUS_CACHE_MAX_ENTRIES, or set_limits()), by evicting
+the least recently used entries. entries(), stats(), evict() and clear() manage it,
+and are also available from the command line, as "python -m plyplus cache". Looking up an
+entry doesn't wait for other processes: its hits are counted in memory, and added to the
+index by flush_hits() (on the next store, without waiting for the lock, and at exit).
+
+Entries are also looked up in BUNDLED_DIR, which holds the tables plyplus ships for
+its own grammars (see bootstrap.py). It's never written to at runtime.
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import stat
+import time
+import errno
+import hashlib
+import platform
+import atexit
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from ply import lex
+
+from . import __version__, PLYPLUS_DIR
+from .utils import StringType
+
+BUNDLED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tables')
+
+MEMORY = ':memory:'
+
+INDEX = 'cache-index'   # the hit counts of the entries (their mtime is their last use)
+
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+
+KEY_LENGTH = 20     # in hex digits
+
+# Part of the key; bump it when what's stored under a key (or how it's named) changes
+FORMAT_VERSION = 5
+
+# Options that affect the built grammar, and so must be part of its key
+KEY_OPTIONS = ('engine', 'just_lex', 'auto_filter_tokens', 'keep_empty_trees', 'ignore_postproc', 'expansion_mode', 'optimize', 'compact_tables', 'lr_method', 'start')
+
+
+def cache_key(grammar_text, options):
+    "Returns a key for grammar_text built with options, that is stable across processes"
+    if isinstance(grammar_text, StringType):
+        grammar_text = grammar_text.encode('utf-8')
+
+    h = hashlib.sha256()
+    for part in (str(FORMAT_VERSION), __version__, lex.__version__, platform.python_implementation(), '%d.%d' % sys.version_info[:2]):
+        h.update(part.encode('ascii') + b'\0')
+    for name in KEY_OPTIONS:
+        h.update(('%s=%r' % (name, getattr(options, name))).encode('utf-8') + b'\0')
+    h.update(grammar_text)
+
+    return h.hexdigest()[:KEY_LENGTH]
+
+_cache_dir = None
+_memory = {}
+_memory_lock = threading.RLock()     # get() calls nest: tables are cached while building the grammar
+
+def set_cache_dir(path):
+    "Sets the directory where the cache is stored (creating it if needed). None keeps it in memory only"
+    global _cache_dir
+    if path == MEMORY:
+        path = None
+    if path is not None:
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    _cache_dir = path
+    _reset_estimate()
+
+def get_cache_dir():
+    "Returns the directory where the cache is stored, or None if it's in memory only"
+    return _cache_dir
+
+def _path(name):
+    return os.path.join(_cache_dir, name)
+
+def _load(path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return None     # missing, corrupt, or written by an incompatible version
+
+def _lookup(name):
+    "Returns the object cached under name (or None), and whether it was found in the cache directory"
+    obj = _memory.get(name)
+    if obj is not None:
+        return obj, False
+    if _cache_dir is not None:
+        obj = _load(_path(name))
+        if obj is not None:
+            return obj, True
+    return _load(os.path.join(BUNDLED_DIR, name)), False
+
+def _count(name, obj, in_cache_dir):
+    if obj is None:
+        _stats['misses'] += 1
+    else:
+        _stats['hits'] += 1
+        if in_cache_dir:
+            _record_hit(name)
+
+def load(name):
+    "Returns the object cached under name, or None if there isn't one"
+    obj, in_cache_dir = _lookup(name)
+    _count(name, obj, in_cache_dir)
+    return obj
+
+def store(name, obj):
+    "Caches obj under name"
+    if _cache_dir is not None:
+        try:
+            _write(_path(name), obj)
+            size = os.path.getsize(_path(name))
+        except (IOError, OSError):
+            pass    # can't write there (read-only filesystem?), so keep it for this process at least
+        else:
+            flush_hits()
+            _grow_estimate(size)
+            return
+    _memory[name] = obj
+
+def _write(path, obj):
+    # Written to a temporary file first, and renamed over path, so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def replace(src, dst):
+    "Renames src to dst, replacing dst if it exists"
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # Windows doesn't rename over existing files
+        os.remove(dst)
+        os.rename(src, dst)
+
+@contextmanager
+def lock(name):
+    "Holds an exclusive lock on name, which other threads and processes using the same cache wait for"
+    if _cache_dir is None:
+        with _memory_lock:
+            yield
+        return
+
+    try:
+        f = open(_path(name + '.lock'), 'a+b')
+    except (IOError, OSError):
+        # Can't create the lock file, so we can't write the entry either. Just build it.
+        yield
+        return
+
+    try:
+        _lock_file(f)
+        yield
+    finally:
+        f.close()   # releases the lock
+
+def _lock_file(f, blocking=True):
+    "Returns whether the lock was acquired (always True when blocking)"
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            if blocking or e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+        return True
+
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            return True
+        except IOError:
+            if not blocking:
+                return False
+            # LK_LOCK gives up after 10 seconds
+
+def get(name, build):
+    """Returns the object cached under name.
+
+    If there isn't one, calls build() to create it, and caches the result. Only one
+    process builds it; other processes asking for it at the same time wait, and then
+    load it from the cache.
+    """
+    obj, in_cache_dir = _lookup(name)
+    if obj is None:
+        with lock(name):
+            obj, in_cache_dir = _lookup(name)     # maybe someone built it while we waited
+            if obj is None:
+                _count(name, obj, in_cache_dir)
+                obj = build()
+                store(name, obj)
+                return obj
+    _count(name, obj, in_cache_dir)
+    return obj
+
+
+# -- Management --
+
+CacheEntry = namedtuple('CacheEntry', 'name size hits last_used')
+
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+_max_size = None
+_max_entries = None
+
+def set_limits(max_size=None, max_entries=None):
+    "Sets the maximum total size (in bytes) and number of entries of the cache directory. None means no limit"
+    global _max_size, _max_entries
+    _max_size = max_size
+    _max_entries = max_entries
+    _reset_estimate()
+
+def get_limits():
+    "Returns (max_size, max_entries)"
+    return _max_size, _max_entries
+
+def parse_size(text):
+    "Parses a size in bytes, with an optional K, M or G suffix"
+    text = text.strip().upper()
+    for i, suffix in enumerate('KMG'):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * 1024 ** (i + 1))
+    return int(text)
+
+def _load_index():
+    index = _load(_path(INDEX)) or {}
+    # Older versions kept (hits, last used) tuples
+    return dict((name, hits[0] if isinstance(hits, tuple) else hits) for name, hits in index.items())
+
+# Hits are on the read path, which other processes shouldn't wait for: a hit sets the mtime of
+# its entry, and is counted here, until flush_hits() adds the counts to the index
+_pending_hits = {}
+_pending_hits_lock = threading.Lock()
+
+def _record_hit(name):
+    now = time.time()   # finer than the clock of the filesystem timestamps, which can give it the time of an earlier write
+    try:
+        os.utime(_path(name), (now, now))
+    except OSError:
+        pass    # removed meanwhile, or a read-only filesystem
+    with _pending_hits_lock:
+        _pending_hits[name] = _pending_hits.get(name, 0) + 1
+
+def flush_hits(blocking=False):
+    """Adds the hits counted by this process to the index. Unless blocking, gives up
+    (keeping the counts for the next flush) if another process is updating it."""
+    if _cache_dir is None:
+        return
+    with _pending_hits_lock:
+        if not _pending_hits:
+            return
+        hits = dict(_pending_hits)
+        _pending_hits.clear()
+    try:
+        with open(_path(INDEX + '.lock'), 'a+b') as f:
+            if _lock_file(f, blocking):
+                index = _load_index()
+                for name, count in hits.items():
+                    index[name] = index.get(name, 0) + count
+                _write(_path(INDEX), index)
+                return
+    except (IOError, OSError):
+        pass    # the index is only informative
+    with _pending_hits_lock:
+        for name, count in hits.items():
+            _pending_hits[name] = _pending_hits.get(name, 0) + count
+
+atexit.register(flush_hits, True)     # the last chance to add them, so it waits for the lock
+
+def entries():
+    "Returns the entries in the cache directory as CacheEntry tuples, most recently used first"
+    if _cache_dir is None:
+        return []
+
+    index = _load_index()
+    with _pending_hits_lock:
+        for name, count in _pending_hits.items():
+            index[name] = index.get(name, 0) + count
+    result = []
+    for name in os.listdir(_cache_dir):
+        if name == INDEX or name.endswith(('.lock', '.tmp')):
+            continue
+        try:
+            st = os.stat(_path(name))
+        except OSError:
+            continue    # removed meanwhile
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        result.append(CacheEntry(name, st.st_size, index.get(name, 0), st.st_mtime))
+
+    result.sort(key=lambda entry: entry.last_used, reverse=True)
+    return result
+
+def _remove(name):
+    """Removes an entry, unless it's locked (it's being built, so it's not a good candidate anyway).
+    Its lock file stays: a process waiting for the lock would get it on the removed file,
+    while the next one locks a new file, and both would build the entry."""
+    try:
+        f = open(_path(name + '.lock'), 'a+b')
+    except (IOError, OSError):
+        f = None
+    # Not waiting for the lock avoids deadlocks, since we may be holding another one
+    if f is not None and not _lock_file(f, blocking=False):
+        f.close()
+        return False
+
+    try:
+        try:
+            os.remove(_path(name))
+        except OSError:
+            return False
+        return True
+    finally:
+        if f is not None:
+            f.close()
+
+def _remove_from_index(names):
+    with _pending_hits_lock:
+        for name in names:
+            _pending_hits.pop(name, None)
+    try:
+        with lock(INDEX):
+            index = _load_index()
+            for name in names:
+                index.pop(name, None)
+            _write(_path(INDEX), index)
+    except (IOError, OSError):
+        pass
+
+def evict(max_size=None, max_entries=None):
+    """Removes the least recently used entries, until the cache directory has at most
+    max_entries entries, taking at most max_size bytes. Returns the removed entries.
+    """
+    all_entries = entries()
+    count = len(all_entries)
+    total_size = sum(entry.size for entry in all_entries)
+    removed = []
+    for entry in reversed(all_entries):
+        if (max_size is None or total_size <= max_size) and (max_entries is None or count <= max_entries):
+            break
+        if _remove(entry.name):
+            count -= 1
+            total_size -= entry.size
+            removed.append(entry)
+
+    if removed:
+        _remove_from_index([entry.name for entry in removed])
+        _stats['evictions'] += len(removed)
+    _set_estimate(count, total_size)
+    return removed
+
+# What this process knows of the size of the cache directory: it's measured once, then grown
+# by each store(), so that evict() only runs when the limits are crossed. Other processes'
+# stores aren't seen until then, when evict() measures the directory again.
+_estimate = None
+
+def _reset_estimate():
+    global _estimate
+    _estimate = None
+
+def _set_estimate(count, total_size):
+    global _estimate
+    _estimate = [count, total_size]
+
+def _grow_estimate(size):
+    if _max_size is None and _max_entries is None:
+        return
+    if _estimate is None:
+        all_entries = entries()
+        _set_estimate(len(all_entries), sum(entry.size for entry in all_entries))
+    else:
+        _estimate[0] += 1   # overwriting an entry isn't a new one, but overestimating only evicts sooner
+        _estimate[1] += size
+    count, total_size = _estimate
+    if (_max_size is not None and total_size > _max_size) or (_max_entries is not None and count > _max_entries):
+        evict(_max_size, _max_entries)
+
+def clear():
+    """Removes all the entries. Returns the removed entries.
+    It also removes the temporary and lock files, so it shouldn't run while other processes build grammars."""
+    _memory.clear()
+    with _pending_hits_lock:
+        _pending_hits.clear()
+    _reset_estimate()
+    if _cache_dir is None:
+        return []
+
+    removed = [entry for entry in entries() if _remove(entry.name)]
+    for name in os.listdir(_cache_dir):
+        if name.endswith(('.tmp', '.lock')):
+            try:
+                os.remove(_path(name))
+            except OSError:
+                pass
+    _remove_from_index([entry.name for entry in removed])
+    return removed
+
+def stats():
+    """Returns the cache hits, misses and evictions of this process,
+    and the number of entries and total size of the cache directory
+    """
+    all_entries = entries()
+    return dict(_stats,
+                cache_dir=_cache_dir,
+                entries=len(all_entries),
+                size=sum(entry.size for entry in all_entries),
+                max_size=_max_size,
+                max_entries=_max_entries)
+
+
+set_cache_dir(os.environ.get('PLYPLUS_CACHE_DIR', PLYPLUS_DIR))
+set_limits(parse_size(os.environ.get('PLYPLUS_CACHE_MAX_SIZE', str(DEFAULT_MAX_SIZE))),
+           int(os.environ['PLYPLUS_CACHE_MAX_ENTRIES']) if 'PLYPLUS_CACHE_MAX_ENTRIES' in os.environ else None)
@@ -32,6 +32,10 @@ class ParseError(PlyplusException):
         self.errors = errors
         super(ParseError, self).__init__(u'\n'.join(map(StringType, self.errors)))
 
+    def __reduce__(self):
+        # Exceptions unpickle with their args, and ours is the joined message
+        return ParseError, (self.errors,)
+
 class TokenizeError(PlyplusException):
     pass
 
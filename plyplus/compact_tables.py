@@ -0,0 +1,346 @@
+"""Compact LALR tables, and a parser that reads them directly.
+
+yacc's tables are dicts of dicts, keyed by state and by symbol name: each state has a dict of
+its actions, and each entry costs a hash slot (and an int object, for the larger numbers).
+CompactTables numbers the symbols, and packs the rows of the tables into a few arrays, with
+row displacement (a comb vector): each row gets a base, and its entry for symbol c is at
+base + c, so that rows interleave where their entries don't collide. A check array says
+which symbol each entry is for, so that the missing entries (syntax errors) are found:
+
+    i = action_base[state] + terminal_id
+    action = action_value[i] if action_check[i] == terminal_id else None
+
+Distinct rows get distinct bases (which is what makes checking the symbol enough), and
+identical rows share theirs.
+
+The goto table is packed by nonterminal instead, as yacc does: most gotos on a nonterminal go
+to the same state, which becomes its default, and only the others are packed (by state).
+A LALR parser only looks up the gotos that exist, so the default is never wrong.
+
+The arrays are serialized (and pickled) as bytes, so the tables load from the cache without
+creating objects for their entries.
+"""
+
+import sys
+from array import array
+
+from ply import yacc
+
+
+ARRAYS = ('action_base', 'action_value', 'action_check', 'goto_base', 'goto_value', 'goto_check', 'goto_default',
+          'default_reductions', 'production_lhs')
+
+def _array(values):
+    "An array of the smallest type that holds the values"
+    if all(-0x8000 <= v < 0x8000 for v in values):
+        return array('h', values)
+    return array('i', values)
+
+def _pack(rows, width):
+    """Packs rows (dicts of column to value) into a comb vector. Returns the base of each row,
+    and the arrays of values and of the column of each value.
+    The arrays are padded so that looking up any column of any row stays inside them.
+    """
+    bases = [0] * len(rows)
+    values = []
+    columns = []
+    occupied = 0    # a bitset of the slots taken
+    used_bases = set()
+    placed = {}
+    for r in sorted(range(len(rows)), key=lambda r: -len(rows[r])):
+        row = rows[r]
+        key = tuple(sorted(row.items()))
+        if key in placed:
+            bases[r] = placed[key]
+            continue
+
+        # The bases where every entry of the row lands on a free slot (past the end, they all do)
+        limit = len(columns) + width
+        free = ~occupied & ((1 << limit) - 1)
+        candidates = (1 << len(columns) + 1) - 1
+        for c, _ in key:
+            candidates &= free >> c
+        while True:
+            lowest = candidates & -candidates
+            base = lowest.bit_length() - 1
+            if base not in used_bases:
+                break
+            candidates ^= lowest
+        used_bases.add(base)
+        placed[key] = bases[r] = base
+
+        if base + width > len(columns):
+            values += [0] * (base + width - len(columns))
+            columns += [-1] * (base + width - len(columns))
+        for c, value in key:
+            values[base + c] = value
+            columns[base + c] = c
+            occupied |= 1 << (base + c)
+
+    return array('i', bases), _array(values), _array(columns)
+
+
+class CompactTables(object):
+    """The tables of a LALR parser, in arrays, made from the tables of yacc
+    (as returned by engine_ply._parser_to_tab)
+    """
+    def __init__(self, tab):
+        action, goto = tab['action'], tab['goto']
+        states = len(action)
+        assert sorted(action) == list(range(states))
+
+        self.terminals = sorted(set(name for actions in action.values() for name in actions))
+        self.terminal_ids = dict((name, i) for i, name in enumerate(self.terminals))
+        self.nonterminals = sorted(set(name for gotos in goto.values() for name in gotos) | set(p[1] for p in tab['productions']))
+        nonterminal_ids = dict((name, i) for i, name in enumerate(self.nonterminals))
+
+        # None (a nonassoc error) is the same as no action
+        action_rows = [dict((self.terminal_ids[name], value) for name, value in action[state].items() if value is not None)
+                       for state in range(states)]
+        self.action_base, self.action_value, self.action_check = _pack(action_rows, len(self.terminals))
+
+        goto_columns = [{} for _ in self.nonterminals]
+        for state, gotos in goto.items():
+            for name, target in gotos.items():
+                goto_columns[nonterminal_ids[name]][state] = target
+        goto_default = []
+        for column in goto_columns:
+            targets = list(column.values())
+            default = max(sorted(set(targets)), key=targets.count) if targets else 0
+            goto_default.append(default)
+            for state, target in list(column.items()):
+                if target == default:
+                    del column[state]
+        self.goto_base, self.goto_value, self.goto_check = _pack(goto_columns, states)
+        self.goto_default = _array(goto_default)
+
+        # The states where yacc reduces without reading the next token (see yacc.LRParser.set_defaulted_states)
+        defaults = []
+        for state in range(states):
+            values = list(action[state].values())
+            defaults.append(values[0] if len(values) == 1 and values[0] is not None and values[0] < 0 else 0)
+        self.default_reductions = _array(defaults)
+
+        self.productions = tab['productions']
+        self.production_lhs = _array([nonterminal_ids[p[1]] for p in self.productions])
+
+        self.counts = {
+            'states': states,
+            'actions': sum(len(actions) for actions in action.values()),
+            'gotos': sum(len(gotos) for gotos in goto.values()),
+            'productions': len(self.productions),
+        }
+
+    def nbytes(self):
+        "The memory taken by the arrays"
+        return sum(sys.getsizeof(getattr(self, name)) for name in ARRAYS)
+
+    def serialize(self):
+        "Returns the tables as plain data (the arrays as bytes), from which deserialize() can restore them"
+        data = dict((name, getattr(self, name)) for name in ('terminals', 'nonterminals', 'productions', 'counts'))
+        data['byteorder'] = sys.byteorder
+        for name in ARRAYS:
+            a = getattr(self, name)
+            data[name] = (a.typecode, a.tobytes() if hasattr(a, 'tobytes') else a.tostring())
+        return data
+
+    @classmethod
+    def deserialize(cls, data):
+        self = cls.__new__(cls)
+        self.__setstate__(data)
+        return self
+
+    __getstate__ = serialize
+
+    def __setstate__(self, data):
+        for name in ('terminals', 'nonterminals', 'productions', 'counts'):
+            setattr(self, name, data[name])
+        self.terminal_ids = dict((name, i) for i, name in enumerate(self.terminals))
+        for name in ARRAYS:
+            typecode, raw = data[name]
+            a = array(typecode)
+            if hasattr(a, 'frombytes'):
+                a.frombytes(raw)
+            else:
+                a.fromstring(raw)
+            if data['byteorder'] != sys.byteorder:
+                a.byteswap()
+            setattr(self, name, a)
+
+
+class CompactLRParser(object):
+    """Parses with CompactTables, as yacc.LRParser does (with the same error recovery, calling p_error),
+    but without its debugging and position tracking modes"""
+    def __init__(self, tables, callbacks):
+        self.tables = tables
+        self.productions = [yacc.MiniProduction(*p) for p in tables.productions]
+        for p in self.productions:
+            p.bind(callbacks)
+        self.errorfunc = callbacks['p_error']
+        self.errorok = True
+
+    def errok(self):
+        self.errorok = True
+
+    def restart(self):
+        del self.statestack[:]
+        del self.symstack[:]
+        sym = yacc.YaccSymbol()
+        sym.type = '$end'
+        self.symstack.append(sym)
+        self.statestack.append(0)
+
+    def parse(self, input=None, lexer=None, debug=False, tracking=False, tokenfunc=None):
+        # A port of yacc.LRParser.parseopt_notrack(), reading the arrays
+        tables = self.tables
+        action_base, action_value, action_check = tables.action_base, tables.action_value, tables.action_check
+        goto_base, goto_value, goto_check, goto_default = tables.goto_base, tables.goto_value, tables.goto_check, tables.goto_default
+        defaults = tables.default_reductions
+        terminal_ids = tables.terminal_ids
+        prod = self.productions
+        production_lhs = tables.production_lhs
+        error_count = yacc.error_count
+
+        lookahead = None
+        looked_up = None    # the lookahead whose terminal_id is known
+        terminal_id = -1
+        lookaheadstack = []
+        pslice = yacc.YaccProduction(None)
+        errorcount = 0
+
+        pslice.lexer = lexer
+        pslice.parser = self
+        if input is not None:
+            lexer.input(input)
+        get_token = lexer.token if tokenfunc is None else tokenfunc
+        self.token = get_token
+
+        statestack = self.statestack = [0]
+        sym = yacc.YaccSymbol()
+        sym.type = '$end'
+        symstack = self.symstack = [sym]
+        pslice.stack = symstack
+        errtoken = None
+        state = 0
+
+        while True:
+            t = defaults[state]
+            if not t:
+                if not lookahead:
+                    if not lookaheadstack:
+                        lookahead = get_token()
+                    else:
+                        lookahead = lookaheadstack.pop()
+                    if not lookahead:
+                        lookahead = yacc.YaccSymbol()
+                        lookahead.type = '$end'
+
+                if lookahead is not looked_up:
+                    looked_up = lookahead
+                    terminal_id = terminal_ids.get(lookahead.type, -1)
+                i = action_base[state] + terminal_id
+                t = action_value[i] if terminal_id >= 0 and action_check[i] == terminal_id else None
+
+            if t is not None:
+                if t > 0:
+                    # Shift
+                    statestack.append(t)
+                    state = t
+                    symstack.append(lookahead)
+                    lookahead = None
+                    if errorcount:
+                        errorcount -= 1
+                    continue
+
+                if t < 0:
+                    # Reduce
+                    p = prod[-t]
+                    plen = p.len
+                    sym = yacc.YaccSymbol()
+                    sym.type = p.name
+                    sym.value = None
+
+                    if plen:
+                        targ = symstack[-plen-1:]
+                        targ[0] = sym
+                    else:
+                        targ = [sym]
+                    pslice.slice = targ
+                    try:
+                        if plen:
+                            del symstack[-plen:]
+                        self.state = state
+                        p.callable(pslice)
+                        if plen:
+                            del statestack[-plen:]
+                        symstack.append(sym)
+                        lhs = production_lhs[-t]
+                        top = statestack[-1]
+                        if goto_check[goto_base[lhs] + top] == top:
+                            state = goto_value[goto_base[lhs] + top]
+                        else:
+                            state = goto_default[lhs]
+                        statestack.append(state)
+                    except SyntaxError:
+                        # Enter error recovery
+                        lookaheadstack.append(lookahead)
+                        if plen:
+                            symstack.extend(targ[1:-1])
+                        statestack.pop()
+                        state = statestack[-1]
+                        sym.type = 'error'
+                        sym.value = 'error'
+                        lookahead = sym
+                        errorcount = error_count
+                        self.errorok = False
+                    continue
+
+                # Accept
+                return getattr(symstack[-1], 'value', None)
+
+            # A syntax error: report it (unless recovering from the previous one), and recover as yacc does
+            if errorcount == 0 or self.errorok:
+                errorcount = error_count
+                self.errorok = False
+                errtoken = lookahead
+                if errtoken.type == '$end':
+                    errtoken = None
+                if errtoken and not hasattr(errtoken, 'lexer'):
+                    errtoken.lexer = lexer
+                self.state = state
+                tok = yacc.call_errorfunc(self.errorfunc, errtoken, self)
+                if self.errorok:
+                    lookahead = tok
+                    errtoken = None
+                    continue
+            else:
+                errorcount = error_count
+
+            if len(statestack) <= 1 and lookahead.type != '$end':
+                lookahead = None
+                errtoken = None
+                state = 0
+                del lookaheadstack[:]
+                continue
+
+            if lookahead.type == '$end':
+                return
+
+            if lookahead.type != 'error':
+                sym = symstack[-1]
+                if sym.type == 'error':
+                    lookahead = None
+                    continue
+                t = yacc.YaccSymbol()
+                t.type = 'error'
+                if hasattr(lookahead, 'lineno'):
+                    t.lineno = t.endlineno = lookahead.lineno
+                if hasattr(lookahead, 'lexpos'):
+                    t.lexpos = t.endlexpos = lookahead.lexpos
+                t.value = lookahead
+                lookaheadstack.append(lookahead)
+                lookahead = t
+            else:
+                symstack.pop()
+                statestack.pop()
+                state = statestack[-1]
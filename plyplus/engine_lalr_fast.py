@@ -0,0 +1,238 @@
+"""A LALR engine that parses with a loop generated for the grammar (engine='lalr_fast').
+
+It has the same lexer and parse tables as Engine_PLY (made by yacc or by plyplus.lalr, and cached
+the same way), and builds the same trees, with the same syntax errors. But yacc.LRParser is a
+generic loop: for each reduction it makes a YaccSymbol, slices the symbol stack into a
+YaccProduction, and calls a p_ function, which slices it again to get the values. Instead,
+generate_driver() writes the parse loop for the grammar's tables:
+
+    - The tables are locals of the loop: a list of the actions of each state, indexed by the
+      state, and a list of the reductions, indexed by the (negative) reduce action.
+    - Each reduction has its length, its action (see Engine_PLY.production_actions), and the
+      goto column of its rule, so reducing is an argument slice, one call, and one lookup.
+    - Most reductions are of one symbol, to a self-expanding rule, which returns it: the
+      driver does that without calling the action.
+    - The value stack and the state stack are preallocated lists, with a stack pointer.
+    - The states that reduce without reading the next token reduce on any token.
+    - Only the parts the grammar needs are written (see _DRIVER_TEMPLATE).
+"""
+
+from ply import yacc
+
+from .common import ErrorMsg, ParseError
+from .engine_ply import Engine_PLY, _parser_to_tab, _production_symbols, value_kinds, symbol_kinds
+from .compact_tables import CompactLRParser
+
+STACK_SIZE = 256    # the stacks start this deep, and double when full
+
+_DRIVER_TEMPLATE = '''
+def parse(get_token, error_func):
+    rows = ROWS
+    reductions = REDUCTIONS
+    size = STACK_SIZE
+    states = [0] * size
+    values = [None] * size
+    sp = 1          # states[sp-1] is the current state, and values[1:sp] the values of the symbols
+    state = 0
+    lookahead = None
+    pending = []    # the lookaheads put back by the error recovery
+    errorcount = 0
+
+    while True:
+        if lookahead is None:
+            if pending:
+                lookahead = pending.pop()
+            else:
+                lookahead = get_token() or END
+            ttype = lookahead.type
+
+        try:
+            act = rows[state][ttype]
+        except KeyError:
+            # A syntax error: report it (unless recovering from the previous one), and recover as yacc does
+            if errorcount == 0:
+                error_func(None if ttype == '$end' else lookahead)
+            errorcount = ERROR_COUNT
+
+            if sp <= 1 and ttype != '$end':
+                lookahead = None
+                state = 0
+                del pending[:]
+            elif ttype == '$end':
+                return None
+            elif ttype != 'error':
+%(error_top)s
+                error = yacc.YaccSymbol()
+                error.type = ttype = 'error'
+                error.value = lookahead
+                pending.append(lookahead)
+                lookahead = error
+            else:
+                sp -= 1
+                state = states[sp - 1]
+            continue
+
+        if act < 0:
+            n, action, gotos, unit = reductions[act]
+%(unit_reduction)s
+            if n:
+                sp -= n
+                value = action(values[sp:sp + n])
+%(empty_reduction)s
+            state = gotos[states[sp - 1]]
+            states[sp] = state
+            values[sp] = value
+            sp += 1
+        elif act > 0:
+            if sp == size:
+                states.extend([0] * size)
+                values.extend([None] * size)
+                size *= 2
+            state = states[sp] = act
+            values[sp] = lookahead.value
+            sp += 1
+            lookahead = None
+            if errorcount:
+                errorcount -= 1
+        else:
+            return values[sp - 1]
+'''
+
+# The one-child productions of self-expanding rules return their child, unless it's a tree that is expanded
+# (unit is True when it never is, and the rule's name when the child has to be tested)
+_UNIT_REDUCTION = '''            if unit:
+                value = values[sp - 1]
+                if unit is True or not isinstance(value, TREE_CLASS) or not (value.head in EXPAND or (value.head == unit and unit in FLATTEN)):
+                    state = states[sp - 1] = gotos[states[sp - 2]]
+                    continue'''
+
+# A reduction of an empty production pushes a symbol without popping any
+_EMPTY_REDUCTION = '''            else:
+                if sp == size:
+                    states.extend([0] * size)
+                    values.extend([None] * size)
+                    size *= 2
+                value = action([])'''
+
+# Whether the symbol on top of the stack is an error, which is known from the state
+_ERROR_TOP = '''                if state in ERROR_STATES:
+                    lookahead = None
+                    continue'''
+
+
+class _DefaultRow(dict):
+    "The actions of a state that reduces without reading the next token: it reduces on any token"
+    def __init__(self, actions, reduction):
+        dict.__init__(self, actions)
+        self.reduction = reduction
+
+    def __missing__(self, ttype):
+        return self.reduction
+
+
+def generate_driver(tab, actions, units, tree_class, rules_to_flatten, rules_to_expand):
+    """Returns a function that parses the tokens returned by a function, with the tables in tab
+    (see engine_ply._parser_to_tab), and returns the value of the start rule, or None after
+    syntax errors that it couldn't recover from. It's called with the function, and a function
+    that is called with the token of each syntax error (None at the end of the input).
+
+    actions are the actions of the productions (see Engine_PLY.production_actions), and units
+    say which reductions the driver does itself (see _UNIT_REDUCTION), as their action would.
+    """
+    action_table, goto_table, productions = tab['action'], tab['goto'], tab['productions']
+
+    rows = []
+    for state in range(len(action_table)):
+        row = dict((ttype, act) for ttype, act in action_table[state].items() if act is not None)   # None is a nonassoc error
+        values = list(action_table[state].values())
+        if len(values) == 1 and values[0] is not None and values[0] < 0:
+            row = _DefaultRow(row, values[0])   # as yacc.LRParser.set_defaulted_states()
+        rows.append(row)
+
+    goto_columns = {}
+    for state, gotos in goto_table.items():
+        for name, target in gotos.items():
+            goto_columns.setdefault(name, {})[state] = target
+
+    reductions = [None] * len(productions)
+    for index, (_, name, length, _, _, _) in enumerate(productions):
+        if index:   # the first one is the accept, never reduced
+            reductions[-index] = (length, actions[index], goto_columns.get(name, {}), units[index])
+
+    source = _DRIVER_TEMPLATE % {
+        'unit_reduction': _UNIT_REDUCTION if any(r and r[3] for r in reductions) else '',
+        'empty_reduction': _EMPTY_REDUCTION if any(p[2] == 0 for p in productions[1:]) else '',
+        'error_top': _ERROR_TOP if any('error' in row for row in rows) else '',
+    }
+    namespace = {
+        'ROWS': rows,
+        'REDUCTIONS': reductions,
+        'ERROR_STATES': frozenset(row['error'] for row in rows if row.get('error', 0) > 0),
+        'TREE_CLASS': tree_class,
+        'FLATTEN': rules_to_flatten,
+        'EXPAND': rules_to_expand,
+        'ERROR_COUNT': yacc.error_count,
+        'STACK_SIZE': STACK_SIZE,
+        'END': _end_symbol(),
+        'yacc': yacc,
+    }
+    exec(compile(source, '<lalr_fast driver>', 'exec'), namespace)
+    return namespace['parse']
+
+def _end_symbol():
+    end = yacc.YaccSymbol()
+    end.type = '$end'
+    return end
+
+
+class Engine_LALR_Fast(Engine_PLY):
+    """Parses with a loop generated for the grammar (see generate_driver), instead of yacc.LRParser.
+    The tables are Engine_PLY's, so they can't be compact (see GrammarOptions)."""
+
+    def __init__(self, options, rules_to_flatten, rules_to_expand):
+        Engine_PLY.__init__(self, options, rules_to_flatten, rules_to_expand)
+        self.driver = None
+
+    def build_parser(self, cache_file):
+        Engine_PLY.build_parser(self, cache_file)
+        self._generate_driver()
+
+    @classmethod
+    def deserialize(cls, data, options, rules_to_flatten, rules_to_expand):
+        self = super(Engine_LALR_Fast, cls).deserialize(data, options, rules_to_flatten, rules_to_expand)
+        if self.parser:
+            self._generate_driver()
+        return self
+
+    def _generate_driver(self):
+        assert not isinstance(self.parser, CompactLRParser)
+        tab = _parser_to_tab(self.parser)
+        productions = [(p[0], p[3]) for p in tab['productions']]
+        self.driver = generate_driver(tab, self.production_actions(productions), self._units(productions),
+                                      self.options.tree_class, self.rules_to_flatten, self.rules_to_expand)
+
+    def _units(self, productions):
+        "Returns the unit of each production, for generate_driver"
+        kinds = value_kinds(self.rule_defs)
+        self_expanding = set(rule_name for rule_name, _, self_expand, helper in self.rule_defs if self_expand and helper is None)
+        units = [None]
+        for production, func in productions[1:]:
+            rule_name = func[len('p_'):]
+            symbols = _production_symbols(production)
+            unit = None
+            if len(symbols) == 1 and rule_name in self_expanding:
+                kind, = symbol_kinds(rule_name, symbols, kinds, self.rules_to_flatten, self.rules_to_expand)
+                unit = {'token': True, 'tree': True, 'splice': None, 'any': rule_name}[kind]
+            units.append(unit)
+        return units
+
+    def parse(self, text, start):
+        self.errors = []
+        self.lexer.input(text)
+        tree = self.driver(self._token_function(start), self.p_error)
+        if not tree:
+            self.errors.append(ErrorMsg(msg="Could not create parse tree!"))
+        if self.errors:
+            raise ParseError(self.errors)
+
+        return tree
@@ -1,7 +1,8 @@
-from .common import ParseError, ErrorMsg, TokValue
-from .strees import is_stree
+import copy
 
-from .engine_ply import Engine_PLY
+from .common import ParseError, ErrorMsg, TokValue, GrammarException
+
+from .engine_ply import Engine_PLY, helper_action, compile_action, value_kinds, symbol_kinds
 
 from . import pearley
 
@@ -28,63 +29,98 @@ class Engine_Pearley(object):
         self.lexer = None
         self.parser = None
         self.errors = None
+        self.conflicts = None   # there are no parse tables
 
         self.rules = []
+        self.rule_defs = []     # for serialize()
 
 
-    def add_rule(self, rule_name, rule_def, self_expand):
-        tree_class = self.options.tree_class
-        auto_filter_tokens = self.options.auto_filter_tokens
-        def _handle_rule(match, index):
-            if rule_name == 'start' and is_stree(match):
-                    return match
-
-            subtree = []
-            for child in match:
-                if isinstance(child, tree_class) and (
-                           (                            child.head in self.rules_to_expand )
-                        or (child.head == rule_name and child.head in self.rules_to_flatten)
-                        ):
-                    # (EXPAND | FLATTEN) & mods -> here to keep tree-depth minimal, prevents unbounded tree-depth on
-                    #                              recursive rules.
-                    #           EXPAND1  & mods -> perform necessary expansions on children first to ensure we don't end
-                    #                              up expanding inside our parents if (after expansion) we have more
-                    #                              than one child.
-                    subtree.extend(child.tail)
-                else:
-                    subtree.append(child)
-
-            # Apply auto-filtering (remove 'punctuation' tokens)
-            if auto_filter_tokens and len(subtree) != 1:
-                subtree = list(filter(is_stree, subtree))
-
-            if len(subtree) == 1 and self_expand:
-                # Self-expansion: only perform on EXPAND and EXPAND1 rules
-                return subtree[0]
-            else:
-                return tree_class(rule_name, subtree, skip_adjustments=True)
-
+    def add_rule(self, rule_name, rule_def, self_expand, helper=None):
+        self.rule_defs.append((rule_name, rule_def, self_expand, helper))
+        if helper is not None:
+            action = helper_action(helper, rule_name, self.options.tree_class, self.rules_to_expand)
+            def _handle_rule(match, index):
+                try:
+                    return action(match)
+                except ParseError:
+                    raise pearley.AbortParseMatch()     # just this derivation fails
+        else:
+            _handle_rule = None     # compiled for each alternative by build_parser, when all the rules are known
 
         for option in rule_def:
             symbols = [{'literal': x} if x.isupper() else x for x in option]
             rule = {"name": rule_name, "symbols": symbols, "postprocess": _handle_rule}
             self.rules.append(rule)
 
+    def _compile_actions(self):
+        "Sets the postprocess of the alternatives of the rules (other than the helpers), see compile_action"
+        kinds = value_kinds(self.rule_defs)
+        self_expanding = dict((rule_name, self_expand) for rule_name, _, self_expand, _ in self.rule_defs)
+        for rule in self.rules:
+            if rule['postprocess'] is None:
+                rule_name = rule['name']
+                symbols = [x['literal'] if isinstance(x, dict) else x for x in rule['symbols']]
+                action = compile_action(rule_name, symbol_kinds(rule_name, symbols, kinds, self.rules_to_flatten, self.rules_to_expand),
+                                        self_expanding[rule_name], self.options.tree_class, self.options.auto_filter_tokens,
+                                        self.rules_to_flatten, self.rules_to_expand)
+                rule['postprocess'] = _postprocess(action)
+
+    def add_precedence(self, assoc, tokens):
+        raise GrammarException("Precedence declarations (%%%s) are only supported by the ply engine" % assoc)
+
     def add_token(self, name, value):
         self.engine_ply.add_token(name, value)
 
     def add_token_unless(self, name, value, unless_toks_dict, unless_toks_regexps):
         self.engine_ply.add_token_unless(name, value, unless_toks_dict, unless_toks_regexps)
 
-    def build_lexer(self):
-        self.engine_ply.build_lexer()
+    def build_lexer(self, cache_file):
+        self.engine_ply.build_lexer(cache_file)
         self.lexer = self.engine_ply.lexer
 
     def build_parser(self, cache_file):
-        self.parser = pearley.Parser(self.rules, 'start')
-
-    def parse(self, text):
-        self.build_parser('bla')
+        self.parser = self._new_parser(self.options.start[0])
+
+    def _new_parser(self, start):
+        "Returns a parser that starts with the rule given (a parser only parses once)"
+        if any(rule['postprocess'] is None for rule in self.rules):
+            self._compile_actions()
+        return pearley.Parser(self.rules, start)
+
+    def table_sizes(self):
+        sizes = self.engine_ply.table_sizes()
+        sizes['rules'] = len(self.rules)
+        return sizes
+
+    # -- Serialization --
+    # There are no parse tables; the rules are replayed, and the lexer is restored by Engine_PLY
+
+    def serialize(self):
+        return {
+            'rules': self.rule_defs,
+            'lexer': self.engine_ply.serialize(),
+        }
+
+    @classmethod
+    def deserialize(cls, data, options, rules_to_flatten, rules_to_expand):
+        self = cls(options, rules_to_flatten, rules_to_expand)
+        self.engine_ply = Engine_PLY.deserialize(data['lexer'], options, rules_to_flatten, rules_to_expand)
+        self.lexer = self.engine_ply.lexer
+        for rule in data['rules']:
+            self.add_rule(*rule)
+        return self
+
+    def copy(self, lexer):
+        "Returns an engine that shares the rules, with its own lexer (it makes its parser for each parse)"
+        other = copy.copy(self)
+        other.engine_ply = self.engine_ply.copy(lexer)
+        other.lexer = lexer
+        other.parser = None
+        other.errors = None
+        return other
+
+    def parse(self, text, start):
+        self.parser = self._new_parser(start)
         self.errors = []
         self.lexer.input(text)
         tokens = []
@@ -110,3 +146,8 @@ class Engine_Pearley(object):
         return tree
 
 
+def _postprocess(action):
+    "Returns a postprocess function for pearley, which calls the action with the children"
+    def postprocess(match, index):
+        return action(match)
+    return postprocess
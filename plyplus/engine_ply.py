@@ -1,21 +1,30 @@
 import re
+import os
+import sys
+import copy
 import types
 import logging
 
 from ply import lex, yacc
 
 from .common import *
-from .strees import is_stree
-from . import PLYPLUS_DIR
+from .strees import is_stree, STree
+from . import PLYPLUS_DIR, cache, lalr
+from .compact_tables import CompactTables, CompactLRParser
 
 grammar_logger = logging.getLogger('Grammar')
 grammar_logger.setLevel(logging.ERROR)
 
+# With several start rules, the parser starts with this rule: the marker token of one of them, then it
+START_RULE = '__start'
+START_MARKER = '__START_%d'
+
 class Engine_PLY_Callback(object):
     start = "start"
 
     def __init__(self):
         self.tokens = []
+        self.precedence = []
 
     @staticmethod
     def t_error(t):
@@ -23,6 +32,21 @@ class Engine_PLY_Callback(object):
 
     p_error = NotImplemented
 
+class ConflictLog(object):
+    """A debug log for yacc, which keeps the conflicts it reports (it only reports them in debug mode),
+    and passes everything on to another log"""
+    def __init__(self, log):
+        self.log = log
+        self.conflicts = []
+
+    def warning(self, msg, *args, **kwargs):
+        if msg.startswith(('shift/reduce conflict', 'reduce/reduce conflict')):
+            self.conflicts.append(msg % args)
+        self.log.warning(msg, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.log, name)
+
 class Engine_PLY(object):
     def __init__(self, options, rules_to_flatten, rules_to_expand):
         self.rules_to_flatten = rules_to_flatten
@@ -33,48 +57,50 @@ class Engine_PLY(object):
         self.callback.p_error = self.p_error
 
         self.lexer = None
+        self.lextab = None
         self.parser = None
         self.errors = None
+        self.conflicts = None   # known if the tables were generated with the profile option
+
+        # Everything we were given, in order, so that serialize() can replay it
+        self.rule_defs = []
+        self.token_defs = []
+        self.actions = {}   # rule name -> its action, called with the values of the children
 
-    def add_rule(self, rule_name, rule_def, self_expand):
+    def add_rule(self, rule_name, rule_def, self_expand, helper=None):
+        self.rule_defs.append((rule_name, rule_def, self_expand, helper))
         rule_def = '%s\t: %s'%(rule_name, '\n\t| '.join(map(' '.join, rule_def)))
         tree_class = self.options.tree_class
-        auto_filter_tokens = self.options.auto_filter_tokens
-
-        def p_rule(_, p):
-            subtree = []
-            for child in p.__getslice__(1, None):
-                if isinstance(child, tree_class) and (
-                           (                            child.head in self.rules_to_expand )
-                        or (child.head == rule_name and child.head in self.rules_to_flatten)
-                        ):
-                    # (EXPAND | FLATTEN) & mods -> here to keep tree-depth minimal, prevents unbounded tree-depth on
-                    #                              recursive rules.
-                    #           EXPAND1  & mods -> perform necessary expansions on children first to ensure we don't end
-                    #                              up expanding inside our parents if (after expansion) we have more
-                    #                              than one child.
-                    subtree.extend(child.tail)
-                else:
-                    subtree.append(child)
-
-            # Apply auto-filtering (remove 'punctuation' tokens)
-            if auto_filter_tokens and len(subtree) != 1:
-                subtree = list(filter(is_stree, subtree))
-
-            if len(subtree) == 1 and self_expand:
-                # Self-expansion: only perform on EXPAND and EXPAND1 rules
-                p[0] = subtree[0]
-            else:
-                p[0] = tree_class(rule_name, subtree, skip_adjustments=True)
+
+        if helper is None:
+            action = rule_action(rule_name, self_expand, tree_class, self.options.auto_filter_tokens, self.rules_to_flatten, self.rules_to_expand)
+            def p_rule(_, p):
+                p[0] = action(p.__getslice__(1, None))
+        else:
+            action = helper_action(helper, rule_name, tree_class, self.rules_to_expand)
+            def p_helper_rule(_, p):    # yacc warns about functions defined twice under the same name
+                p[0] = action(p.__getslice__(1, None))
+            p_rule = p_helper_rule
+        self.actions[rule_name] = action
+
         p_rule.__doc__ = rule_def
         setattr(self.callback, 'p_%s' % (rule_name,), types.MethodType(p_rule, self))
 
+    def add_precedence(self, assoc, tokens):
+        "Adds a level of precedence, above the previous ones. assoc is 'left', 'right' or 'nonassoc'"
+        self.callback.precedence.append(tuple([assoc] + list(tokens)))
+
     def add_token(self, name, value):
+        self.token_defs.append((name, value, None))
+        self._set_token(name, value)
+
+    def _set_token(self, name, value):
         self.callback.tokens.append(name)
         setattr(self.callback, 't_%s'%name, value)
 
 
     def add_token_unless(self, name, value, unless_toks_dict, unless_toks_regexps):
+        self.token_defs.append((name, value, (unless_toks_dict, [(r.pattern, n) for r, n in unless_toks_regexps])))
         def t_token(t):
             if t.value in unless_toks_dict:
                 t.type = unless_toks_dict[t.value]
@@ -87,18 +113,176 @@ class Engine_PLY(object):
             return t
         t_token.__doc__ = value
 
-        self.add_token(name, t_token)
+        self._set_token(name, t_token)
 
 
-    def build_lexer(self):
-        self.lexer = lex.lex(module=self.callback, reflags=re.UNICODE)
+    def build_lexer(self, cache_file):
+        def build():
+            self.lexer = lex.lex(module=self.callback, reflags=re.UNICODE)
+            return _lexer_to_tab(self.lexer)
+        self.lextab = cache.get(cache_file + '.lextab', build)
+        if self.lexer is None:
+            # Skips validating the token regexps, and building the master regexp
+            self.lexer = _lexer_from_tab(self.lextab, self._callbacks())
+
+    def _add_start_rule(self):
+        "Sets the rule that the parser starts with: the start rule, or START_RULE when there are several"
+        starts = self.options.start
+        if len(starts) == 1:
+            self.callback.start = starts[0]
+            return
+        markers = [START_MARKER % i for i in range(len(starts))]
+        self.callback.tokens += markers     # never lexed: parse() gives the parser the one of its start rule
+        self.callback.start = START_RULE
+        self.add_rule(START_RULE, [[marker, start] for marker, start in zip(markers, starts)], False, ('start',))
 
     def build_parser(self, cache_file):
-        self.parser = yacc.yacc(module=self.callback, debug=self.options.debug, tabmodule=cache_file, errorlog=grammar_logger, outputdir=PLYPLUS_DIR)
+        self._add_start_rule()
+        def build():
+            if self.options.lalr_builder == 'native' or self.options.lr_method == 'lr1':
+                tab, conflicts = lalr.build_tables(self._productions(), self.callback.tokens, self.callback.precedence, self.callback.start,
+                                                   method=self.options.lr_method)
+                if self.options.profile:
+                    self.conflicts = conflicts
+            elif self.options.profile:
+                debugfile = open(os.path.join(PLYPLUS_DIR, yacc.debug_file), 'w') if self.options.debug else None
+                try:
+                    debuglog = ConflictLog(yacc.PlyLogger(debugfile) if debugfile else yacc.NullLogger())
+                    tab = _parser_to_tab(yacc.yacc(module=self.callback, debug=True, debuglog=debuglog, tabmodule=cache_file, write_tables=False, errorlog=grammar_logger, outputdir=PLYPLUS_DIR))
+                finally:
+                    if debugfile is not None:
+                        debugfile.close()
+                self.conflicts = debuglog.conflicts
+            else:
+                tab = _parser_to_tab(yacc.yacc(module=self.callback, debug=self.options.debug, tabmodule=cache_file, write_tables=False, errorlog=grammar_logger, outputdir=PLYPLUS_DIR))
+            return CompactTables(tab) if self.options.compact_tables else tab
+        self.parser = _parser_from_tab(cache.get(cache_file + '.parsetab', build), self._callbacks())
+        self._bind_actions()
+
+    def table_sizes(self):
+        "Returns the number of tokens, and the size of the parse tables (if built), including the memory they take"
+        markers = len(self.options.start) if self.parser and len(self.options.start) > 1 else 0    # see _add_start_rule
+        sizes = {'tokens': len(self.callback.tokens) - markers}
+        if isinstance(self.parser, CompactLRParser):
+            sizes.update(self.parser.tables.counts)
+            sizes['table bytes'] = self.parser.tables.nbytes()
+        elif self.parser:
+            sizes['states'] = len(self.parser.action)
+            sizes['actions'] = sum(len(actions) for actions in self.parser.action.values())
+            sizes['gotos'] = sum(len(gotos) for gotos in self.parser.goto.values())
+            sizes['productions'] = len(self.parser.productions)
+            sizes['table bytes'] = _tables_nbytes(self.parser.action, self.parser.goto)
+        if self.conflicts is not None:
+            sizes['conflicts'] = len(self.conflicts)
+        return sizes
+
+    def _productions(self):
+        """Returns the productions of the p_ functions, as yacc reads them: ordered by the line where the
+        function is defined, then by its name. The line of a production is that of its docstring line."""
+        functions = []
+        for name in dir(self.callback):
+            if name.startswith('p_') and name != 'p_error':
+                function = getattr(self.callback, name)
+                functions.append((function.__code__.co_firstlineno, name, function.__doc__))
+        functions.sort()
+
+        productions = []
+        for line, name, doc in functions:
+            for _, dline, prodname, syms in yacc.parse_grammar(doc, '', line):
+                productions.append((prodname, syms, name, dline))
+        return productions
+
+    def production_actions(self, productions):
+        """Returns the action of each production, given as (str, func) as in the parse tables: compiled for
+        the production (see compile_action), or its rule's for the helpers. The first one, the accept, has none."""
+        kinds = value_kinds(self.rule_defs)
+        rules = dict((rule_name, (self_expand, helper)) for rule_name, _, self_expand, helper in self.rule_defs)
+        actions = [None]
+        for production, func in productions[1:]:
+            rule_name = func[len('p_'):]
+            self_expand, helper = rules[rule_name]
+            if helper is None:
+                symbols = symbol_kinds(rule_name, _production_symbols(production), kinds, self.rules_to_flatten, self.rules_to_expand)
+                actions.append(compile_action(rule_name, symbols, self_expand, self.options.tree_class,
+                                              self.options.auto_filter_tokens, self.rules_to_flatten, self.rules_to_expand))
+            else:
+                actions.append(self.actions[rule_name])
+        return actions
+
+    def _bind_actions(self):
+        "Has the parser call the action of each production, rather than the p_ function of its rule"
+        productions = self.parser.productions
+        actions = self.production_actions([(p.str, p.func) for p in productions])
+        for production, action in zip(productions[1:], actions[1:]):
+            production.callable = _yacc_callable(action)
+
+    def copy(self, lexer):
+        "Returns an engine that shares the tables and the actions, with its own lexer, and its own parse state"
+        other = copy.copy(self)
+        other.lexer = lexer
+        other.errors = None
+        if self.parser:
+            other.parser = copy.copy(self.parser)   # the parser keeps its stacks while parsing
+            other.parser.errorfunc = other.p_error
+        return other
+
+    def _callbacks(self):
+        return dict((name, getattr(self.callback, name)) for name in dir(self.callback))
+
+    # -- Serialization --
+    # The built lexer and parser are saved as plain data (the same information PLY
+    # writes into its lextab and parsetab modules), so they can be restored without
+    # validating the token regexps or generating the LALR tables again.
+
+    def serialize(self):
+        return {
+            'tokens': self.token_defs,
+            'rules': self.rule_defs,
+            'lexer': self.lextab,
+            'parser': _serialize_tab(_parser_to_tab(self.parser)) if self.parser else None,
+        }
+
+    @classmethod
+    def deserialize(cls, data, options, rules_to_flatten, rules_to_expand):
+        self = cls(options, rules_to_flatten, rules_to_expand)
+
+        for name, value, unless in data['tokens']:
+            if unless:
+                unless_toks_dict, unless_toks_regexps = unless
+                self.add_token_unless(name, value, unless_toks_dict, [(re.compile(r), n) for r, n in unless_toks_regexps])
+            else:
+                self.add_token(name, value)
+        for rule in data['rules']:
+            if rule[0] != START_RULE:
+                self.add_rule(*rule)
+        if data['parser']:
+            self._add_start_rule()
 
-    def parse(self, text):
+        callbacks = self._callbacks()
+        self.lextab = data['lexer']
+        self.lexer = _lexer_from_tab(self.lextab, callbacks)
+        if data['parser']:
+            self.parser = _parser_from_tab(_deserialize_tab(data['parser']), callbacks)
+            self._bind_actions()
+        return self
+
+    def _token_function(self, start):
+        "Returns the function that the parser gets the tokens from: the lexer's, after the marker of the start rule if there are several"
+        if len(self.options.start) == 1:
+            return self.lexer.token
+        marker = lex.LexToken()
+        marker.type = START_MARKER % self.options.start.index(start)
+        marker.value = None
+        marker.lineno = marker.lexpos = 0
+        markers = [marker]
+        lexer_token = self.lexer.token
+        def token():
+            return markers.pop() if markers else lexer_token()
+        return token
+
+    def parse(self, text, start):
         self.errors = []
-        tree = self.parser.parse(text, lexer=self.lexer, debug=self.options.debug)
+        tree = self.parser.parse(text, lexer=self.lexer, debug=self.options.debug, tokenfunc=self._token_function(start))
         if not tree:
             self.errors.append(ErrorMsg(msg="Could not create parse tree!"))
         if self.errors:
@@ -122,3 +306,281 @@ class Engine_PLY(object):
 
         self.errors.append(err)
 
+
+
+def rule_action(rule_name, self_expand, tree_class, auto_filter_tokens, rules_to_flatten, rules_to_expand):
+    """Returns the action of a rule: it's called with the children of the rule, and returns its value
+    (a tree, or its only child if the rule is self-expanding)"""
+    def action(children):
+        subtree = []
+        for child in children:
+            if isinstance(child, tree_class) and (
+                       (                            child.head in rules_to_expand )
+                    or (child.head == rule_name and child.head in rules_to_flatten)
+                    ):
+                # (EXPAND | FLATTEN) & mods -> here to keep tree-depth minimal, prevents unbounded tree-depth on
+                #                              recursive rules.
+                #           EXPAND1  & mods -> perform necessary expansions on children first to ensure we don't end
+                #                              up expanding inside our parents if (after expansion) we have more
+                #                              than one child.
+                subtree.extend(child.tail)
+            else:
+                subtree.append(child)
+
+        # Apply auto-filtering (remove 'punctuation' tokens)
+        if auto_filter_tokens and len(subtree) != 1:
+            subtree = list(filter(is_stree, subtree))
+
+        if len(subtree) == 1 and self_expand:
+            # Self-expansion: only perform on EXPAND and EXPAND1 rules
+            return subtree[0]
+        return tree_class(rule_name, subtree, skip_adjustments=True)
+
+    return action
+
+def value_kinds(rule_defs):
+    """Returns what the value of each rule is, by name (for the rules given to add_rule): 'tree' when it's
+    always a tree of the rule (for the rules that don't self-expand, and the helpers that make trees),
+    and 'any' for the others"""
+    kinds = {}
+    for rule_name, _, self_expand, helper in rule_defs:
+        if helper is None:
+            kinds[rule_name] = 'any' if self_expand else 'tree'
+        else:
+            kinds[rule_name] = 'tree' if helper[0] in ('splice', 'check') else 'any'
+    return kinds
+
+def symbol_kinds(rule_name, symbols, value_kinds, rules_to_flatten, rules_to_expand):
+    """Returns what each child of a production of the rule is, as known when building: a 'token', a
+    'tree' that is kept, a tree to 'splice' (expanded, or flattened into the rule), or 'any' value
+    (of a self-expanding rule), which the action has to test"""
+    kinds = []
+    for symbol in symbols:
+        kind = value_kinds.get(symbol, 'token')
+        if kind == 'tree' and (symbol in rules_to_expand or (symbol == rule_name and symbol in rules_to_flatten)):
+            kind = 'splice'
+        kinds.append(kind)
+    return kinds
+
+_action_makers = {}     # shape -> the function that makes actions of that shape (see compile_action)
+
+def compile_action(rule_name, kinds, self_expand, tree_class, auto_filter_tokens, rules_to_flatten, rules_to_expand):
+    """Returns the action of a production of a rule, whose children are of the given kinds (see symbol_kinds).
+    It returns what rule_action's does, but only tests the children of kind 'any': the tokens and the
+    trees are kept, dropped or spliced as known when building, and so is whether to filter the tokens
+    and to self-expand, when the number of children is known.
+
+    The code of the action is generated for its shape, so the productions of the same shape share it.
+    """
+    shape = (tuple(kinds), bool(self_expand), bool(auto_filter_tokens), issubclass(tree_class, STree), rule_name in rules_to_flatten)
+    if shape not in _action_makers:
+        namespace = {'is_stree': is_stree}
+        exec(compile(_action_source(*shape), '<action %s>' % ' '.join(kinds), 'exec'), namespace)
+        _action_makers[shape] = namespace['make_action']
+    return _action_makers[shape](rule_name, tree_class, rules_to_expand)
+
+def _action_source(kinds, self_expand, auto_filter_tokens, trees_are_strees, flattened):
+    "Returns the code of make_action(rule_name, tree_class, rules_to_expand), for compile_action"
+    children = ['c%d' % i for i in range(len(kinds))]
+    known = kinds.count('token') + kinds.count('tree')
+    if not auto_filter_tokens or (known == len(kinds) and known == 1):
+        filtering = 'never'
+    elif known >= 2 or known == len(kinds):
+        filtering = 'always'    # so the tokens are dropped, and the trees kept, as they're added
+    else:
+        filtering = 'if not one'
+
+    added = []      # the children added before the first one of unknown length
+    lines = []
+    for child, kind in zip(children, kinds):
+        if kind in ('token', 'tree'):
+            if filtering == 'always' and (kind == 'token' or not trees_are_strees):
+                continue
+            if lines:
+                lines.append('subtree.append(%s)' % child)
+            else:
+                added.append(child)
+            continue
+
+        test = '%s.head in rules_to_expand' % child
+        if flattened:
+            test += ' or %s.head == rule_name' % child
+        if len(kinds) == 1 and kind == 'any':
+            # The most common case: return the only child, unless it's expanded
+            lines += ['if not (isinstance(%s, tree_class) and (%s)):' % (child, test),
+                      '    return %s' % (child if self_expand else 'tree_class(rule_name, [%s], skip_adjustments=True)' % child),
+                      'subtree = list(%s.tail)' % child]
+            continue
+
+        if not lines:
+            lines.append('subtree = [%s]' % ', '.join(added))
+        tail = 'filter(is_stree, %s.tail)' % child if filtering == 'always' else '%s.tail' % child
+        if kind == 'splice':
+            lines.append('subtree += %s' % tail)
+        else:
+            lines += ['if isinstance(%s, tree_class) and (%s):' % (child, test),
+                      '    subtree += %s' % tail,
+                      'elif is_stree(%s):' % child if filtering == 'always' else 'else:',
+                      '    subtree.append(%s)' % child]
+
+    if not lines:
+        # Every child is known
+        if self_expand and len(added) == 1:
+            lines.append('return %s' % added[0])
+        else:
+            lines.append('return tree_class(rule_name, [%s], skip_adjustments=True)' % ', '.join(added))
+    else:
+        if filtering == 'if not one':
+            lines += ['if len(subtree) != 1:',
+                      '    subtree = list(filter(is_stree, subtree))']
+        if self_expand:
+            lines += ['if len(subtree) == 1:',
+                      '    return subtree[0]']
+        lines.append('return tree_class(rule_name, subtree, skip_adjustments=True)')
+
+    if children:
+        lines.insert(0, '%s = children' % (', '.join(children) if len(children) > 1 else children[0] + ','))
+    return '\n'.join(['def make_action(rule_name, tree_class, rules_to_expand):',
+                      '    def action(children):']
+                     + ['        ' + line for line in lines]
+                     + ['    return action'])
+
+def helper_action(helper, rule_name, tree_class, rules_to_expand):
+    """Returns the action of a helper rule added by ExpandOper_Visitor
+    (of a long permutation, see _perm_rule_list, or of an optional part in 'factored' mode, see _factor_optional),
+    or of START_RULE
+
+    The action is called with the children of the rule, and returns its value.
+    Raises ParseError when a permutation has a member too many or too few times.
+    """
+    def expand(children):
+        subtree = []
+        for child in children:
+            if isinstance(child, tree_class) and child.head in rules_to_expand:
+                subtree.extend(child.tail)
+            else:
+                subtree.append(child)
+        return subtree
+
+    kind = helper[0]
+    if kind == 'splice':
+        # Neither filtered nor self-expanded: the children are left to the rule that expands it
+        def action(children):
+            return tree_class(rule_name, expand(children), skip_adjustments=True)
+    elif kind == 'member':
+        index = helper[1]
+        def action(children):
+            return [index], expand(children)
+    elif kind == 'list':
+        # The values are never modified, since (with pearley) they may be shared by other derivations
+        def action(children):
+            if len(children) == 1:
+                return children[0]
+            (indices, subtree), (member_indices, member_subtree) = children[0], children[-1]
+            return indices + member_indices, subtree + expand(children[1:-1]) + member_subtree
+    elif kind == 'check':
+        members = helper[1]
+        def action(children):
+            (indices, subtree), = children
+            for index, (member, optional) in enumerate(members):
+                count = indices.count(index)
+                if count > 1:
+                    raise ParseError([ErrorMsg(msg="Permutation member '%s' appears %d times" % (member, count))])
+                if count == 0 and not optional:
+                    raise ParseError([ErrorMsg(msg="Permutation member '%s' is missing" % member)])
+            return tree_class(rule_name, subtree, skip_adjustments=True)
+    elif kind == 'start':
+        # The marker of the start rule that the parse started with, then the rule (see Engine_PLY._add_start_rule)
+        def action(children):
+            return children[1]
+    else:
+        assert False, helper
+
+    return action
+
+
+def _production_symbols(production):
+    "Returns the symbols of a production, from its str in yacc's tables ('rule -> a B c', or 'rule -> <empty>')"
+    symbols = production.split()[2:]
+    return [] if symbols == ['<empty>'] else symbols
+
+def _yacc_callable(action):
+    def p_production(p):
+        p[0] = action(p.__getslice__(1, None))
+    return p_production
+
+
+def _lexer_to_tab(lexer):
+    statere = {}
+    for state, lexre in lexer.lexstatere.items():
+        statere[state] = [(retext, [(names[i], f[1]) if f and f[0] else f for i, f in enumerate(funcs)])
+                          for (_, funcs), retext, names
+                          in zip(lexre, lexer.lexstateretext[state], lexer.lexstaterenames[state])]
+
+    return {
+        'tokens': sorted(lexer.lextokens),
+        'reflags': int(lexer.lexreflags),
+        'literals': lexer.lexliterals,
+        'stateinfo': lexer.lexstateinfo,
+        'statere': statere,
+        'stateignore': lexer.lexstateignore,
+        'stateerrorf': dict((state, f.__name__ if f else None) for state, f in lexer.lexstateerrorf.items()),
+        'stateeoff': dict((state, f.__name__ if f else None) for state, f in lexer.lexstateeoff.items()),
+    }
+
+def _lexer_from_tab(tab, callbacks):
+    # Lexer.readtab() only accepts a module, so we dress our table up as one
+    lextab = types.ModuleType('lextab')
+    lextab._tabversion = lex.__tabversion__
+    lextab._lextokens = set(tab['tokens'])
+    lextab._lexreflags = tab['reflags']
+    lextab._lexliterals = tab['literals']
+    lextab._lexstateinfo = tab['stateinfo']
+    lextab._lexstatere = tab['statere']
+    lextab._lexstateignore = tab['stateignore']
+    lextab._lexstateerrorf = tab['stateerrorf']
+    lextab._lexstateeoff = tab['stateeoff']
+
+    lexer = lex.Lexer()
+    lexer.readtab(lextab, callbacks)
+    return lexer
+
+def _parser_to_tab(parser):
+    if isinstance(parser, CompactLRParser):
+        return parser.tables
+    return {
+        'action': parser.action,
+        'goto': parser.goto,
+        'productions': [(p.str, p.name, p.len, p.func, None, None) for p in parser.productions],
+    }
+
+def _serialize_tab(tab):
+    if isinstance(tab, CompactTables):
+        return {'compact': tab.serialize()}
+    return tab
+
+def _deserialize_tab(data):
+    if 'compact' in data:
+        return CompactTables.deserialize(data['compact'])
+    return data
+
+def _parser_from_tab(tab, callbacks):
+    if isinstance(tab, CompactTables):
+        return CompactLRParser(tab, callbacks)
+    lr = yacc.LRTable()
+    lr.lr_method = 'LALR'
+    lr.lr_action = tab['action']
+    lr.lr_goto = tab['goto']
+    lr.lr_productions = [yacc.MiniProduction(*p) for p in tab['productions']]
+    lr.bind_callables(callbacks)
+    return yacc.LRParser(lr, callbacks['p_error'])
+
+def _tables_nbytes(action, goto):
+    "The memory taken by yacc's tables: the dicts, and the ints that aren't cached by Python"
+    size = 0
+    for table in (action, goto):
+        size += sys.getsizeof(table)
+        for row in table.values():
+            size += sys.getsizeof(row)
+            size += sum(sys.getsizeof(value) for value in row.values() if value is not None and not -5 <= value <= 256)
+    return size
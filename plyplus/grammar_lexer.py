@@ -1,5 +1,10 @@
+import os
+import threading
+
 from ply import lex
 
+from . import __version__
+
 LEX_TAB_MODULE = "plyplus_grammar_lextab"
 
 tokens = (
@@ -56,4 +61,31 @@ t_ignore = " \t\r"
 def t_error(t):
     raise Exception("Illegal character in grammar: %r in %r" % (t.value[0], t.value[:10] ))
 
-lexer = lex.lex(lextab=LEX_TAB_MODULE)
+_lexer = None
+_lexer_lock = threading.Lock()
+
+def get_lexer():
+    "Returns the lexer for the grammar language. It's built on first use, so importing plyplus stays cheap"
+    global _lexer
+    with _lexer_lock:
+        if _lexer is None:
+            _lexer = _build_lexer()
+    return _lexer
+
+def _build_lexer():
+    try:
+        from . import plyplus_grammar_lextab as lextab     # generated by bootstrap.py
+    except ImportError:
+        lextab = None
+    # PLY trusts the lextab blindly, so make sure it was written for this code
+    if lextab is not None and getattr(lextab, '_plyplus_version', None) == __version__ \
+                          and getattr(lextab, '_tabversion', None) == lex.__tabversion__:
+        return lex.lex(lextab=lextab, optimize=True)
+    return lex.lex()
+
+def write_lextab(outputdir):
+    "Writes the lexer tables into outputdir, as the module LEX_TAB_MODULE"
+    lex.lex().writetab(LEX_TAB_MODULE, outputdir)
+    with open(os.path.join(outputdir, LEX_TAB_MODULE + '.py'), 'a') as f:
+        f.write('_plyplus_version = %r\n' % __version__)
+
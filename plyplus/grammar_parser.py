@@ -1,15 +1,20 @@
 from __future__ import absolute_import
 
+import threading
+
 from ply import yacc
 
 from .strees import STree as S
+from .common import GrammarException
 
-from .grammar_lexer import tokens, lexer
+from .grammar_lexer import tokens, get_lexer
 from . import PLYPLUS_DIR
 
 DEBUG = False
 YACC_TAB_MODULE = "plyplus_grammar_parsetab"
 
+PRECEDENCE_OPTIONS = ('%left', '%right', '%nonassoc')
+
 
 def p_extgrammar(p):
     """extgrammar : grammar
@@ -80,17 +85,31 @@ def p_ruledef(p):
     p[0] = S('ruledef', [p[1], p[3]])
 
 def p_optiondef(p):
-    """optiondef : OPTION COLON REGEXP SEMICOLON
-                 | OPTION COLON TOKEN SEMICOLON
+    """optiondef : OPTION COLON optionvalues SEMICOLON
                  | OPTION COLON RULENAME SEMICOLON
                  | OPTION TOKEN COLON tokenvalue SEMICOLON
     """
     if len(p) == 6:
         assert p[1] == '%fragment'
         p[0] = S('fragmentdef', (p[2], p[4]))
+    elif p[1] in PRECEDENCE_OPTIONS:
+        # %left: '\+' '-';  (the later ones bind tighter)
+        p[0] = S('precedencedef', [p[1]] + (p[3] if isinstance(p[3], list) else [p[3]]))
+    elif isinstance(p[3], list):
+        if len(p[3]) != 1:
+            raise GrammarException("Option %s takes a single value" % p[1])
+        p[0] = S('optiondef', (p[1], p[3][0]))
     else:
         p[0] = S('optiondef', (p[1], p[3]))
 
+def p_optionvalues(p):
+    """optionvalues : REGEXP
+                    | TOKEN
+                    | REGEXP optionvalues
+                    | TOKEN optionvalues
+    """
+    p[0] = [p[1]] + (p[2] if len(p) > 2 else [])
+
 def p_rules_list(p):
     """rules_list   : production
                     | production OR rules_list"""
@@ -99,7 +118,13 @@ def p_rules_list(p):
 def p_production(p):
     """production : perm_rule
                   | rule
+                  | rule OPTION TOKEN
     """
+    if len(p) == 4:
+        # expr : '-' expr %prec UMINUS ;
+        if p[2] != '%prec':
+            raise GrammarException("Unknown rule option: %s" % p[2])
+        p[1].tail.append(S('prec', [p[3]]))
     p[0] = p[1]
 
 def p_perm_rule(p):
@@ -150,7 +175,25 @@ def p_error(p):
 start = "extgrammar"
 
 
-_parser = yacc.yacc(debug=DEBUG, tabmodule=YACC_TAB_MODULE, outputdir=PLYPLUS_DIR)     # Return parser object
+_parser = None
+_parser_lock = threading.Lock()
+
+def _get_parser():
+    # Built on first use, so importing plyplus stays cheap
+    global _parser
+    with _parser_lock:
+        if _parser is None:
+            # Uses the tables generated by bootstrap.py when their signature matches,
+            # and builds them in memory otherwise
+            _parser = yacc.yacc(debug=DEBUG, tabmodule=YACC_TAB_MODULE, write_tables=False, outputdir=PLYPLUS_DIR)
+    return _parser
+
+def write_parsetab(outputdir):
+    "Writes the parse tables into outputdir, as the module YACC_TAB_MODULE"
+    yacc.yacc(debug=False, tabmodule=YACC_TAB_MODULE, outputdir=outputdir)
+
 def parse(text, debug=False):
+    parser = _get_parser()
+    lexer = get_lexer()
     lexer.lineno = 1
-    return _parser.parse(text, lexer=lexer, debug=debug)
+    return parser.parse(text, lexer=lexer, debug=debug)
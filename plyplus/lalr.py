@@ -0,0 +1,622 @@
+"""A LALR(1) table generator, faster than the one of ply.yacc, that makes the same tables,
+and a LR(1) table generator (method='lr1').
+
+The lookaheads are computed with the algorithm of DeRemer and Pennello, as in yacc:
+
+    DeRemer, F. L., and T. J. Pennello: "Efficient Computation of LALR(1) Lookahead Sets",
+    ACM Transactions on Programming Languages and Systems, Vol. 4, No. 4, Oct. 1982, pp. 615-649
+
+yacc spends most of its time looking things up in lists, and comparing item sets by
+following chains of dicts. Here the items are numbers, item sets are keyed by the tuple
+of their kernel items, and the sets of terminals are bitsets (ints).
+
+The states are numbered in the same order as yacc numbers them, and the conflicts are
+resolved the same way (by precedence, then shifting, then reducing the production that
+was declared first), so the tables can be used by ply.yacc.LRParser, and cached as if
+yacc made them.
+
+LALR(1) merges the LR(1) states that have the same items (the same core), which may make
+reduce/reduce conflicts that LR(1) doesn't have: the lookaheads of one state are added to
+the other. The LR(1) generator only merges states when that changes nothing that either
+state does (see _LR1TableGenerator), which is what IELR(1) aims at too: the tables parse
+like canonical LR(1) tables, but are about the size of the LALR(1) tables.
+
+The conflicts are reported with an example: the shortest input that gets to the state of
+the conflict, then the token ('IF NAME COLON NAME . ELSE').
+"""
+
+from .common import GrammarException
+
+START = "S'"
+END = '$end'
+ERROR = 'error'
+
+MAXINT = float('inf')
+
+
+def build_tables(productions, tokens, precedence, start, method='lalr'):
+    """Returns the LALR(1) (or with method='lr1', the LR(1)) tables of a grammar, as a dict of the action
+    table, the goto table, and the productions (in the form that engine_ply._parser_from_tab reads),
+    and the list of conflicts.
+
+    productions - (name, symbols, func, line) for each production, numbered from 1 in that order.
+                  When two productions can be reduced, the one with the lowest line wins.
+    tokens - the names of the terminals
+    precedence - tuples of (assoc, terminal, ...), from the lowest level to the highest
+    start - the start symbol
+
+    Raises GrammarException if the grammar is invalid.
+    """
+    grammar = _Grammar(productions, tokens, precedence, start)
+    generator = {'lalr': _TableGenerator, 'lr1': _LR1TableGenerator}[method](grammar)
+    return generator.tables(), generator.conflicts
+
+
+class _Grammar(object):
+    def __init__(self, productions, tokens, precedence, start):
+        errors = []
+
+        self.terminals = list(tokens) + [ERROR]
+        self.terminal_index = dict((t, i) for i, t in enumerate(self.terminals))
+        self.terminal_index[END] = len(self.terminals)
+        self.terminals.append(END)
+
+        self.precedence = {}
+        for level, declaration in enumerate(precedence):
+            assoc = declaration[0]
+            for term in declaration[1:]:
+                self.precedence[term] = (assoc, level + 1)
+        used_precedence = set()
+
+        # Production 0 is S' -> start
+        self.names = [START]
+        self.symbols = [(start,)]
+        self.funcs = [None]
+        self.lines = [0]
+        self.precs = [('right', 0)]
+        self.prodnames = {}
+        seen = set()
+        for name, symbols, func, line in productions:
+            symbols = list(symbols)
+            if name in self.terminal_index:
+                errors.append('Illegal rule name %r. Already defined as a token' % name)
+            if '%prec' in symbols:
+                precname = symbols[-1]
+                if symbols[-2] != '%prec' or precname not in self.precedence:
+                    errors.append('Bad %%prec in rule %r: %s' % (name, ' '.join(symbols)))
+                used_precedence.add(precname)
+                del symbols[-2:]
+                prec = self.precedence.get(precname, ('right', 0))
+            else:
+                terminals = [s for s in symbols if s in self.terminal_index]
+                prec = self.precedence.get(terminals[-1], ('right', 0)) if terminals else ('right', 0)
+
+            symbols = tuple(symbols)
+            if (name, symbols) in seen:
+                errors.append('Duplicate rule %s -> %s' % (name, ' '.join(symbols)))
+            seen.add((name, symbols))
+
+            self.prodnames.setdefault(name, []).append(len(self.names))
+            self.names.append(name)
+            self.symbols.append(symbols)
+            self.funcs.append(func)
+            self.lines.append(line)
+            self.precs.append(prec)
+
+        self.start = start
+        if start not in self.prodnames:
+            errors.append('Start symbol %s undefined' % start)
+        for symbols in self.symbols:
+            for s in symbols:
+                if s not in self.prodnames and s not in self.terminal_index:
+                    errors.append('Symbol %r used, but not defined as a token or a rule' % s)
+        for term in self.precedence:
+            if term not in self.terminal_index and term not in used_precedence:
+                errors.append('Precedence rule %r defined for unknown symbol %r' % (self.precedence[term][0], term))
+        if not errors:
+            for name in self._infinite_cycles():
+                errors.append('Infinite recursion detected for symbol %r' % name)
+        if errors:
+            raise GrammarException('Unable to build parser:\n' + '\n'.join(sorted(set(errors))))
+
+        # The items, numbered: production p with the dot at position d is item base[p] + d
+        self.base = []
+        self.item_prod = []
+        self.item_dot = []
+        self.item_next = []     # the symbol after the dot, or None
+        for p, symbols in enumerate(self.symbols):
+            self.base.append(len(self.item_prod))
+            for dot in range(len(symbols) + 1):
+                self.item_prod.append(p)
+                self.item_dot.append(dot)
+                self.item_next.append(symbols[dot] if dot < len(symbols) else None)
+
+        # The symbols of each production, without repeats, in order (yacc creates the states in that order)
+        self.usyms = []
+        for symbols in self.symbols:
+            usyms = []
+            for s in symbols:
+                if s not in usyms:
+                    usyms.append(s)
+            self.usyms.append(usyms)
+
+    def _infinite_cycles(self):
+        terminates = set(self.terminal_index)
+        changed = True
+        while changed:
+            changed = False
+            for name, prods in self.prodnames.items():
+                if name in terminates:
+                    continue
+                for p in prods:
+                    if all(s in terminates for s in self.symbols[p]):
+                        terminates.add(name)
+                        changed = True
+                        break
+        return sorted(name for name in self.prodnames if name not in terminates)
+
+    def shortest_yields(self):
+        "Returns the shortest list of terminals that each nonterminal derives"
+        yields = {}
+        changed = True
+        while changed:
+            changed = False
+            for p in range(1, len(self.symbols)):
+                if all(s in yields or s in self.terminal_index for s in self.symbols[p]):
+                    tokens = []
+                    for s in self.symbols[p]:
+                        tokens += yields.get(s, [s])
+                    name = self.names[p]
+                    if name not in yields or len(tokens) < len(yields[name]):
+                        yields[name] = tokens
+                        changed = True
+        return yields
+
+    def nullable(self):
+        nullable = set()
+        changed = True
+        while changed:
+            changed = False
+            for p in range(1, len(self.symbols)):
+                if self.names[p] not in nullable and all(s in nullable for s in self.symbols[p]):
+                    nullable.add(self.names[p])
+                    changed = True
+        return nullable
+
+
+class _TableGenerator(object):
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.conflicts = []
+        self._paths = None      # the shortest way to each state, for the examples of the conflicts
+
+        self._make_states()
+        self._parse_table()
+
+    def _make_states(self):
+        """Makes the states (self.states, the items of each one), the transitions between them,
+        and the lookaheads of the reductions (self.lookaheads, by state and production)"""
+        self._lr0_items()
+        self._lalr_lookaheads()
+
+    def _closure(self, kernel):
+        g = self.grammar
+        items = list(kernel)
+        added = set()
+        for item in items:
+            symbol = g.item_next[item]
+            if symbol in g.prodnames and symbol not in added:
+                added.add(symbol)
+                items += [g.base[p] for p in g.prodnames[symbol]]
+        return items
+
+    def _lr0_items(self):
+        "Creates the LR(0) states, and the transitions between them"
+        g = self.grammar
+        self.states = [self._closure([g.base[0]])]
+        self.transitions = []
+        kernels = {}
+
+        for items in self.states:
+            goto_kernels = {}
+            for item in items:
+                symbol = g.item_next[item]
+                if symbol is not None:
+                    goto_kernels.setdefault(symbol, []).append(item + 1)
+
+            # In the order yacc finds them: it collects the symbols in a dict (so on Python 2, the order is arbitrary)
+            symbols = {}
+            for item in items:
+                for symbol in g.usyms[g.item_prod[item]]:
+                    symbols[symbol] = None
+            transitions = {}
+            for symbol in symbols:
+                if symbol in goto_kernels:
+                    kernel = tuple(goto_kernels[symbol])
+                    state = kernels.get(kernel)
+                    if state is None:
+                        state = kernels[kernel] = len(self.states)
+                        self.states.append(self._closure(kernel))
+                    transitions[symbol] = state
+            self.transitions.append(transitions)
+
+    def _lalr_lookaheads(self):
+        g = self.grammar
+        nullable = g.nullable()
+        bit = dict((t, 1 << i) for t, i in g.terminal_index.items())
+
+        ntrans = [(state, symbol) for state, transitions in enumerate(self.transitions)
+                                  for symbol in transitions if symbol in g.prodnames]
+        ntrans_set = set(ntrans)
+
+        # The terminals shifted, the nullable nonterminals read, and the items of each rule, in each state
+        shifts = []
+        reads = []
+        rule_items = []
+        for items in self.states:
+            terms = 0
+            nullables = []
+            by_rule = {}
+            for item in items:
+                by_rule.setdefault(g.names[g.item_prod[item]], []).append(item)
+                symbol = g.item_next[item]
+                if symbol in bit:
+                    terms |= bit[symbol]
+                elif symbol in nullable and symbol not in nullables:
+                    nullables.append(symbol)
+            shifts.append(terms)
+            reads.append(nullables)
+            rule_items.append(by_rule)
+
+        def direct_reads(trans):
+            state, symbol = trans
+            terms = shifts[self.transitions[state][symbol]]
+            if state == 0 and symbol == g.start:
+                terms |= bit[END]
+            return terms
+        def reads_relation(trans):
+            target = self.transitions[trans[0]][trans[1]]
+            return [(target, symbol) for symbol in reads[target]]
+        readsets = _digraph(ntrans, reads_relation, direct_reads)
+
+        # The lookback and includes relations, computed as yacc computes them
+        lookbacks = {}
+        includes = {}
+        for trans in ntrans:
+            state, name = trans
+            lookback = []
+            for item in rule_items[state][name]:
+                p = g.item_prod[item]
+                symbols = g.symbols[p]
+                dot = g.item_dot[item]
+                j = state
+                while dot < len(symbols):
+                    t = symbols[dot]
+                    dot += 1
+                    if (j, t) in ntrans_set and all(s in nullable for s in symbols[dot:]):
+                        includes.setdefault((j, t), []).append(trans)
+                    j = self.transitions[j][t]
+                if g.item_dot[item] == 0:
+                    lookback.append((j, p))
+            lookbacks[trans] = lookback
+
+        followsets = _digraph(ntrans, lambda trans: includes.get(trans, []), lambda trans: readsets[trans])
+
+        self.lookaheads = {}
+        for trans, lookback in lookbacks.items():
+            for state_prod in lookback:
+                self.lookaheads[state_prod] = self.lookaheads.get(state_prod, 0) | followsets.get(trans, 0)
+
+    def _parse_table(self):
+        g = self.grammar
+        self.action = {}
+        self.goto = {}
+        rr_reported = set()
+
+        for st, items in enumerate(self.states):
+            st_action = {}
+            st_actionp = {}
+            transitions = self.transitions[st]
+
+            for item in items:
+                p = g.item_prod[item]
+                a = g.item_next[item]
+                if a is None:
+                    if p == 0:
+                        st_action[END] = 0
+                        st_actionp[END] = p
+                        continue
+                    mask = self.lookaheads.get((st, p), 0)
+                    while mask:
+                        low = mask & -mask
+                        mask ^= low
+                        a = g.terminals[low.bit_length() - 1]
+                        r = st_action.get(a)
+                        if r is None:
+                            st_action[a] = -p
+                            st_actionp[a] = p
+                        elif r > 0:
+                            # Shift/reduce: shift, unless precedence says otherwise
+                            sprec, slevel = g.precedence.get(a, ('right', 0))
+                            rprec, rlevel = g.precs[p]
+                            if slevel < rlevel or (slevel == rlevel and rprec == 'left'):
+                                st_action[a] = -p
+                                st_actionp[a] = p
+                                if not slevel and not rlevel:
+                                    self._sr_conflict(st, a, 'reduce')
+                            elif slevel == rlevel and rprec == 'nonassoc':
+                                st_action[a] = None
+                            elif not rlevel:
+                                self._sr_conflict(st, a, 'shift')
+                        elif r < 0:
+                            # Reduce/reduce: the production declared first
+                            oldp = -r
+                            if g.lines[oldp] > g.lines[p]:
+                                st_action[a] = -p
+                                st_actionp[a] = p
+                                chosen, rejected = p, oldp
+                            else:
+                                chosen, rejected = oldp, p
+                            if (st, chosen, rejected) not in rr_reported:
+                                rr_reported.add((st, chosen, rejected))
+                                self.conflicts.append('reduce/reduce conflict in state %d resolved using rule (%s) (example: %s)'
+                                                      % (st, _production_str(g, chosen), self._example(st, a)))
+                elif a in g.terminal_index:
+                    j = transitions[a]
+                    r = st_action.get(a)
+                    if r is None:
+                        st_action[a] = j
+                        st_actionp[a] = p
+                    elif r < 0:
+                        sprec, slevel = g.precedence.get(a, ('right', 0))
+                        rprec, rlevel = g.precs[st_actionp[a]]
+                        if slevel > rlevel or (slevel == rlevel and rprec == 'right'):
+                            st_action[a] = j
+                            st_actionp[a] = p
+                            if not rlevel:
+                                self._sr_conflict(st, a, 'shift')
+                        elif slevel == rlevel and rprec == 'nonassoc':
+                            st_action[a] = None
+                        elif not slevel and not rlevel:
+                            self._sr_conflict(st, a, 'reduce')
+
+            self.action[st] = st_action
+            self.goto[st] = dict((symbol, target) for symbol, target in transitions.items() if symbol in g.prodnames)
+
+    def _sr_conflict(self, state, token, resolution):
+        self.conflicts.append('shift/reduce conflict for %s in state %d resolved as %s (example: %s)'
+                              % (token, state, resolution, self._example(state, token)))
+
+    def _example(self, state, token):
+        "Returns the shortest input that gets to the state, then the token"
+        if self._paths is None:
+            self._paths = {0: None}
+            queue = [0]
+            for st in queue:
+                for symbol, target in sorted(self.transitions[st].items()):
+                    if target not in self._paths:
+                        self._paths[target] = (st, symbol)
+                        queue.append(target)
+            self._yields = self.grammar.shortest_yields()
+
+        symbols = []
+        while self._paths[state]:
+            state, symbol = self._paths[state]
+            symbols.append(symbol)
+        tokens = []
+        for symbol in reversed(symbols):
+            tokens += self._yields.get(symbol, [symbol])
+        return ' '.join(tokens + ['.', token])
+
+    def tables(self):
+        g = self.grammar
+        return {
+            'action': self.action,
+            'goto': self.goto,
+            'productions': [(_production_str(g, p), g.names[p], len(g.symbols[p]), g.funcs[p], None, None)
+                            for p in range(len(g.symbols))],
+        }
+
+
+class _LR1TableGenerator(_TableGenerator):
+    """Makes LR(1) states, whose items have their own lookaheads, as canonical LR(1) does, except that
+    a new state is merged into one that has the same core, unless that changes what either of them
+    does on a token (see _compatible). So the merges make no conflicts, and change no resolution of
+    one, and the parser makes the same moves as with the canonical LR(1) tables (but may reduce
+    more before finding a syntax error).
+
+    Merging adds lookaheads to a state, and so to the states that follow it, which are made again;
+    the states that end up unreachable are dropped.
+    """
+    def _make_states(self):
+        g = self.grammar
+        self._first_rest()
+
+        kernels = []        # the kernel items of each state, sorted
+        kernel_las = []     # their lookaheads
+        by_core = {}
+        closures = []
+        transitions = []
+        queue = []
+        queued = []
+
+        def add(kernel, las):
+            for st in by_core.get(kernel, ()):
+                old = kernel_las[st]
+                if all(not (la & ~o) for la, o in zip(las, old)):
+                    return st
+                if self._compatible(kernel, old, las):
+                    kernel_las[st] = [la | o for la, o in zip(las, old)]
+                    if not queued[st]:
+                        queued[st] = True
+                        queue.append(st)
+                    return st
+            st = len(kernels)
+            kernels.append(kernel)
+            kernel_las.append(list(las))
+            by_core.setdefault(kernel, []).append(st)
+            closures.append(None)
+            transitions.append(None)
+            queued.append(True)
+            queue.append(st)
+            return st
+
+        add((g.base[0],), [1 << g.terminal_index[END]])
+        for st in queue:    # (the queue grows as we go)
+            queued[st] = False
+            items, la = closures[st] = self._closure1(kernels[st], kernel_las[st])
+            goto_kernels = {}
+            for item in items:
+                symbol = g.item_next[item]
+                if symbol is not None:
+                    goto_kernels.setdefault(symbol, []).append((item + 1, la[item]))
+            transitions[st] = {}
+            for symbol, kernel in sorted(goto_kernels.items()):
+                kernel.sort()
+                transitions[st][symbol] = add(tuple(item for item, _ in kernel), [la for _, la in kernel])
+
+        # Numbers the reachable states, from 0
+        order = [0]
+        number = {0: 0}
+        for st in order:
+            for symbol, target in sorted(transitions[st].items()):
+                if target not in number:
+                    number[target] = len(order)
+                    order.append(target)
+
+        self.states = []
+        self.transitions = []
+        self.lookaheads = {}
+        for st in order:
+            items, la = closures[st]
+            for item in items:
+                if g.item_next[item] is None:
+                    key = (len(self.states), g.item_prod[item])
+                    self.lookaheads[key] = self.lookaheads.get(key, 0) | la[item]
+            self.states.append(items)
+            self.transitions.append(dict((symbol, number[target]) for symbol, target in transitions[st].items()))
+
+    def _first_rest(self):
+        """For each item, the terminals that the symbols after the one after the dot can begin with (a bitset),
+        and whether they can be empty"""
+        g = self.grammar
+        nullable = g.nullable()
+        bit = dict((t, 1 << i) for t, i in g.terminal_index.items())
+
+        first = dict((name, 0) for name in g.prodnames)
+        changed = True
+        while changed:
+            changed = False
+            for p in range(1, len(g.symbols)):
+                terms = first[g.names[p]]
+                for s in g.symbols[p]:
+                    terms |= bit[s] if s in bit else first[s]
+                    if s not in nullable:
+                        break
+                if terms != first[g.names[p]]:
+                    first[g.names[p]] = terms
+                    changed = True
+
+        self.first_rest = {}
+        for p, symbols in enumerate(g.symbols):
+            terms, empty = 0, True
+            for dot in range(len(symbols) - 1, -1, -1):
+                self.first_rest[g.base[p] + dot] = (terms, empty)
+                s = symbols[dot]
+                if s in bit:
+                    terms, empty = bit[s], False
+                else:
+                    terms = first[s] | (terms if s in nullable else 0)
+                    empty = empty and s in nullable
+
+    def _closure1(self, kernel, lookaheads):
+        "Returns the items of the closure of the kernel, and the lookaheads of each item (by item)"
+        g = self.grammar
+        items = list(kernel)
+        la = dict(zip(kernel, lookaheads))
+        stack = list(kernel)
+        while stack:
+            item = stack.pop()
+            symbol = g.item_next[item]
+            if symbol in g.prodnames:
+                terms, empty = self.first_rest[item]
+                if empty:
+                    terms |= la[item]
+                for p in g.prodnames[symbol]:
+                    new = g.base[p]
+                    old = la.get(new)
+                    if old is None:
+                        la[new] = terms
+                        items.append(new)
+                        stack.append(new)
+                    elif terms & ~old:
+                        la[new] = old | terms
+                        stack.append(new)
+        return items, la
+
+    def _compatible(self, kernel, a, b):
+        """Whether the states of the kernel with the lookaheads a and b can be merged: on each token
+        where the merged state has more than one action (a conflict), each state has either no
+        action, or all of them"""
+        g = self.grammar
+        items, la_a = self._closure1(kernel, a)
+        la_b = self._closure1(kernel, b)[1]
+        shifts = 0
+        reductions = []
+        for item in items:
+            symbol = g.item_next[item]
+            if symbol is None:
+                reductions.append((g.item_prod[item], la_a[item], la_b[item]))
+            elif symbol in g.terminal_index:
+                shifts |= 1 << g.terminal_index[symbol]
+
+        terms = 0
+        for _, terms_a, terms_b in reductions:
+            terms |= terms_a | terms_b
+        while terms:
+            t = terms & -terms
+            terms ^= t
+            reduce_a = set(p for p, terms_a, _ in reductions if terms_a & t)
+            reduce_b = set(p for p, _, terms_b in reductions if terms_b & t)
+            merged = reduce_a | reduce_b
+            if len(merged) + bool(shifts & t) <= 1:
+                continue
+            for reduce in (reduce_a, reduce_b):
+                if (reduce or shifts & t) and reduce != merged:
+                    return False
+        return True
+
+
+def _production_str(grammar, p):
+    return '%s -> %s' % (grammar.names[p], ' '.join(grammar.symbols[p]) or '<empty>')
+
+def _digraph(X, R, FP):
+    """The digraph algorithm of DeRemer and Pennello: returns F(x) for each x in X, where F(x) is the union
+    of FP(x) and of F(y) for every y that x relates to (in R(x)). The sets are bitsets."""
+    N = dict.fromkeys(X, 0)
+    stack = []
+    F = {}
+
+    def traverse(x):
+        stack.append(x)
+        d = len(stack)
+        N[x] = d
+        F[x] = FP(x)
+        for y in R(x):
+            if N[y] == 0:
+                traverse(y)
+            N[x] = min(N[x], N[y])
+            F[x] |= F.get(y, 0)
+        if N[x] == d:
+            # x is the root of a strongly connected component, which all get the same set
+            while True:
+                element = stack.pop()
+                N[element] = MAXINT
+                F[element] = F[x]
+                if element == x:
+                    break
+
+    for x in X:
+        if N[x] == 0:
+            traverse(x)
+    return F
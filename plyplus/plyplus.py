@@ -4,24 +4,32 @@ from __future__ import absolute_import
 
 import re
 import os
+import copy
+import threading
 import itertools
 import logging
 import ast
-import hashlib
 import codecs
+from timeit import default_timer
+from contextlib import contextmanager
 try:
-    import cPickle as pickle
+    import tracemalloc
 except ImportError:
-    import pickle
+    tracemalloc = None  # Python 2: allocations aren't profiled
+try:
+    from re import _parser as sre_parse     # Python 3.11+
+except ImportError:
+    import sre_parse
 
-from . import __version__, PLYPLUS_DIR, grammar_parser
+from . import __version__, grammar_parser, cache, registry
 from .utils import StringTypes, list_join, StringType
 from .common import TokValue, GrammarException, ParseError
 
 from .strees import STree, SVisitor, STransformer, is_stree, SVisitor_Recurse
 
-from .engine_ply import Engine_PLY
+from .engine_ply import Engine_PLY, START_RULE
 from .engine_pearley import Engine_Pearley
+from .engine_lalr_fast import Engine_LALR_Fast
 
 # -- Must!
 #TODO: Support States
@@ -29,11 +37,9 @@ from .engine_pearley import Engine_Pearley
 #      alternatively (but not as good?): add option to expand all 'start' symbols
 
 # -- Nice to have
-#TODO: Operator precedence
 #TODO: find better terms than expand and flatten
 #TODO: Exact recovery of input (as text attr)
 #      Allow to reconstruct the input with whatever changes were made to the tree
-#TODO: Allow 'optimize' mode
 #TODO: Rule Self-recursion (an operator? a 'self' keyword?)
 #TODO: Add token history on parse error
 #TODO: Add rule history on parse error?
@@ -44,9 +50,7 @@ from .engine_pearley import Engine_Pearley
 #TODO: Complete EOF handling in python grammar (postlex)
 #TODO: Make filter behaviour consitent for both ()? and ()* / ()+
 #TODO: better filters
-#TODO: Offer mechanisms to easily avoid ambiguity (expr: expr '\+' expr etc.)
 #TODO: Use PLY's ignore mechanism (=tokens return None) instead of post-filtering it myself?
-#TODO: Support Compiling grammars into a single parser python file
 #TODO: Support running multi-threaded
 #TODO: Better debug mode (set debug level, choose between prints and interactive debugging?)
 
@@ -74,6 +78,8 @@ from .engine_pearley import Engine_Pearley
 #DONE: Change rule+ into "rule simp*" instead of "simp+"
 #DONE: Multi-line comments
 #DONE: Better error handling (choose between prints and raising exception, setting threshold, etc.)
+#DONE: Support Compiling grammars into a single parser python file (see standalone.py)
+#DONE: Allow 'optimize' mode (see inline_rules)
 #
 
 logging.basicConfig()
@@ -127,19 +133,39 @@ class ExtractSubgrammars_Visitor(SVisitor):
         self.parent_source_name = parent_source_name
         self.parent_tab_filename = parent_tab_filename
         self.parent_options = parent_options
+        self.subgrammar_options = _subgrammar_options(parent_options)
 
-        self.last_tok = None
+        self.names_used = set()
 
     def tokendef(self, tok):
-        self.last_tok = tok.tail[0]
-    def subgrammar(self, tree):
-        assert self.last_tok
+        # Children are visited first, so nested subgrammars are already built by now
+        if len(tok.tail) < 3 or tok.tail[2].head != 'subgrammar':
+            return
+        tree = tok.tail[2]
         assert len(tree.tail) == 1
-        source_name = '%s:%s' % (self.parent_source_name, self.last_tok.lower())
-        tab_filename = '%s_%s' % (self.parent_tab_filename, self.last_tok.lower())
-        subgrammar = _Grammar(tree.tail[0], source_name, tab_filename, self.parent_options)
+
+        # Each subgrammar needs its own name, since its tables are cached under it
+        name = tok.tail[0].lower()
+        i = 1
+        while name in self.names_used:
+            i += 1
+            name = '%s%d' % (tok.tail[0].lower(), i)
+        self.names_used.add(name)
+
+        source_name = '%s:%s' % (self.parent_source_name, name)
+        tab_filename = '%s_%s' % (self.parent_tab_filename, name)
+        subgrammar = self._create(tok.tail[0], tree.tail[0], source_name, tab_filename)
         tree.head, tree.tail = 'subgrammarobj', [subgrammar]
 
+    def _create(self, token_name, grammar_tree, source_name, tab_filename):
+        return _Grammar(grammar_tree, source_name, tab_filename, self.subgrammar_options)
+
+def _subgrammar_options(options):
+    "A subgrammar is built with the options of its grammar, but starts with its own start rule"
+    options = copy.copy(options)
+    options.start = ('start',)
+    return options
+
 class ApplySubgrammars_Visitor(SVisitor):
     def __init__(self, subgrammars):
         self.subgrammars = subgrammars
@@ -188,6 +214,159 @@ def simplify_tokendefs(tree):
     return tokendefs
 
 
+def _keep_unused_token(defin, used_tokens):
+    "Returns whether a token with mods is needed even if no reachable rule uses it"
+    token_features = defin[1]
+    if not (is_stree(token_features) and token_features.head == 'tokenmods'):
+        return False
+    for token_mod in token_features.tail:
+        mod, modtokenlist = token_mod.tail
+        if mod in ('%ignore', '%newline'):
+            return True
+        if mod == '%unless' and any(modtok_name in used_tokens for _, (modtok_name, _) in modtokenlist.tail):
+            return True     # it lexes the %unless tokens
+    return False
+
+def prune_unreachable(grammar_list, keep_tokens=False, start=('start',)):
+    """Removes the rules that can't be reached from the start rules, and the tokens that no
+    reachable rule uses (except for %ignore and %newline tokens, and tokens with
+    a used %unless token). With keep_tokens, only the rules are pruned.
+
+    Returns the new grammar list, and the names of the pruned rules and tokens.
+    """
+    rules = dict((name.lstrip('@#?'), defin) for type_, (name, defin) in grammar_list if type_ == 'rule')
+    if not all(name in rules for name in start):
+        return grammar_list, [], []
+
+    reachable = set()
+    used_tokens = set()
+    to_visit = list(start)
+    while to_visit:
+        name = to_visit.pop()
+        if name in reachable or name not in rules:
+            continue
+        reachable.add(name)
+        for alternative in rules[name]:
+            for symbol in alternative:
+                if symbol.startswith('%'):
+                    pass    # %prec
+                elif symbol.isupper():
+                    used_tokens.add(symbol)
+                else:
+                    to_visit.append(symbol)
+
+    pruned_rules = []
+    pruned_tokens = []
+    new_list = []
+    for type_, (name, defin) in grammar_list:
+        if type_ == 'rule' and name.lstrip('@#?') not in reachable:
+            pruned_rules.append(name.lstrip('@#?'))
+            continue
+        if type_ in ('token', 'token_with_mods') and not keep_tokens and name not in used_tokens:
+            if not (type_ == 'token_with_mods' and _keep_unused_token(defin, used_tokens)):
+                pruned_tokens.append(name)
+                continue
+        new_list.append((type_, (name, defin)))
+
+    # yacc refuses precedence for tokens it doesn't know
+    pruned = set(pruned_tokens)
+    grammar_list = new_list
+    new_list = []
+    for type_, (name, defin) in grammar_list:
+        if type_ == 'precedence':
+            defin = [token for token in defin if token not in pruned]
+            if not defin:
+                continue
+        new_list.append((type_, (name, defin)))
+
+    return new_list, pruned_rules, pruned_tokens
+
+
+# A rule isn't inlined where it would give an alternative more than this many alternatives
+INLINE_LIMIT = 16
+
+def _inlinable(name, alternatives, rule_mods, helper_rules, prec_symbols, start):
+    "Returns whether the node of a rule is always expanded, so that its alternatives can replace it"
+    if name in start or name in helper_rules:
+        return False
+    if any(name in alt or prec_symbols.intersection(alt) for alt in alternatives):
+        return False    # recursive, or decides the precedence of the rules it's used in
+    if RuleMods.EXPAND in rule_mods[name]:
+        return True
+    # A ?rule of single items always returns its child, unless the child is expanded into it
+    return RuleMods.EXPAND1 in rule_mods[name] and all(
+                len(alt) == 1 and RuleMods.EXPAND not in rule_mods.get(alt[0], '') for alt in alternatives)
+
+def inline_rules(grammar_list, helper_rules=(), start=('start',)):
+    """Replaces rules whose nodes are always expanded (@rules, and ?rules whose alternatives
+    are single items) with their alternatives, in the rules that use them. Only rules with
+    single items, or that are used once, are inlined.
+    @atom : number | LPAR expr RPAR ;
+    neg : MINUS atom ;
+     -->
+    neg : MINUS number | MINUS LPAR expr RPAR ;
+
+    Each inlined rule saves a reduction, and a call to its action, whenever it's parsed.
+    The resulting tree is the same. The start rules, rules used by flatten (#) and helper rules
+    are left alone, as are the alternatives that use precedence (which depends on their last token).
+
+    Returns the new grammar list, and the names of the inlined rules.
+    """
+    rule_mods = {}
+    rules = {}
+    for type_, (name, defin) in grammar_list:
+        if type_ == 'rule':
+            mods, = re.match('([@#?]*).*', name).groups()
+            rule_mods[name[len(mods):]] = mods
+            rules[name[len(mods):]] = [list(alt) for alt in defin]
+    prec_symbols = set()
+    for type_, (name, defin) in grammar_list:
+        if type_ == 'precedence':
+            prec_symbols.update(defin)
+        elif type_ == 'rule':
+            prec_symbols.update(symbol for alt in defin for symbol in alt if symbol.startswith('%prec '))
+
+    inlined = []
+    changed = True
+    while changed:
+        changed = False
+        for name in sorted(rules):
+            alternatives = rules.get(name)
+            if alternatives is None or not _inlinable(name, alternatives, rule_mods, helper_rules, prec_symbols, start):
+                continue
+            users = [user for user in rules if user != name and any(name in alt for alt in rules[user])]
+            uses = sum(alt.count(name) for user in users for alt in rules[user])
+            if not uses or not (uses == 1 or all(len(alt) <= 1 for alt in alternatives)):
+                continue
+            if any(RuleMods.FLATTEN in rule_mods[user] or user in helper_rules
+                   or any(name in alt and (prec_symbols.intersection(alt) or len(alternatives) ** alt.count(name) > INLINE_LIMIT)
+                          for alt in rules[user])
+                   for user in users):
+                continue
+
+            for user in users:
+                new_alternatives = []
+                for alt in rules[user]:
+                    choices = [alternatives if symbol == name else [[symbol]] for symbol in alt]
+                    for new_alt in itertools.product(*choices):
+                        new_alt = [symbol for part in new_alt for symbol in part]
+                        if new_alt not in new_alternatives:     # it would be the same tree anyway
+                            new_alternatives.append(new_alt)
+                rules[user] = new_alternatives
+            del rules[name]
+            inlined.append(name)
+            changed = True
+
+    new_list = []
+    for type_, (name, defin) in grammar_list:
+        if type_ == 'rule':
+            if name.lstrip('@#?') not in rules:
+                continue
+            defin = rules[name.lstrip('@#?')]
+        new_list.append((type_, (name, defin)))
+    return new_list, inlined
+
+
 class NameAnonymousTokens_Visitor(SVisitor):
     ANON_TOKEN_ID = 'ANON'
 
@@ -214,10 +393,16 @@ class NameAnonymousTokens_Visitor(SVisitor):
                     self._rules_to_add.append(STree('tokendef', [tok_name, child]))
                 tree.tail[i] = tok_name
 
+    precedencedef = rule    # %left: '\+' '-';
+
     def grammar(self, tree):
         if self._rules_to_add:
             tree.tail += self._rules_to_add
 
+    @property
+    def tokens_added(self):
+        return len(self._rules_to_add)
+
 
 class SimplifyGrammar_Visitor(SVisitor_Recurse):
 
@@ -276,19 +461,35 @@ class SimplifyGrammar_Visitor(SVisitor_Recurse):
 class ExpandOper_Visitor(SimplifyGrammar_Visitor):
     ANON_RULE_ID = 'anon'
 
-    def __init__(self):
+    # Longer permutations aren't expanded into all their orderings (see _perm_rule_list)
+    PERM_EXPANSION_LIMIT = 4
+
+    def __init__(self, expansion_mode='inline'):
         self._count = itertools.count()
         self._rules_to_add = []
+        self.helper_rules = {}  # helper rules -> what their action does (see _perm_rule_list and _factor_optional)
+        self.expansion_mode = expansion_mode
+        self._perm_depth = 0    # operators inside a permutation are always inlined (see pre_perm_rule)
+        self._factored = {}     # (rule, rest of an alternative) -> its helper (see _factor_optional)
+        self._helper_owners = {}
+        self.rules_added = 0
 
     def _get_new_rule_name(self):
         return '_%s_%d' % (self.ANON_RULE_ID, next(self._count))
 
     def grammar(self, tree):
+        changed = False
+        if self.expansion_mode == 'factored':
+            for ruledef in tree.tail:
+                if is_stree(ruledef) and ruledef.head == 'ruledef' and self._factor_optional(ruledef):
+                    changed = True
+
         if self._rules_to_add:
             tree.tail += self._rules_to_add
+            self.rules_added += len(self._rules_to_add)
             self._rules_to_add = []
             return True
-        return False
+        return changed
 
     def _add_recurse_rule(self, mod, name, repeated_expr):
         new_rule = STree('ruledef', [mod+name, STree('rules_list', [STree('rule', [repeated_expr]), STree('rule', [name, repeated_expr])]) ])
@@ -296,6 +497,7 @@ class ExpandOper_Visitor(SimplifyGrammar_Visitor):
 
     def oper(self, tree):
         rule_operand, operator = tree.tail
+        factored = self.expansion_mode == 'factored' and not self._perm_depth
 
         if operator == '*':
             # a : b c* d;
@@ -307,7 +509,10 @@ class ExpandOper_Visitor(SimplifyGrammar_Visitor):
             # _c : _c c | c;
             new_name = self._get_new_rule_name() + '_star'
             self._add_recurse_rule(RuleMods.EXPAND, new_name, rule_operand)
-            tree.head, tree.tail = 'rules_list', [STree('rule', [new_name]), STree('rule', [])]
+            if factored:
+                tree.head, tree.tail = 'optional', [new_name]   # see _factor_optional
+            else:
+                tree.head, tree.tail = 'rules_list', [STree('rule', [new_name]), STree('rule', [])]
         elif operator == '+':
             # a : b c+ d;
             #  -->
@@ -317,12 +522,60 @@ class ExpandOper_Visitor(SimplifyGrammar_Visitor):
             self._add_recurse_rule(RuleMods.EXPAND, new_name, rule_operand)
             tree.head, tree.tail = 'rule', [new_name]
         elif operator == '?':
-            tree.head, tree.tail = 'rules_list', [rule_operand, STree('rule', [])]
+            if factored:
+                tree.head, tree.tail = 'optional', [rule_operand]   # see _factor_optional
+            else:
+                tree.head, tree.tail = 'rules_list', [rule_operand, STree('rule', [])]
         else:
             assert False, rule_operand
 
         return True # changed
 
+    def _factor_optional(self, ruledef):
+        """ In 'factored' mode, moves the rest of a rule, from its first optional part,
+            into a helper rule. The helpers are expanded without filtering their tokens,
+            so the rule gets the same children as when its alternatives are inlined.
+            a : b c? d e* f;
+             -->
+            a : b _t1;
+            @_t1 : c d _t2 | d _t2;
+            @_t2 : _e_star f | f;
+
+            Inlined, a would have 4 alternatives (2^k for k optional parts). And unlike
+            helpers that only match the optional part (@_c : c |), the parser still
+            chooses between the alternatives where it did, which adds no LALR conflicts.
+        """
+        name, rules = ruledef.tail
+        changed = False
+        for rule in (rules.tail if rules.head == 'rules_list' else [rules]):
+            for i, child in enumerate(rule.tail):
+                if not (is_stree(child) and child.head == 'optional'):
+                    continue
+
+                rule_operand, = child.tail
+                if name.startswith(RuleMods.FLATTEN):
+                    # Nested instances of the rule would be hidden from flattening inside the helper
+                    rule.tail = rule.tail[:i] + [STree('rules_list', [STree('rule', [rule_operand]), STree('rule', [])])] + rule.tail[i+1:]
+                else:
+                    # The alternatives of a rule share their helpers, or there would be 2^k of them
+                    owner = self._helper_owners.get(name, name)
+                    rest = rule.tail[i:]
+                    key = (owner, tuple(rest))
+                    if key not in self._factored:
+                        new_name = self._get_new_rule_name() + '_opt'
+                        self._rules_to_add.append(STree('ruledef', [RuleMods.EXPAND+new_name, STree('rules_list', [STree('rule', [rule_operand] + rest[1:]), STree('rule', rest[1:])]) ]))
+                        self.helper_rules[new_name] = ('splice',)
+                        self._helper_owners[RuleMods.EXPAND+new_name] = owner
+                        self._factored[key] = new_name
+                    rule.tail = rule.tail[:i] + [self._factored[key]]
+                changed = True
+                break   # the rest of the rule was moved, or will be seen on the next pass
+        return changed
+
+    def pre_perm_rule(self, tree):
+        # Permutation members have to show whether they're optional, by an empty alternative
+        self._perm_depth += 1
+
     def perm_rule(self, tree):
         """ Transforms a permutation rule into a rules_list of the permutations.
             x : a ^ b ^ c
@@ -352,8 +605,12 @@ class ExpandOper_Visitor(SimplifyGrammar_Visitor):
               | b Z c Z a | c Z a Z b | c Z b Z a
               | a Z c     | c Z a
         """
+        self._perm_depth -= 1
         rules = tree.tail[0].tail
         sep = tree.tail[1] if len(tree.tail) == 2 else None
+        if len(rules) > self.PERM_EXPANSION_LIMIT:
+            return self._perm_rule_list(tree, rules, sep)
+
         tree.head = 'rules_list'
         tree.tail = [STree('rule', rule_perm) for rule_perm in itertools.permutations(rules)]
         self._visit(tree)
@@ -363,6 +620,56 @@ class ExpandOper_Visitor(SimplifyGrammar_Visitor):
                          for rule in tree.tail]
         return True
 
+    def _perm_rule_list(self, tree, rules, sep):
+        """ Transforms a long permutation rule into a list of its members,
+            which is checked when it's reduced.
+            x : a ^ b? ^ c ^^ Z
+             -->
+            x : _p ;
+            @_p : _p_list ;     // each member appears once (b at most once)
+            _p_list : _p_list Z _p_0 | _p_list Z _p_1 | _p_list Z _p_2
+                    | _p_0 | _p_1 | _p_2 ;
+            _p_0 : a ;
+            _p_1 : b ;
+            _p_2 : c ;
+
+            So the grammar grows linearly with the number of members, instead of
+            factorially. The resulting tree is the same.
+        """
+        name = self._get_new_rule_name() + '_perm'
+        list_name = name + '_list'
+
+        member_names = []
+        members = []
+        for i, rule in enumerate(rules):
+            # Children are simplified first, so an optional member (b?, b*, etc.) has an empty alternative
+            alternatives = rule.tail if rule.head == 'rules_list' else [rule]
+            non_empty = [alt for alt in alternatives if alt.tail]
+            member_name = '%s_%d' % (name, i)
+            self._rules_to_add.append(STree('ruledef', [member_name, STree('rules_list', non_empty)]))
+            self.helper_rules[member_name] = ('member', i)
+            member_names.append(member_name)
+            members.append((' | '.join(' '.join(map(StringType, alt.tail)) for alt in non_empty),
+                            len(non_empty) < len(alternatives)))
+
+        if sep:
+            sep_name = name + '_sep'
+            self._rules_to_add.append(STree('ruledef', [RuleMods.EXPAND + sep_name, STree('rules_list', [sep])]))
+            seps = [sep_name]
+        else:
+            seps = []
+
+        self._rules_to_add.append(STree('ruledef', [list_name, STree('rules_list',
+                                    [STree('rule', [list_name] + seps + [member_name]) for member_name in member_names]
+                                  + [STree('rule', [member_name]) for member_name in member_names])]))
+        self.helper_rules[list_name] = ('list',)
+
+        self._rules_to_add.append(STree('ruledef', [RuleMods.EXPAND + name, STree('rules_list', [STree('rule', [list_name])])]))
+        self.helper_rules[name] = ('check', members)
+
+        tree.head, tree.tail = 'rule', [name]
+        return True
+
 
 
 class GrammarTreeToList_Transformer(STransformer):
@@ -374,9 +681,14 @@ class GrammarTreeToList_Transformer(STransformer):
 
     @staticmethod
     def rule(tree):
-        return tree.tail
+        # %prec has to come last, even if the rule was in parentheses
+        return [x for x in tree.tail if not x.startswith('%prec ')] + [x for x in tree.tail if x.startswith('%prec ')]
     #     return ' '.join(tree.tail)
 
+    @staticmethod
+    def prec(tree):
+        return '%%prec %s' % tree.tail[0]
+
     @staticmethod
     def ruledef(tree):
         return ('rule', tree.tail)
@@ -385,6 +697,10 @@ class GrammarTreeToList_Transformer(STransformer):
     def optiondef(tree):
         return ('option', tree.tail)
 
+    @staticmethod
+    def precedencedef(tree):
+        return ('precedence', [tree.tail[0], tree.tail[1:]])
+
     @staticmethod
     def fragmentdef(tree):
         return ('fragment', [None, None])
@@ -486,6 +802,57 @@ class LexerWrapper(object):
             self._lexer_pos_of_start_column = t.lexpos + t.value.rindex(self.newline_char)
 
 
+_peaks = []     # the peak allocation of each phase being measured, before nested phases reset it
+
+@contextmanager
+def _measure(trace_allocations):
+    """Measures the block. Yields a list, which is then filled with the seconds it took,
+    and the bytes it allocated and its peak above the start (or None, when not traced)"""
+    measured = []
+    tracing = trace_allocations and tracemalloc is not None and tracemalloc.is_tracing()
+    if tracing:
+        before, peak = tracemalloc.get_traced_memory()
+        if _peaks:
+            _peaks[-1] = max(_peaks[-1], peak)
+        _peaks.append(before)
+        tracemalloc.reset_peak()
+    start = default_timer()
+    try:
+        yield measured
+    finally:
+        seconds = default_timer() - start
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(_peaks.pop(), peak)
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], peak)
+            measured += [seconds, current - before, peak - before]
+        else:
+            measured += [seconds, None, None]
+
+def format_build_report(report, indent=''):
+    "Formats a report returned by Grammar.build_report() as text"
+    lines = ['%s%s: %.1f ms' % (indent, report['source'], report['seconds'] * 1000)]
+    for phase in report['phases']:
+        line = '%s    %-18s %8.1f ms' % (indent, phase['name'], phase['seconds'] * 1000)
+        if phase['allocated'] is not None:
+            line += ' %+10.1f KB allocated, %.1f KB peak' % (phase['allocated'] / 1024.0, phase['peak'] / 1024.0)
+        lines.append(line)
+
+    counts = report['counts']
+    lines.append('%s    %s' % (indent, ', '.join('%d %s' % (counts[name], name) for name in sorted(counts))))
+    for conflict in report['conflicts'] or ():
+        lines.append('%s    %s' % (indent, conflict))
+    if report['inlined rules']:
+        lines.append('%s    inlined: %s' % (indent, ', '.join(report['inlined rules'])))
+    if report['pruned rules'] or report['pruned tokens']:
+        lines.append('%s    unreachable, left out: %s' % (indent, ', '.join(report['pruned rules'] + report['pruned tokens'])))
+
+    for name, subreport in sorted(report['subgrammars'].items()):
+        lines.append(format_build_report(subreport, indent + '    '))
+    return '\n'.join(lines)
+
+
 class GrammarOptions(object):
     """Specifies the options for PlyPlus
 
@@ -493,8 +860,33 @@ class GrammarOptions(object):
         debug - Affects verbosity (default: False)
         just_lex - Don't build a parser. Useful for debugging (default: False)
         auto_filter_tokens - Automagically remove "punctuation" tokens (default: True)
-        cache_grammar - Cache the PlyPlus grammar (PLY caches regardless of this. Default: False)
+        cache_grammar - Cache the whole built grammar, not just its parse tables (Default: False)
         ignore_postproc - Don't call the post-processing function (default: False)
+        engine - What parses, 'ply', 'lalr_fast' or 'pearley' (default: 'ply')
+                 'lalr_fast' uses ply's tables, with a parse loop generated for the grammar
+                 (see plyplus.engine_lalr_fast), which is faster. It doesn't support compact_tables.
+                 'pearley' is an Earley parser, for grammars that aren't LALR(1). It's experimental.
+        expansion_mode - How the ? and * operators are expanded, 'inline' or 'factored' (default: 'inline')
+                         'inline' adds alternatives without the operand, so a rule with k of them
+                         becomes 2^k alternatives. 'factored' uses helper rules instead, which keeps
+                         the grammar linear (see ExpandOper_Visitor._factor_optional). Both give the same trees.
+        optimize - Inline the rules whose nodes are always expanded, so that the parser makes fewer
+                   reductions. The trees are the same (see inline_rules) (default: False)
+        profile - Also record the memory allocated by each phase of the build, and the LALR conflicts
+                  (see Grammar.build_report) (default: False)
+        lalr_builder - What makes the parse tables, 'yacc' or 'native' (default: 'yacc')
+                       'native' makes the same tables as ply.yacc, faster (see plyplus.lalr), and reports
+                       the conflicts with an example input, but doesn't write parser.out in debug mode.
+        start - The rule that parsing starts with, or a list of them (default: 'start')
+                With several, one set of parse tables is made for all of them, and Grammar.parse()
+                takes the one to start with.
+        lr_method - How the parse tables are made, 'lalr' or 'lr1' (default: 'lalr')
+                    'lr1' makes LR(1) tables (always with the native builder), which have no conflicts
+                    for grammars that are LR(1) but not LALR(1), and parse as fast (see plyplus.lalr).
+        share - Share the build with the other Grammar instances of the process that have the same grammar
+                and options (see plyplus.registry). Each instance still parses on its own. (default: False)
+        compact_tables - Keep the parse tables in arrays, which take less memory, and load faster from
+                         the cache (see plyplus.compact_tables). Not for debugging. (default: False)
 
     Read the GrammarOptions class for more details.
     """
@@ -509,10 +901,55 @@ class GrammarOptions(object):
         self.cache_grammar = o.pop('cache_grammar', False)
         self.ignore_postproc = bool(o.pop('ignore_postproc', False))
         self.engine = o.pop('engine', 'ply')
-
+        self.expansion_mode = o.pop('expansion_mode', 'inline')
+        self.optimize = bool(o.pop('optimize', False))
+        self.profile = bool(o.pop('profile', False))
+        self.lalr_builder = o.pop('lalr_builder', 'yacc')
+        self.compact_tables = bool(o.pop('compact_tables', False))
+        self.lr_method = o.pop('lr_method', 'lalr')
+        self.share = bool(o.pop('share', False))
+        start = o.pop('start', 'start')
+        self.start = (start,) if isinstance(start, StringTypes) else tuple(start)
+
+        if self.expansion_mode not in ('inline', 'factored'):
+            raise ValueError("Unknown expansion_mode: %r" % self.expansion_mode)
+        if self.lalr_builder not in ('yacc', 'native'):
+            raise ValueError("Unknown lalr_builder: %r" % self.lalr_builder)
+        if not self.start:
+            raise ValueError("No start rule")
+        if self.lr_method not in ('lalr', 'lr1'):
+            raise ValueError("Unknown lr_method: %r" % self.lr_method)
+        if self.compact_tables and self.engine == 'lalr_fast':
+            raise ValueError("compact_tables isn't supported by the lalr_fast engine")
         if o:
             raise ValueError("Unknown options: %s" % o.keys())
 
+    # Options that are stored by Grammar.serialize() (tree_class is a class, and isn't)
+    SERIALIZED_OPTIONS = ('debug', 'just_lex', 'auto_filter_tokens', 'keep_empty_trees', 'ignore_postproc', 'engine', 'expansion_mode', 'optimize', 'compact_tables', 'lr_method', 'start')
+
+
+def _read_grammar(grammar):
+    "Returns the text of a grammar given as a string or a file-like object, its source, and a name for its tables"
+    # Some, but not all file-like objects have a 'name' attribute
+    try:
+        source = grammar.name
+    except AttributeError:
+        source = '<string>'
+        name = 'grammar'
+    else:
+        name = os.path.basename(source).replace('.', '_')
+
+    # Drain file-like objects to get their contents
+    try:
+        read = grammar.read
+    except AttributeError:
+        pass
+    else:
+        grammar = read()
+
+    assert isinstance(grammar, StringTypes)
+    return grammar, source, name
+
 
 class Grammar(object):
     """Grammar object. Provides the main interface to PlyPlus.
@@ -525,58 +962,200 @@ class Grammar(object):
             options : a dictionary controlling various aspects of plyplus.
                       """
         options = GrammarOptions(options)
+        grammar, source, name = _read_grammar(grammar)
+        self._init(grammar, source, name, options)
 
-        # Some, but not all file-like objects have a 'name' attribute
-        try:
-            source = grammar.name
-        except AttributeError:
-            source = '<string>'
-            tab_filename = "parsetab_%s" % str(hash(grammar)%(2**32))
-        else:
-            # PLY turns "a.b" into "b", so gotta get rid of the dot.
-            tab_filename = "parsetab_%s" % os.path.basename(source).replace('.', '_')
+    def _init(self, grammar, source, name, options):
+        tab_filename = '%s_%s' % (name, cache.cache_key(grammar, options))
 
-        # Drain file-like objects to get their contents
+        # Allocations are traced during the build only (tracing slows everything down)
+        start_tracing = options.profile and tracemalloc is not None and not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
         try:
-            read = grammar.read
-        except AttributeError:
-            pass
-        else:
-            grammar = read()
-
-        assert isinstance(grammar, StringTypes)
-
-        if options.cache_grammar:
-            plyplus_cache_filename = PLYPLUS_DIR + '/%s-%s-%s.plyplus' % (tab_filename, hashlib.sha256(grammar).hexdigest(), __version__)
-            if os.path.exists(plyplus_cache_filename):
-                with open(plyplus_cache_filename, 'rb') as f:
-                    self._grammar = pickle.load(f)
+            if options.share:
+                # The options that aren't in the key of the tables (such as tree_class) change the build too
+                key = tab_filename, tuple(sorted(vars(options).items()))
+                self._shared = registry.get(key, lambda: self._build(grammar, source, tab_filename, options))
+                self._grammar = self._shared.copy()
             else:
-                self._grammar = self._create_grammar(grammar, source, tab_filename, options)
+                self._grammar = self._build(grammar, source, tab_filename, options)
+        finally:
+            if start_tracing:
+                tracemalloc.stop()
 
-                with open(plyplus_cache_filename, 'wb') as f:
-                    pickle.dump(self._grammar, f, pickle.HIGHEST_PROTOCOL)
-        else:
-            self._grammar = self._create_grammar(grammar, source, tab_filename, options)
+    def _build(self, grammar, source, tab_filename, options):
+        if options.cache_grammar:
+            built = []
+            def build():
+                built.append(self._create_grammar(grammar, source, tab_filename, options))
+                return built[0].serialize()
+            data = cache.get(tab_filename + '.plyplus', build)
+            return built[0] if built else _Grammar.deserialize(data, options)
+        return self._create_grammar(grammar, source, tab_filename, options)
 
 
     @staticmethod
     def _create_grammar(grammar, source, tab_filename, options):
-        grammar_tree = grammar_parser.parse(grammar)
+        with _measure(options.profile) as measured:
+            grammar_tree = grammar_parser.parse(grammar)
         if not grammar_tree:
             raise GrammarException("Parse Error: Could not create grammar")
+        parse_time, allocated, peak = measured
+
+        grammar = _Grammar(grammar_tree, source, tab_filename, options)
+        grammar.timings.insert(0, ('parse grammar', parse_time))
+        if allocated is not None:
+            grammar.allocations['parse grammar'] = allocated, peak
+        return grammar
+
+    @classmethod
+    def build_async(cls, grammar, pool=None, **options):
+        """Returns a Grammar at once, and builds it in the background, in a thread, or with pool
+        (a multiprocessing.Pool, or a concurrent.futures executor), which can build several
+        grammars in parallel, in other processes. The first use of the grammar waits until it's
+        built, and raises the exception of the build if it failed.
+
+        A pool sends the built grammar back serialized (see serialize()), so the grammar isn't shared
+        (see the share option), and tree_class is set in this process. Options are as for Grammar().
+        """
+        grammar_options = GrammarOptions(options)   # raises at once if they're invalid
+        grammar, source, name = _read_grammar(grammar)
+        if pool is None:
+            def build():
+                built = cls.__new__(cls)
+                built._init(grammar, source, name, grammar_options)
+                return built
+            finish = _BuildThread(build).get
+        else:
+            options = dict(options)
+            tree_class = options.pop('tree_class', STree)
+            args = grammar, source, name, options
+            if hasattr(pool, 'apply_async'):
+                get_result = pool.apply_async(_build_serialized, args).get
+            else:
+                get_result = pool.submit(_build_serialized, *args).result
+            def finish():
+                return Grammar.deserialize(get_result(), tree_class=tree_class)
+
+        self = cls.__new__(cls)
+        self._pending = _PendingBuild(finish)
+        return self
 
-        return _Grammar(grammar_tree, source, tab_filename, options)
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set: _grammar isn't until build_async()'s build is done
+        if name == '_grammar' and '_pending' in self.__dict__:
+            self.__dict__.update(vars(self._pending.wait()))
+            return self._grammar
+        raise AttributeError(name)
 
     def lex(self, text):
         return self._grammar.lex(text)
 
-    def parse(self, text):
-        return self._grammar.parse(text)
+    def parse(self, text, start=None):
+        """Parses the text, from the start rule given (one of the start option's, by default the first one),
+        and returns its tree"""
+        return self._grammar.parse(text, start)
+
+    def build_report(self):
+        """Returns what building the grammar took, and what it made, as a dict.
+
+        It has the seconds each phase took ('phases'), and with the profile option, the bytes
+        it allocated, and their peak. The counts are of the anonymous rules and tokens the
+        build created, the rules and alternatives given to the engine, and the size of the
+        tables (and their LALR conflicts, with the profile option). Each subgrammar has its
+        own report. Use format_build_report() to make it readable.
+        """
+        return self._grammar.build_report()
+
+    def serialize(self):
+        """Returns the built grammar (including its lexer and parser tables) as plain data.
+
+        The result only contains builtin types, so it can be pickled or written out
+        with repr(). Use Grammar.deserialize() to restore it.
+
+        It holds the token definitions, the rules, the modifier sets (rules to expand
+        or flatten, newline and ignored tokens), the code section, and the subgrammars,
+        which are serialized the same way.
+        """
+        options = self._grammar.options
+        return {
+            'version': __version__,
+            'options': dict((name, getattr(options, name)) for name in GrammarOptions.SERIALIZED_OPTIONS),
+            'grammar': self._grammar.serialize(),
+        }
+
+    @classmethod
+    def deserialize(cls, data, **options):
+        """Restores a grammar returned by serialize(), without building it again.
+
+        Options given here override the ones the grammar was built with
+        (useful for options such as tree_class, which aren't serialized).
+        """
+        if data['version'] != __version__:
+            raise GrammarException("Grammar was serialized by plyplus %s, but this is plyplus %s" % (data['version'], __version__))
+
+        built_options = dict(data['options'])
+        built_options.update(options)
+
+        self = cls.__new__(cls)
+        self._grammar = _Grammar.deserialize(data['grammar'], GrammarOptions(built_options))
+        return self
+
+    # Pickling goes through serialize(), so a grammar built once can be sent to
+    # other processes, which restore it without building it again.
+    def __getstate__(self):
+        return self.serialize(), self._grammar.options.tree_class
+
+    def __setstate__(self, state):
+        data, tree_class = state
+        self._grammar = Grammar.deserialize(data, tree_class=tree_class)._grammar
 
     __init__.__doc__ += GrammarOptions.__doc__
 
 
+def _build_serialized(grammar, source, name, options):
+    "Builds a grammar for Grammar.build_async(), in a worker of its pool, and returns it serialized"
+    built = Grammar.__new__(Grammar)
+    built._init(grammar, source, name, GrammarOptions(options))
+    return built.serialize()
+
+class _BuildThread(threading.Thread):
+    "Runs a function in the background; get() waits for it, and returns its result (or raises its exception)"
+    def __init__(self, function):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.function = function
+        self.result = self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.result = self.function()
+        except Exception as e:
+            self.error = e
+
+    def get(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class _PendingBuild(object):
+    "The build of a grammar by Grammar.build_async(): wait() returns the Grammar built"
+    def __init__(self, finish):
+        self._finish = finish
+        self._lock = threading.Lock()
+        self._built = None
+
+    def wait(self):
+        with self._lock:
+            if self._built is None:
+                self._built = self._finish()
+                self._finish = None
+            return self._built
+
+
 class GrammarVerifier(SVisitor):
     def __init__(self):
         self.rules_used = None
@@ -622,9 +1201,80 @@ class GrammarVerifier(SVisitor):
 
 
 class _Grammar(object):
+    # Rules and tokens that can't be used are left out of the lexer and parser (see prune_unreachable)
+    PRUNE_UNREACHABLE = True
+
     def __init__(self, grammar_tree, source_name, tab_filename, options):
-        GrammarVerifier().verify(grammar_tree)
+        self._init(source_name, tab_filename, options)
+
+        with self._phase('verify'):
+            GrammarVerifier().verify(grammar_tree)
+
+        # -- Build Grammar --
+        with self._phase('subgrammars'):
+            ExtractSubgrammars_Visitor(source_name, tab_filename, self.options).visit(grammar_tree)
+        with self._phase('simplify'):
+            SimplifyGrammar_Visitor().visit(grammar_tree)
+        with self._phase('expand operators'):
+            expand_oper = ExpandOper_Visitor(self.options.expansion_mode)
+            expand_oper.visit(grammar_tree)
+            self._helper_rules = expand_oper.helper_rules
+        with self._phase('simplify tokens'):
+            tokendefs = simplify_tokendefs(grammar_tree)
+            name_anon_tokens = NameAnonymousTokens_Visitor(tokendefs)
+            name_anon_tokens.visit(grammar_tree)
+            grammar_list_and_code = GrammarTreeToList_Transformer().transform(grammar_tree)
+        self.counts['anonymous rules'] = expand_oper.rules_added
+        self.counts['anonymous tokens'] = name_anon_tokens.tokens_added
+
+        # code may be omitted
+        if len(grammar_list_and_code) == 1:
+            grammar_list, = grammar_list_and_code
+        else:
+            grammar_list, code = grammar_list_and_code
+            with self._phase('exec code'):
+                self._exec_code(StringType(code), code.line)
+
+        if not self.options.just_lex:
+            rule_names = set(name.lstrip('@#?') for type_, (name, _) in grammar_list if type_ == 'rule')
+            undefined = [name for name in self.options.start if name not in rule_names]
+            if undefined:
+                raise GrammarException("Start rule not defined: %s" % ', '.join(undefined))
+            if len(self.options.start) > 1 and START_RULE in rule_names:
+                raise GrammarException("The rule name %s is reserved for the rule that chooses between several start rules" % START_RULE)
+
+        if self.options.optimize:
+            with self._phase('optimize'):
+                grammar_list, self.inlined_rules = inline_rules(grammar_list, self._helper_rules, self.options.start)
+
+        if self.PRUNE_UNREACHABLE and not self.options.just_lex:    # a lexer lexes all its tokens, used or not
+            with self._phase('prune'):
+                # A lexer postproc might consume tokens that no rule uses
+                grammar_list, self.pruned_rules, self.pruned_tokens = prune_unreachable(grammar_list, keep_tokens=bool(self.lexer_postproc),
+                                                                                        start=self.options.start)
+
+        rules = [defin for type_, (_, defin) in grammar_list if type_ == 'rule']
+        self.counts['rules'] = len(rules)
+        self.counts['alternatives'] = sum(len(alternatives) for alternatives in rules)
+
+        with self._phase('add rules'):
+            for type_, (name, defin) in grammar_list:
+                assert type_ in ('token', 'token_with_mods', 'rule', 'option', 'precedence', 'fragment'), "Can't handle type %s"%type_
+                handler = getattr(self, '_add_%s' % type_)
+                handler(name, defin)
 
+        # -- Build lexer --
+        with self._phase('build lexer'):
+            self.engine.build_lexer(cache_file=tab_filename)
+            self._wrap_lexer()
+
+        # -- Build Parser --
+        if not self.options.just_lex:
+            with self._phase('build parser'):
+                self.engine.build_parser(cache_file=tab_filename)
+        self.counts.update(self.engine.table_sizes())
+
+    def _init(self, source_name, tab_filename, options):
         self.options = options
 
         self.tab_filename = tab_filename
@@ -635,51 +1285,115 @@ class _Grammar(object):
         self._ignore_tokens = set()
         self.lexer_postproc = None
         self._newline_value = '\n'
-
-        engine_class = {
+        self._code = None
+        self.subgrammars = {}
+        self.timings = []   # (phase, seconds) for each phase of the build
+        self.allocations = {}   # phase -> (bytes allocated, peak), with the profile option
+        self.counts = {}    # what the build made: anonymous rules, alternatives, states, etc.
+        self.pruned_rules = []
+        self.pruned_tokens = []
+        self.inlined_rules = []
+
+        self.engine_class = {
             'ply': Engine_PLY,
             'pearley': Engine_Pearley,
+            'lalr_fast': Engine_LALR_Fast,
         }[options.engine]
 
-        self.engine = engine_class(self.options, self.rules_to_flatten, self.rules_to_expand)
+        self.engine = self.engine_class(self.options, self.rules_to_flatten, self.rules_to_expand)
 
-        # -- Build Grammar --
-        self.subgrammars = {}
-        ExtractSubgrammars_Visitor(source_name, tab_filename, self.options).visit(grammar_tree)
-        SimplifyGrammar_Visitor().visit(grammar_tree)
-        ExpandOper_Visitor().visit(grammar_tree)
-        tokendefs = simplify_tokendefs(grammar_tree)
-        NameAnonymousTokens_Visitor(tokendefs).visit(grammar_tree)
-        grammar_list_and_code = GrammarTreeToList_Transformer().transform(grammar_tree)
+    @contextmanager
+    def _phase(self, name):
+        with _measure(self.options.profile) as measured:
+            yield
+        seconds, allocated, peak = measured
+        self.timings.append((name, seconds))
+        if allocated is not None:
+            self.allocations[name] = allocated, peak
 
-        # code may be omitted
-        if len(grammar_list_and_code) == 1:
-            grammar_list, = grammar_list_and_code
-        else:
-            grammar_list, code = grammar_list_and_code
+    def _exec_code(self, code, line):
+        self._code = code, line
 
-            # prefix with newlines to get line-number count correctly (ensures tracebacks are correct)
-            src_code = '\n' * (max(code.line, 1) - 1) + code
+        # prefix with newlines to get line-number count correctly (ensures tracebacks are correct)
+        src_code = '\n' * (max(line, 1) - 1) + code
 
-            # compiling before executing attaches source_name as filename: shown in tracebacks
-            exec_code = compile(src_code, source_name, 'exec')
-            exec(exec_code, locals())
+        # compiling before executing attaches source_name as filename: shown in tracebacks
+        exec_code = compile(src_code, self.source_name, 'exec')
+        exec(exec_code, locals())
 
-        for type_, (name, defin) in grammar_list:
-            assert type_ in ('token', 'token_with_mods', 'rule', 'option', 'fragment'), "Can't handle type %s"%type_
-            handler = getattr(self, '_add_%s' % type_)
-            handler(name, defin)
-
-        # -- Build lexer --
-        self.engine.build_lexer()
+    def _wrap_lexer(self):
+        self._base_lexer = self.engine.lexer
         lexer = LexerWrapper(self.engine.lexer, newline_tokens_names=self._newline_tokens, newline_char=self._newline_value, ignore_token_names=self._ignore_tokens)
         if self.lexer_postproc and not self.options.ignore_postproc:
             lexer = self.lexer_postproc(lexer)  # apply wrapper
         self.engine.lexer = lexer
 
-        # -- Build Parser --
-        if not self.options.just_lex:
-            self.engine.build_parser(cache_file=tab_filename)
+    def copy(self):
+        "Returns a grammar that shares what was built with this one, but has its own lexer and parse state"
+        other = copy.copy(self)
+        other.engine = self.engine.copy(self._base_lexer.clone())
+        other.subgrammars = dict((name, subgrammar.copy()) for name, subgrammar in self.subgrammars.items())
+        other._wrap_lexer()
+        return other
+
+    def serialize(self):
+        "Returns the built grammar as plain data, from which deserialize() can restore it"
+        return {
+            'source_name': self.source_name,
+            'tab_filename': self.tab_filename,
+            'rules_to_flatten': sorted(self.rules_to_flatten),
+            'rules_to_expand': sorted(self.rules_to_expand),
+            'newline_tokens': sorted(self._newline_tokens),
+            'ignore_tokens': sorted(self._ignore_tokens),
+            'newline_char': self._newline_value,
+            'code': self._code,
+            'pruned_rules': self.pruned_rules,
+            'pruned_tokens': self.pruned_tokens,
+            'inlined_rules': self.inlined_rules,
+            'subgrammars': dict((name, subgrammar.serialize()) for name, subgrammar in self.subgrammars.items()),
+            'engine': self.engine.serialize(),
+        }
+
+    @classmethod
+    def deserialize(cls, data, options):
+        self = cls.__new__(cls)
+        self._init(data['source_name'], data['tab_filename'], options)
+
+        with self._phase('deserialize'):
+            self.rules_to_flatten.update(data['rules_to_flatten'])
+            self.rules_to_expand.update(data['rules_to_expand'])
+            self._newline_tokens.update(data['newline_tokens'])
+            self._ignore_tokens.update(data['ignore_tokens'])
+            self._newline_value = data['newline_char']
+            self.pruned_rules = data['pruned_rules']
+            self.pruned_tokens = data['pruned_tokens']
+            self.inlined_rules = data['inlined_rules']
+            for name, subgrammar in data['subgrammars'].items():
+                self.subgrammars[name] = cls.deserialize(subgrammar, _subgrammar_options(options))
+            if data['code']:
+                self._exec_code(*data['code'])
+
+            self.engine = self.engine_class.deserialize(data['engine'], self.options, self.rules_to_flatten, self.rules_to_expand)
+            self._wrap_lexer()
+        self.counts.update(self.engine.table_sizes())
+        return self
+
+    def build_report(self):
+        "See Grammar.build_report"
+        return {
+            'source': self.source_name,
+            'seconds': sum(seconds for _, seconds in self.timings),
+            'phases': [{'name': name, 'seconds': seconds,
+                        'allocated': self.allocations.get(name, (None, None))[0],
+                        'peak': self.allocations.get(name, (None, None))[1]}
+                       for name, seconds in self.timings],
+            'counts': dict(self.counts),
+            'conflicts': self.engine.conflicts,
+            'inlined rules': self.inlined_rules,
+            'pruned rules': self.pruned_rules,
+            'pruned tokens': self.pruned_tokens,
+            'subgrammars': dict((name, subgrammar.build_report()) for name, subgrammar in self.subgrammars.items()),
+        }
 
     def __repr__(self):
         return '<Grammar from %s, tab at %s>' % (self.source_name, self.tab_filename)
@@ -693,11 +1407,17 @@ class _Grammar(object):
                 break
             yield tok
 
-    def parse(self, text):
-        "Parse the text into an AST"
+    def parse(self, text, start=None):
+        "Parse the text into an AST, from the start rule given (by default, the first one)"
         assert not self.options.just_lex
+        if start is None:
+            start = self.options.start[0]
+        elif start not in self.options.start:
+            raise ValueError("Not a start rule of the grammar: %r (they are: %s)" % (start, ', '.join(self.options.start)))
 
-        tree = self.engine.parse(text)
+        tree = self.engine.parse(text, start)
+        if not is_stree(tree):
+            tree = self.options.tree_class(start, [tree])     # the token of a ?rule with one child
 
         if self.subgrammars:
             ApplySubgrammars_Visitor(self.subgrammars).visit(tree)
@@ -717,6 +1437,10 @@ class _Grammar(object):
             raise GrammarException( "Unknown option: %s " % name )
 
 
+    def _add_precedence(self, assoc, tokens):
+        "Declares the precedence of tokens: %left, %right or %nonassoc (see ply.yacc)"
+        self.engine.add_precedence(assoc.lstrip('%'), tokens)
+
     def _extract_unless_tokens(self, modtokenlist):
         unless_toks_dict = {}
         unless_toks_regexps = []
@@ -810,8 +1534,184 @@ class _Grammar(object):
             self.rules_to_flatten.add( rule_name )
 
         self_expand = (RuleMods.EXPAND in mods or RuleMods.EXPAND1 in mods)
-        self.engine.add_rule(rule_name, rule_def, self_expand)
+        self.engine.add_rule(rule_name, rule_def, self_expand, self._helper_rules.get(rule_name))
+
 
 
+# -- Analysis --
 
+# analyze() warns about grammars larger than these
+ANALYZE_MAX_STATES = 2000
+ANALYZE_MAX_RULE_ALTERNATIVES = 100
 
+class AnalyzeSubgrammars_Visitor(ExtractSubgrammars_Visitor):
+    "Analyzes the subgrammars, instead of building them"
+    def __init__(self, parent_source_name, parent_tab_filename, parent_options):
+        ExtractSubgrammars_Visitor.__init__(self, parent_source_name, parent_tab_filename, parent_options)
+        self.reports = {}
+
+    def _create(self, token_name, grammar_tree, source_name, tab_filename):
+        self.reports[token_name] = _analyze(grammar_tree, source_name, tab_filename, self.subgrammar_options)
+        return self.reports[token_name]
+
+def _regexp_parts(op, av):
+    "Returns the parts of an item of a parsed regexp"
+    if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+        return [av[2]]
+    if op == sre_parse.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_parse.BRANCH:
+        return av[1]
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    return []
+
+def _regexp_min_width(pattern):
+    "Returns the least a parsed regexp matches, not counting what its unbounded repeats match"
+    width = 0
+    for op, av in pattern:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            if av[1] != sre_parse.MAXREPEAT:
+                width += av[0] * _regexp_min_width(av[2])
+        elif op == sre_parse.SUBPATTERN:
+            width += _regexp_min_width(av[-1])
+        elif op == sre_parse.BRANCH:
+            width += min(_regexp_min_width(branch) for branch in av[1])
+        elif op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN):
+            width += 1
+    return width
+
+def _regexp_repeats(pattern):
+    return any(op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[1] == sre_parse.MAXREPEAT
+               or any(_regexp_repeats(part) for part in _regexp_parts(op, av))
+               for op, av in pattern)
+
+def regexp_backtracks(regexp):
+    """Returns whether a regexp repeats a part that can match the same text in many ways,
+    because it's made of repeats itself, like (a+)* or ([a-z]+ ?)+. On text that almost
+    matches, the regexp engine tries them all, which takes exponential time.
+    """
+    def backtracks(pattern):
+        for op, av in pattern:
+            if (op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[1] == sre_parse.MAXREPEAT
+                    and _regexp_repeats(av[2]) and not _regexp_min_width(av[2])):
+                return True
+            if any(backtracks(part) for part in _regexp_parts(op, av)):
+                return True
+        return False
+
+    try:
+        return backtracks(sre_parse.parse(regexp, re.UNICODE))
+    except re.error:
+        return False    # the lexer will say what's wrong with it
+
+def analyze(grammar, **options):
+    """Runs the first phases of building a grammar (up to the lexer and parser, which aren't built),
+    and returns what the build would make, as a dict. Use it to find the grammars that will be slow
+    to build, or make large tables. Its code section isn't run.
+
+    The counts are of the rules, their alternatives after the operators are expanded (including
+    permutations, and the alternatives that ? and * add), the anonymous rules and tokens, the tokens,
+    and the LR items (a symbol of an alternative, or its end). The LALR states are estimated by the
+    prefixes of alternatives, since each state of the parser is after one.
+
+    It also lists the rules with the most alternatives, and the tokens whose regexps can backtrack
+    exponentially (see regexp_backtracks), and gives warnings. Each subgrammar has its own report.
+    Use format_analysis() to make it readable.
+    """
+    options = GrammarOptions(options)
+    grammar, source, name = _read_grammar(grammar)
+    grammar_tree = grammar_parser.parse(grammar)
+    if not grammar_tree:
+        raise GrammarException("Parse Error: Could not create grammar")
+    return _analyze(grammar_tree, source, name, options)
+
+def _analyze(grammar_tree, source_name, tab_filename, options):
+    # The same phases as _Grammar.__init__
+    GrammarVerifier().verify(grammar_tree)
+    subgrammars = AnalyzeSubgrammars_Visitor(source_name, tab_filename, options)
+    subgrammars.visit(grammar_tree)
+    SimplifyGrammar_Visitor().visit(grammar_tree)
+    expand_oper = ExpandOper_Visitor(options.expansion_mode)
+    expand_oper.visit(grammar_tree)
+    tokendefs = simplify_tokendefs(grammar_tree)
+    name_anon_tokens = NameAnonymousTokens_Visitor(tokendefs)
+    name_anon_tokens.visit(grammar_tree)
+    grammar_list_and_code = GrammarTreeToList_Transformer().transform(grammar_tree)
+    grammar_list = grammar_list_and_code[0]
+
+    inlined_rules = pruned_rules = pruned_tokens = []
+    if options.optimize:
+        grammar_list, inlined_rules = inline_rules(grammar_list, expand_oper.helper_rules, options.start)
+    if _Grammar.PRUNE_UNREACHABLE and not options.just_lex:
+        # Any code might define a lexer postproc
+        grammar_list, pruned_rules, pruned_tokens = prune_unreachable(grammar_list, keep_tokens=len(grammar_list_and_code) > 1, start=options.start)
+
+    rules = {}
+    tokens = []
+    for type_, (name, defin) in grammar_list:
+        if type_ == 'rule':
+            rules[name.lstrip('@#?')] = defin
+        elif type_ == 'token':
+            tokens.append((name, defin))
+        elif type_ == 'token_with_mods':
+            token_value, token_features = defin
+            tokens.append((name, token_value))
+            if token_features is not None and token_features.head == 'tokenmods':
+                for token_mod in token_features.tail:
+                    mod, modtokenlist = token_mod.tail
+                    if mod == '%unless':
+                        tokens += [(modtok_name, modtok_value) for _, (modtok_name, modtok_value) in modtokenlist.tail]
+
+    prefixes = set((name, tuple(alt[:i])) for name, alternatives in rules.items()
+                                          for alt in alternatives for i in range(1, len(alt) + 1))
+    counts = {
+        'rules': len(rules),
+        'alternatives': sum(len(alternatives) for alternatives in rules.values()),
+        'anonymous rules': expand_oper.rules_added,
+        'anonymous tokens': name_anon_tokens.tokens_added,
+        'tokens': len(tokens),
+        'items': sum(len(alt) + 1 for alternatives in rules.values() for alt in alternatives),
+        'estimated states': len(prefixes) + 1,
+    }
+    largest_rules = sorted(((name, len(alternatives)) for name, alternatives in rules.items()), key=lambda x: (-x[1], x[0]))[:5]
+    backtracking_tokens = [(name, regexp) for name, regexp in tokens if regexp_backtracks(regexp)]
+
+    warnings = []
+    if counts['estimated states'] > ANALYZE_MAX_STATES:
+        warnings.append('about %d LALR states: the tables will be large, and slow to build' % counts['estimated states'])
+    for name, alternatives in largest_rules:
+        if alternatives > ANALYZE_MAX_RULE_ALTERNATIVES:
+            hint = " (try expansion_mode='factored')" if options.expansion_mode == 'inline' else ''
+            warnings.append('rule %s expands into %d alternatives%s' % (name, alternatives, hint))
+    for name, regexp in backtracking_tokens:
+        warnings.append('the regexp of token %s can backtrack exponentially: %s' % (name, regexp))
+
+    return {
+        'source': source_name,
+        'counts': counts,
+        'largest rules': largest_rules,
+        'backtracking tokens': backtracking_tokens,
+        'inlined rules': inlined_rules,
+        'pruned rules': pruned_rules,
+        'pruned tokens': pruned_tokens,
+        'warnings': warnings,
+        'subgrammars': subgrammars.reports,
+    }
+
+def format_analysis(report, indent=''):
+    "Formats a report returned by analyze() as text"
+    counts = report['counts']
+    lines = ['%s%s' % (indent, report['source']),
+             '%s    %s' % (indent, ', '.join('%d %s' % (counts[name], name) for name in sorted(counts))),
+             '%s    most alternatives: %s' % (indent, ', '.join('%s (%d)' % rule for rule in report['largest rules']))]
+    if report['inlined rules']:
+        lines.append('%s    inlined: %s' % (indent, ', '.join(report['inlined rules'])))
+    if report['pruned rules'] or report['pruned tokens']:
+        lines.append('%s    unreachable, left out: %s' % (indent, ', '.join(report['pruned rules'] + report['pruned tokens'])))
+    for warning in report['warnings']:
+        lines.append('%s    warning: %s' % (indent, warning))
+
+    for name, subreport in sorted(report['subgrammars'].items()):
+        lines.append(format_analysis(subreport, indent + '    '))
+    return '\n'.join(lines)
@@ -0,0 +1,63 @@
+"""An in-process registry of built grammars, shared by the Grammar instances made with share=True.
+
+Building a grammar takes a while, even when its tables are in the cache, and library code often
+makes its Grammar in a function or a constructor, so it's built again on each call. With
+share=True, a Grammar made with the same text and options as one that's still alive in the
+process reuses its build (the rules, the lexer, the parse tables and the actions), and only
+makes its own lexer and parser state (see _Grammar.copy), so the instances can parse at the
+same time, from different threads.
+
+The registry holds the builds by weak reference: once no Grammar uses one, it's collected.
+"""
+
+from __future__ import absolute_import
+
+import threading
+import weakref
+
+_grammars = weakref.WeakValueDictionary()
+_building = {}  # the lock of each key being built, which the other callers of that key wait for
+_lock = threading.Lock()    # guards the dicts only, never held during a build
+_stats = {'hits': 0, 'misses': 0}
+
+def _registered(key):
+    with _lock:
+        grammar = _grammars.get(key)
+        if grammar is not None:
+            _stats['hits'] += 1
+        return grammar
+
+def get(key, build):
+    """Returns the grammar registered under key, or registers and returns the one build() makes.
+    Only the callers of the same key wait for its build."""
+    grammar = _registered(key)
+    if grammar is not None:
+        return grammar
+    with _lock:
+        build_lock = _building.setdefault(key, threading.Lock())
+
+    with build_lock:
+        try:
+            grammar = _registered(key)     # built while we waited?
+            if grammar is None:
+                with _lock:
+                    _stats['misses'] += 1
+                grammar = build()
+                with _lock:
+                    _grammars[key] = grammar
+            return grammar
+        finally:
+            with _lock:
+                if _building.get(key) is build_lock:
+                    del _building[key]
+
+def stats():
+    "Returns the hits and misses of this process, and the number of grammars registered (and still alive)"
+    with _lock:
+        return dict(_stats, grammars=len(_grammars))
+
+def clear():
+    "Forgets the registered grammars (the Grammar instances keep using theirs), and resets the counts"
+    with _lock:
+        _grammars.clear()
+        _stats.update(hits=0, misses=0)
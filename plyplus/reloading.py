@@ -0,0 +1,131 @@
+"""A grammar that reloads its file when it changes, for long-running processes.
+
+ReloadingGrammar builds the grammar of a .g file, and polls the file's modification time in a
+background thread. When the file changes, the thread builds the new grammar (from the cache,
+when this text was built before with the same options), and swaps it in with an assignment.
+A parse that started before the swap finishes with the grammar it started with, and the
+threads that parse never wait for a rebuild.
+
+A grammar's lexer and parser can't parse two texts at once, so each thread parses with its own
+copy of the current grammar, which shares its tables (see _Grammar.copy).
+
+If the new text doesn't build, the error is logged and kept in the error attribute, and the
+last grammar that built stays in use until the file is fixed.
+"""
+
+from __future__ import absolute_import
+
+import io
+import os
+import logging
+import threading
+
+from .plyplus import Grammar
+
+logger = logging.getLogger('plyplus.reloading')
+
+class ReloadingGrammar(object):
+    """A Grammar built from the file at filename, and rebuilt when it changes.
+
+    The file is checked every interval seconds (by its modification time and size), or when
+    check() is called. Options are as for Grammar(). Call close() to stop watching the file.
+    """
+    def __init__(self, filename, interval=1.0, **options):
+        self.filename = filename
+        self.interval = interval
+        self.options = options
+        self.version = 0    # the number of reloads
+        self.error = None   # the exception of the last rebuild, if it failed
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stat = self._file_stat()
+        self._text = self._read()
+        self.grammar = self._build(self._text)   # the current grammar: a build error is raised here
+
+        self._stop = threading.Event()
+        self._thread = None
+        if interval:
+            self._thread = threading.Thread(target=self._poll, name='ReloadingGrammar(%s)' % filename)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _file_stat(self):
+        st = os.stat(self.filename)
+        return st.st_mtime, st.st_size
+
+    def _read(self):
+        with io.open(self.filename, encoding='utf-8') as f:
+            return f.read()
+
+    def _build(self, text):
+        return Grammar(_NamedText(text, self.filename), **self.options)
+
+    def _poll(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Couldn't check %s", self.filename)
+
+    def check(self):
+        """Rebuilds the grammar if its file changed since the last check. Returns True if it was reloaded.
+        Build errors aren't raised: they're logged, and kept in self.error."""
+        with self._lock:
+            stat = self._file_stat()
+            if stat == self._stat:
+                return False
+            self._stat = stat
+            text = self._read()
+            if text == self._text:
+                return False    # touched, but not changed
+            self._text = text
+
+            try:
+                grammar = self._build(text)
+            except Exception as e:
+                self.error = e
+                logger.error("Couldn't reload %s, still using the previous grammar: %s", self.filename, e)
+                return False
+
+            self.grammar = grammar
+            self.error = None
+            self.version += 1
+            return True
+
+    def close(self):
+        "Stops watching the file. The current grammar can still be used"
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _thread_grammar(self):
+        "The current grammar, copied for this thread. It's read once per call, so a call uses the same grammar from start to end"
+        grammar = self.grammar
+        local = self._local
+        if getattr(local, 'source', None) is not grammar:
+            local.grammar = grammar._grammar.copy()
+            local.source = grammar
+        return local.grammar
+
+    def parse(self, text, start=None):
+        return self._thread_grammar().parse(text, start)
+
+    def lex(self, text):
+        return self._thread_grammar().lex(text)
+
+
+class _NamedText(object):
+    "The text of a grammar, read by Grammar() as a file, so that its tables are named after the file"
+    def __init__(self, text, name):
+        self.name = name
+        self._text = text
+
+    def read(self):
+        return self._text
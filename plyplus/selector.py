@@ -3,6 +3,7 @@ from __future__ import absolute_import
 import re, copy
 from itertools import chain
 import weakref
+import threading
 
 from .strees import STree, is_stree
 from .stree_collection import STreeCollection
@@ -224,10 +225,22 @@ class STreeSelector(STree):
 
 selector_dict = {}
 
-selector_grammar = Grammar(grammars.open('selector.g'), tree_class=STreeSelector)
+_selector_grammar = None
+_selector_grammar_lock = threading.Lock()
+
+def _get_selector_grammar():
+    # Built on first use, so that importing plyplus doesn't pay for it
+    global _selector_grammar
+    with _selector_grammar_lock:
+        if _selector_grammar is None:
+            # cache_grammar picks up the tables shipped in the package (see bootstrap.py)
+            with grammars.open('selector.g') as f:
+                _selector_grammar = Grammar(f, tree_class=STreeSelector, cache_grammar=True)
+    return _selector_grammar
+
 def selector(text):
     if text not in selector_dict:
-        selector_ast = selector_grammar.parse(text)
+        selector_ast = _get_selector_grammar().parse(text)
         selector_ast.map(lambda x: is_stree(x) and x._post_init())
         selector_dict[text] = selector_ast
     return selector_dict[text]
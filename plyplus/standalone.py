@@ -0,0 +1,68 @@
+"""Compiles a grammar into a single, import-ready parser module.
+
+The generated module contains the grammar's lexer regexps, LALR tables and
+reduction metadata as plain data, so importing it doesn't parse the grammar,
+validate the token regexps or generate any tables. It still needs plyplus (and PLY)
+to be installed, for the parsing itself.
+
+Usage:
+
+    python -m plyplus.standalone my_grammar.g > my_parser.py
+
+and then:
+
+    import my_parser
+    tree = my_parser.parse(text)
+
+Use my_parser.load(**options) to get another Grammar instance (with a different
+tree_class, for example).
+"""
+
+from __future__ import absolute_import, print_function
+
+import sys
+import codecs
+
+from . import __version__
+from .plyplus import Grammar
+
+_TEMPLATE = u'''\
+# Parser for %(source)s, generated by plyplus %(version)s. Don't edit!
+#
+# Regenerate with: python -m plyplus.standalone %(source)s
+
+from plyplus import Grammar as _Grammar
+
+DATA = %(data)r
+
+def load(**options):
+    return _Grammar.deserialize(DATA, **options)
+
+grammar = load()
+lex = grammar.lex
+parse = grammar.parse
+'''
+
+def gen_standalone(grammar, out):
+    "Writes a standalone parser module for grammar (a built Grammar instance) into the file object out"
+    data = grammar.serialize()
+    out.write(_TEMPLATE % {
+        'source': data['grammar']['source_name'],
+        'version': __version__,
+        'data': data,
+    })
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) != 1:
+        print("Usage: python -m plyplus.standalone <grammar_file>", file=sys.stderr)
+        return 1
+
+    with codecs.open(args[0], encoding='utf-8') as f:
+        grammar = Grammar(f)
+    gen_standalone(grammar, sys.stdout)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
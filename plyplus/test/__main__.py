@@ -7,6 +7,8 @@ from .test_trees import TestSTrees
 from .test_selectors import TestSelectors
 from .test_parser import TestPlyPlus
 from .test_grammars import TestPythonG, TestConfigG
+from .test_standalone import TestStandalone
+from .test_cache import TestCache
 
 logging.basicConfig(level=logging.INFO)
 
@@ -0,0 +1,272 @@
+from __future__ import absolute_import
+
+import unittest
+import logging
+import os
+import sys
+import uuid
+import shutil
+import tempfile
+import subprocess
+
+from ply import lex, yacc
+
+from plyplus import cache, grammar_parser, bootstrap, grammars
+from plyplus.plyplus import Grammar, GrammarOptions
+
+logging.basicConfig(level=logging.INFO)
+
+def _new_grammar():
+    "Returns a grammar that's never been cached before"
+    return "start: A B*; A: 'a'; B: '%s';" % uuid.uuid4().hex
+
+
+class _Raise(object):
+    "Replaces a function with one that fails the test when called"
+    def __init__(self, testcase, obj, name):
+        self.testcase = testcase
+        self.obj = obj
+        self.name = name
+
+    def __enter__(self):
+        self.orig = getattr(self.obj, self.name)
+        def fail(*args, **kw):
+            self.testcase.fail('%s was called' % self.name)
+        setattr(self.obj, self.name, fail)
+
+    def __exit__(self, *args):
+        setattr(self.obj, self.name, self.orig)
+
+
+class _TempCacheDir(object):
+    "Uses an empty cache directory"
+    def __enter__(self):
+        self.orig_cache_dir = cache.get_cache_dir()
+        self.orig_limits = cache.get_limits()
+        self.cache_dir = tempfile.mkdtemp()
+        cache.set_cache_dir(self.cache_dir)
+        return self.cache_dir
+
+    def __exit__(self, *args):
+        cache.set_cache_dir(self.orig_cache_dir)
+        cache.set_limits(*self.orig_limits)
+        shutil.rmtree(self.cache_dir)
+
+
+class TestCache(unittest.TestCase):
+    def test_key_is_stable(self):
+        grammar = _new_grammar()
+        key = cache.cache_key(grammar, GrammarOptions({}))
+
+        # Must not depend on hash randomization
+        code = 'from plyplus import cache, plyplus; print(cache.cache_key(%r, plyplus.GrammarOptions({})))' % grammar
+        env = dict(os.environ, PYTHONHASHSEED='123')
+        path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        out = subprocess.check_output([sys.executable, '-c', code], env=env, cwd=path)
+        self.assertEqual(out.decode('ascii').strip(), key)
+
+    def test_key_depends_on_options(self):
+        grammar = _new_grammar()
+        key = cache.cache_key(grammar, GrammarOptions({}))
+        self.assertNotEqual(key, cache.cache_key(grammar, GrammarOptions({'auto_filter_tokens': False})))
+        self.assertNotEqual(key, cache.cache_key(grammar, GrammarOptions({'engine': 'pearley'})))
+        self.assertEqual(key, cache.cache_key(grammar, GrammarOptions({'debug': True})))
+
+    def test_parse_tables_cached(self):
+        grammar = _new_grammar()
+        g = Grammar(grammar)
+        with _Raise(self, yacc, 'yacc'):
+            g2 = Grammar(grammar)
+        self.assertEqual(g.parse('a'), g2.parse('a'))
+
+    def test_lexer_tables_cached(self):
+        grammar = _new_grammar()
+        g = Grammar(grammar)
+        with _Raise(self, lex, 'lex'):
+            g2 = Grammar(grammar)
+            # A lexer loaded from the cache can be serialized too
+            g3 = Grammar.deserialize(g2.serialize())
+        self.assertEqual([t.value for t in g.lex('aa')], [t.value for t in g2.lex('aa')])
+        self.assertEqual(g.parse('a'), g3.parse('a'))
+
+    def test_subgrammar_entries(self):
+        # Each subgrammar has its own tables, even if their tokens are named the same
+        grammar = """
+            start: (a | b)+; a: A; b: B;
+            A: 'a+' { start: X+; X: 'a'; };
+            B: 'b+' { start: X+; X: 'b'; };
+            C: '%s';
+        """ % uuid.uuid4().hex
+        g = Grammar(grammar)
+        g2 = Grammar(grammar)
+        self.assertEqual(g.parse('aab'), g2.parse('aab'))
+
+    def test_cache_grammar(self):
+        grammar = _new_grammar()
+        g = Grammar(grammar, cache_grammar=True)
+        with _Raise(self, grammar_parser, 'parse'):
+            g2 = Grammar(grammar, cache_grammar=True)
+        self.assertEqual(g.parse('a'), g2.parse('a'))
+
+    def test_atomic_store(self):
+        name = uuid.uuid4().hex
+        cache.store(name, {'a': 1})
+        self.assertEqual(cache.load(name), {'a': 1})
+        cache_dir = cache.get_cache_dir()
+        self.assertEqual([f for f in os.listdir(cache_dir) if f.startswith(name)], [name])
+
+    def test_memory_only(self):
+        orig_cache_dir = cache.get_cache_dir()
+        cache.set_cache_dir(None)
+        try:
+            grammar = _new_grammar()
+            g = Grammar(grammar, cache_grammar=True)
+            with _Raise(self, grammar_parser, 'parse'):
+                g2 = Grammar(grammar, cache_grammar=True)
+            self.assertEqual(g.parse('a'), g2.parse('a'))
+        finally:
+            cache.set_cache_dir(orig_cache_dir)
+        self.assertEqual([f for f in os.listdir(orig_cache_dir) if g._grammar.tab_filename in f], [])
+
+    def test_concurrent_build(self):
+        # Processes starting together build the grammar only once
+        code = '\n'.join([
+            'import sys',
+            'from plyplus import Grammar, engine_ply',
+            'class CountingYacc(object):',
+            '    def __getattr__(self, name):',
+            '        return getattr(yacc, name)',
+            '    def yacc(self, *args, **kw):',
+            '        sys.stdout.write("built\\n")',
+            '        return yacc.yacc(*args, **kw)',
+            'yacc = engine_ply.yacc',
+            'engine_ply.yacc = CountingYacc()',
+            'Grammar(%r, cache_grammar=True).parse("a")' % _new_grammar(),
+        ])
+        cache_dir = tempfile.mkdtemp()
+        try:
+            env = dict(os.environ, PLYPLUS_CACHE_DIR=cache_dir)
+            path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            procs = [subprocess.Popen([sys.executable, '-c', code], env=env, cwd=path, stdout=subprocess.PIPE)
+                     for _ in range(4)]
+            outputs = [p.communicate()[0] for p in procs]
+            self.assertEqual([p.returncode for p in procs], [0] * 4)
+            self.assertEqual(b''.join(outputs).count(b'built'), 1)
+            self.assertEqual([f for f in os.listdir(cache_dir) if f.endswith('.tmp')], [])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_entries(self):
+        with _TempCacheDir():
+            cache.store('a', 1)
+            cache.store('b', 2)
+            hits = cache.stats()['hits']
+            self.assertEqual(cache.load('a'), 1)
+            self.assertEqual(cache.load('c'), None)
+            self.assertEqual(cache.stats()['hits'], hits + 1)
+
+            entries = cache.entries()
+            self.assertEqual([(e.name, e.hits) for e in entries], [('a', 1), ('b', 0)])
+            self.assertEqual(cache.stats()['entries'], 2)
+
+            self.assertEqual([e.name for e in cache.clear()], ['a', 'b'])
+            self.assertEqual(cache.entries(), [])
+
+    def test_evict(self):
+        with _TempCacheDir():
+            for name in 'abc':
+                cache.store(name, name)
+            cache.load('a')
+            self.assertEqual([e.name for e in cache.evict(max_entries=2)], ['b'])
+            self.assertEqual(cache.load('b'), None)
+            self.assertEqual([e.name for e in cache.entries()], ['a', 'c'])
+
+            size = cache.entries()[0].size
+            self.assertEqual([e.name for e in cache.evict(max_size=size)], ['c'])
+
+    def test_hits_dont_write_the_index(self):
+        with _TempCacheDir() as cache_dir:
+            cache.store('a', 1)
+            with _Raise(self, cache, '_write'):
+                for _ in range(3):
+                    cache.load('a')
+            self.assertEqual([(e.name, e.hits) for e in cache.entries()], [('a', 3)])
+            self.assertFalse(os.path.exists(os.path.join(cache_dir, cache.INDEX)))
+
+            cache.flush_hits(blocking=True)
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, cache.INDEX)))
+            self.assertEqual([(e.name, e.hits) for e in cache.entries()], [('a', 3)])
+
+    def test_hits_of_concurrent_processes(self):
+        code = '\n'.join([
+            'from plyplus import cache',
+            'for _ in range(10):',
+            '    assert cache.load("a") == 1',
+        ])
+        with _TempCacheDir() as cache_dir:
+            cache.store('a', 1)
+            env = dict(os.environ, PLYPLUS_CACHE_DIR=cache_dir)
+            path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            procs = [subprocess.Popen([sys.executable, '-c', code], env=env, cwd=path) for _ in range(8)]
+            self.assertEqual([p.wait() for p in procs], [0] * 8)
+            self.assertEqual([(e.name, e.hits) for e in cache.entries()], [('a', 80)])
+
+    def test_eviction_is_throttled(self):
+        with _TempCacheDir() as cache_dir:
+            cache.set_limits(max_entries=3)
+            cache.get('0', lambda: 0)   # made under its lock
+            with _Raise(self, cache, 'evict'), _Raise(self, cache, 'entries'):
+                cache.store('1', 1)
+                cache.store('2', 2)
+            cache.store('3', 3)
+            self.assertEqual(sorted(e.name for e in cache.entries()), ['1', '2', '3'])
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, '0.lock')))   # eviction leaves lock files
+
+    def test_size_limit(self):
+        with _TempCacheDir():
+            cache.set_limits(max_entries=3)
+            for i in range(5):
+                cache.store(str(i), 'x' * 1000)
+            self.assertEqual(sorted(e.name for e in cache.entries()), ['2', '3', '4'])
+
+    def test_compile(self):
+        text = "[a]\nb=c\n"
+        with grammars.open('config.g') as f:
+            expected = Grammar(f).parse(text)
+
+        with _TempCacheDir() as cache_dir:
+            path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            out = subprocess.check_output([sys.executable, '-m', 'plyplus', 'compile', '-o', cache_dir,
+                                           os.path.join(path, 'plyplus', 'grammars', 'config.g')], cwd=path)
+            self.assertTrue(b'build parser' in out)
+
+            grammar_parser._get_parser()
+            with _Raise(self, yacc, 'yacc'):
+                with grammars.open('config.g') as f:
+                    g = Grammar(f)
+            self.assertEqual(g.parse(text), expected)
+
+    def test_bundled_tables(self):
+        package_dir = tempfile.mkdtemp()
+        try:
+            written = bootstrap.build_tables(package_dir)
+            self.assertTrue(all(os.path.exists(path) for path in written))
+            self.assertTrue(os.path.exists(os.path.join(package_dir, 'plyplus_grammar_lextab.py')))
+            self.assertTrue(os.path.exists(os.path.join(package_dir, 'plyplus_grammar_parsetab.py')))
+
+            [entry] = [path for path in written if path.endswith('.plyplus')]
+            orig_bundled_dir = cache.BUNDLED_DIR
+            orig_cache_dir = cache.get_cache_dir()
+            try:
+                cache.BUNDLED_DIR = os.path.dirname(entry)
+                cache.set_cache_dir(os.path.join(package_dir, 'empty'))
+                self.assertNotEqual(cache.load(os.path.basename(entry)), None)
+            finally:
+                cache.BUNDLED_DIR = orig_bundled_dir
+                cache.set_cache_dir(orig_cache_dir)
+        finally:
+            shutil.rmtree(package_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,10 @@ from __future__ import absolute_import
 
 import unittest
 import logging
+import itertools
 import os
+import gc
+import pickle
 import sys
 try:
     from cStringIO import StringIO as cStringIO
@@ -15,7 +18,14 @@ from io import (
     )
 from ply import yacc
 
-from plyplus.plyplus import Grammar, TokValue, ParseError
+from plyplus import cache, registry, ReloadingGrammar, TokenizeError
+from plyplus.plyplus import Grammar, TokValue, ParseError, GrammarException, format_build_report, analyze, format_analysis
+from plyplus.engine_ply import _parser_to_tab, rule_action, compile_action
+from plyplus.strees import STree
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 logging.basicConfig(level=logging.INFO)
 
@@ -247,6 +257,524 @@ class TestPlyPlus(unittest.TestCase):
 
         g.parse("a" * (sys.getrecursionlimit() // 4))
 
+    def test_perm(self):
+        g = Grammar(r"""start : a ^ b? ^ c ;
+                        a : 'a' ; b : 'b' ; c : 'c' ;
+                     """)
+        self.assertSequenceEqual([x.head for x in g.parse('cab').tail], ('c', 'a', 'b'))
+        self.assertSequenceEqual([x.head for x in g.parse('ac').tail], ('a', 'c'))
+        self.assertRaises(ParseError, g.parse, 'ab')
+
+    def test_long_perm(self):
+        # Too long to expand, so the members are checked when the permutation is reduced
+        members = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
+        g = Grammar(r"""start : x (a ^ b? ^ c ^ (d | e) ^ f* ^ g ^ h ^^ ',') x;
+                        x: 'x'; %s
+                     """ % ' '.join("%s : '%s' ;" % (m, m) for m in members))
+        self.assertTrue(g._grammar.engine.table_sizes()['states'] < 100)
+
+        r = g.parse('xh,g,fff,b,c,d,ax')
+        self.assertSequenceEqual([x.head for x in r.tail], ('x', 'h', 'g', 'f', 'f', 'f', 'b', 'c', 'd', 'a', 'x'))
+        r = g.parse('xa,c,e,g,hx')
+        self.assertSequenceEqual([x.head for x in r.tail], ('x', 'a', 'c', 'e', 'g', 'h', 'x'))
+
+        self.assertRaises(ParseError, g.parse, 'xa,c,e,g,h,ax')     # twice
+        self.assertRaises(ParseError, g.parse, 'xa,c,e,d,g,hx')     # d and e
+        self.assertRaises(ParseError, g.parse, 'xa,c,e,gx')         # no h
+
+    def test_precedence(self):
+        grammar = r"""start: expr;
+                      @expr: add | sub | mul | pow | neg | eq | number | '\(' expr '\)';
+                      add: expr '\+' expr;
+                      sub: expr '-' expr;
+                      mul: expr '\*' expr;
+                      pow: expr '\*\*' expr;
+                      neg: '-' expr %prec UMINUS;
+                      eq: expr '==' expr;
+                      number: '[0-9]+';
+
+                      %nonassoc: '==';
+                      %left: '\+' '-';
+                      %left: '\*';
+                      %right: UMINUS;
+                      %right: '\*\*';
+                   """
+        g = Grammar(grammar)
+        def parse(text):
+            def to_sexp(tree):
+                if tree.head == 'number':
+                    return tree.tail[0]
+                return [tree.head] + [to_sexp(x) for x in tree.tail]
+            return to_sexp(g.parse(text).tail[0])
+
+        self.assertEqual(parse('1+2*3'), ['add', '1', ['mul', '2', '3']])
+        self.assertEqual(parse('1-2-3'), ['sub', ['sub', '1', '2'], '3'])
+        self.assertEqual(parse('2**3**4'), ['pow', '2', ['pow', '3', '4']])
+        self.assertEqual(parse('-2**2'), ['neg', ['pow', '2', '2']])
+        self.assertEqual(parse('-2*3'), ['mul', ['neg', '2'], '3'])
+        self.assertEqual(parse('(1+2)*3==9'), ['eq', ['mul', ['add', '1', '2'], '3'], '9'])
+        self.assertRaises(ParseError, g.parse, '1==2==3')
+
+        self.assertRaises(GrammarException, Grammar, grammar, engine='pearley')
+        self.assertRaises(GrammarException, Grammar, "start: A %precedence B; A: 'a'; B: 'b';")
+
+    def test_factored_expansion(self):
+        grammar = r"""start : x a? (b c?)* d? ',' e* f? x;
+                      #f : G f? ;
+                      x: 'x'; a: 'a'; b: 'b'; c: 'c'; d: 'd'; e: 'e'; G: 'g';
+                   """
+        for engine in ('ply', 'pearley'):
+            inline = Grammar(grammar, engine=engine)
+            factored = Grammar(grammar, engine=engine, expansion_mode='factored')
+            for text in ['x,x', 'xa,x', 'xbbcd,eex', 'xabcb,gggx', 'xd,eggx']:
+                self.assertEqual(inline.parse(text), factored.parse(text))
+
+            if engine == 'ply':
+                self.assertTrue(factored._grammar.engine.table_sizes()['productions'] < inline._grammar.engine.table_sizes()['productions'])
+                self.assertRaises(ParseError, factored.parse, 'xaa,x')
+
+        self.assertRaises(ValueError, Grammar, grammar, expansion_mode='epsilon')
+
+    def test_optimize(self):
+        grammar = r"""start: stmt+;
+                      @stmt: assign | expr_stmt;
+                      assign: NAME '=' expr ';';
+                      expr_stmt: expr ';';
+                      @expr: add | neg | atom | paren;
+                      ?add: expr '\+' atom;
+                      neg: '-' expr %prec UMINUS;
+                      ?atom: number | name;
+                      @paren: '\(' expr '\)';
+                      number: '[0-9]+';
+                      name: NAME;
+                      NAME: '[a-z]+';
+                      %left: '\+';
+                      %right: UMINUS;
+                      WS: '[ ]+' (%ignore);
+                   """
+        for expansion_mode in ('inline', 'factored'):
+            g = Grammar(grammar, expansion_mode=expansion_mode)
+            optimized = Grammar(grammar, expansion_mode=expansion_mode, optimize=True)
+            # expr is recursive, and atom would change the last token of add, which decides its precedence
+            self.assertEqual(sorted(optimized._grammar.inlined_rules), ['paren', 'stmt'])
+            for text in ['1;', 'a = (1 + b) + 2;', '-1 + 2; (-(3)); x = y;']:
+                self.assertEqual(g.parse(text), optimized.parse(text))
+
+        # pearley (without precedence)
+        grammar = grammar.replace(" %prec UMINUS", "").split('%left')[0] + "WS: '[ ]+' (%ignore);"
+        g = Grammar(grammar, engine='pearley')
+        optimized = Grammar(grammar, engine='pearley', optimize=True)
+        self.assertEqual(sorted(optimized._grammar.inlined_rules), ['atom', 'expr', 'stmt'])
+        for text in ['1;', 'a = (1 + b) + 2;', '(-(3)); x = y;']:
+            self.assertEqual(g.parse(text), optimized.parse(text))
+
+    def test_build_report(self):
+        # Built, not loaded from the cache (which doesn't know the conflicts)
+        orig_cache_dir = cache.get_cache_dir()
+        cache.set_cache_dir(None)
+        try:
+            g = Grammar(r"""start: pair+;
+                            pair: NAME (':' VALUE)?;
+                            NAME: '[a-z]+';
+                            VALUE: '<[^>]*>'
+                            {
+                                start: '<' item* '>';
+                                item: '[a-z]+';
+                                WS: ' ' (%ignore);
+                            };
+                            WS: '[ \n]+' (%ignore);
+                         """, profile=True)
+        finally:
+            cache.set_cache_dir(orig_cache_dir)
+        report = g.build_report()
+
+        phases = [phase['name'] for phase in report['phases']]
+        self.assertEqual(phases[0], 'parse grammar')
+        self.assertEqual(phases[-2:], ['build lexer', 'build parser'])
+        self.assertAlmostEqual(report['seconds'], sum(phase['seconds'] for phase in report['phases']))
+        if tracemalloc is not None:
+            self.assertTrue(all(phase['allocated'] is not None for phase in report['phases']))
+
+        counts = report['counts']
+        self.assertEqual(counts['anonymous tokens'], 1)
+        self.assertEqual(counts['conflicts'], 0)
+        self.assertEqual(counts['states'], len(g._grammar.engine.parser.action))
+        self.assertEqual(list(report['subgrammars']), ['VALUE'])
+        self.assertEqual(report['subgrammars']['VALUE']['counts']['anonymous tokens'], 3)
+
+        text = format_build_report(report)
+        self.assertTrue('build parser' in text and '<string>:value' in text)
+
+        # Without the profile option, there are timings and counts, but no allocations or conflicts
+        report = Grammar("start: A; A: 'a';").build_report()
+        self.assertEqual(report['phases'][-1]['allocated'], None)
+        self.assertEqual(report['conflicts'], None)
+
+    def test_analyze(self):
+        grammar = r"""start: pair+;
+                      pair: NAME (':' VALUE)?;
+                      unused: NAME;
+                      NAME: '[a-z]+';
+                      VALUE: '<[^>]*>'
+                      {
+                          start: '<' WORDS* '>';
+                          WORDS: '([a-z]+ ?)+';
+                      };
+                      WS: '[ \n]+' (%ignore);
+                   """
+        report = analyze(grammar)
+        sizes = Grammar(grammar)._grammar.engine.table_sizes()
+
+        counts = report['counts']
+        self.assertEqual(counts['alternatives'] + 1, sizes['productions'])   # and the start production
+        self.assertEqual(counts['tokens'], sizes['tokens'])
+        self.assertEqual(counts['estimated states'], sizes['states'])
+        self.assertEqual(report['pruned rules'], ['unused'])
+        self.assertEqual(report['warnings'], [])
+
+        subreport = report['subgrammars']['VALUE']
+        self.assertEqual(subreport['backtracking tokens'], [('WORDS', '([a-z]+ ?)+')])
+        self.assertEqual(len(subreport['warnings']), 1)
+        self.assertTrue('warning: the regexp of token WORDS' in format_analysis(report))
+
+    def test_native_lalr_builder(self):
+        grammar = r"""start: stmt+;
+                      @stmt: if_stmt | expr ';';
+                      if_stmt: 'if' expr stmt ('else' stmt)?;
+                      @expr: add | mul | cmp | neg | NUMBER | '\(' expr '\)';
+                      add: expr '\+' expr;
+                      mul: expr '\*' expr;
+                      cmp: expr '<' expr;
+                      neg: '-' expr %prec UMINUS;
+
+                      %nonassoc: '<';
+                      %left: '\+';
+                      %left: '\*';
+                      %right: UMINUS;
+
+                      NUMBER: '\d+';
+                      WS: '[ \n]+' (%ignore);
+                   """
+        # Built, not loaded from the cache (the tables are cached the same with either builder)
+        orig_cache_dir = cache.get_cache_dir()
+        cache.set_cache_dir(None)
+        try:
+            grammars = {}
+            for lalr_builder in ('yacc', 'native'):
+                cache.clear()
+                grammars[lalr_builder] = Grammar(grammar, lalr_builder=lalr_builder, profile=True)
+        finally:
+            cache.set_cache_dir(orig_cache_dir)
+
+        yacc_engine, native_engine = grammars['yacc']._grammar.engine, grammars['native']._grammar.engine
+        self.assertEqual(_parser_to_tab(native_engine.parser), _parser_to_tab(yacc_engine.parser))
+        self.assertEqual(len(native_engine.conflicts), 1)     # the dangling else
+        self.assertEqual(len(native_engine.conflicts), len(yacc_engine.conflicts))
+
+        text = 'if 1 < 2 if 3 -4 * 5; else 6 + 7 * 8;'
+        self.assertEqual(grammars['native'].parse(text), grammars['yacc'].parse(text))
+        self.assertRaises(ParseError, grammars['native'].parse, '1 < 2 < 3;')
+
+        self.assertRaises(GrammarException, Grammar, "start: a; a: 'x' a;", lalr_builder='native')
+
+    def test_lr1_tables(self):
+        # LR(1), but not LALR(1): merging the states after 'a' 'e' and 'b' 'e' makes a reduce/reduce conflict
+        grammar = r"""start: 'a' x 'c' | 'a' y 'd' | 'b' x 'd' | 'b' y 'c';
+                      x: 'e';
+                      y: 'e';
+                   """
+        orig_cache_dir = cache.get_cache_dir()
+        cache.set_cache_dir(None)   # built, so that the conflicts are recorded
+        try:
+            cache.clear()
+            lalr = Grammar(grammar, lalr_builder='native', profile=True)
+            lr1 = Grammar(grammar, lr_method='lr1', profile=True)
+        finally:
+            cache.set_cache_dir(orig_cache_dir)
+
+        conflicts = lalr._grammar.engine.conflicts
+        self.assertEqual(len(conflicts), 1)
+        self.assertTrue(conflicts[0].startswith('reduce/reduce'), conflicts)
+        self.assertTrue(conflicts[0].endswith('(example: _ANON_0 _ANON_4 . _ANON_1)'), conflicts)
+
+        self.assertEqual(lr1._grammar.engine.conflicts, [])
+        for text, rule in (('aec', 'x'), ('aed', 'y'), ('bec', 'y'), ('bed', 'x')):
+            self.assertEqual(lr1.parse(text).tail[0].head, rule)
+        self.assertRaises(ParseError, lr1.parse, 'aee')
+
+        self.assertRaises(ValueError, Grammar, grammar, lr_method='lr0')
+
+    def test_compact_tables(self):
+        grammar = r"""start: stmt+;
+                      @stmt: assign | call;
+                      assign: NAME '=' expr ';';
+                      call: NAME '\(' (expr (',' expr)*)? '\)' ';';
+                      @expr: add | NAME | NUMBER;
+                      add: expr '\+' expr;
+                      %left: '\+';
+
+                      NAME: '[a-z]+';
+                      NUMBER: '\d+';
+                      WS: '[ \n]+' (%ignore);
+                   """
+        g = Grammar(grammar)
+        compact = Grammar(grammar, compact_tables=True)
+        text = 'a = 1 + b + 2; f(a, 3); g();'
+        self.assertEqual(compact.parse(text), g.parse(text))
+
+        # The same errors, and the same recovery
+        for text in ('a = 1 +; f(a 3);', 'a = = 2;', 'f(a'):
+            errors = []
+            for grammar_ in (g, compact):
+                try:
+                    grammar_.parse(text)
+                except ParseError as e:
+                    errors.append(str(e))
+            self.assertEqual(len(errors), 2)
+            self.assertEqual(errors[0], errors[1])
+
+        sizes, compact_sizes = g._grammar.engine.table_sizes(), compact._grammar.engine.table_sizes()
+        self.assertEqual(compact_sizes['states'], sizes['states'])
+        self.assertTrue(compact_sizes['table bytes'] < sizes['table bytes'])
+
+        restored = Grammar.deserialize(compact.serialize())
+        self.assertEqual(restored.parse('x = y;'), g.parse('x = y;'))
+
+    def test_lalr_fast_engine(self):
+        grammar = r"""start: stmt*;
+                      @stmt: assign | call;
+                      assign: NAME '=' expr ';';
+                      call: NAME '\(' (expr (',' expr)*)? '\)' ';';
+                      @expr: add | cmp | NAME | NUMBER | '\(' expr '\)';
+                      add: expr '\+' expr;
+                      cmp: expr '<' expr;
+                      %nonassoc: '<';
+                      %left: '\+';
+
+                      NAME: '[a-z]+';
+                      NUMBER: '\d+';
+                      WS: '[ \n]+' (%ignore);
+                   """
+        for expansion_mode in ('inline', 'factored'):
+            g = Grammar(grammar, expansion_mode=expansion_mode)
+            fast = Grammar(grammar, expansion_mode=expansion_mode, engine='lalr_fast')
+            for text in ('a = 1 + (b + 2); f(a < 3, 4); g();', ''):
+                self.assertEqual(fast.parse(text), g.parse(text))
+
+            # The same errors, and the same recovery
+            for text in ('a = 1 +; f(a 3);', 'a = = 2;', 'f(a', 'a = 1 < 2 < 3;'):
+                errors = []
+                for grammar_ in (g, fast):
+                    try:
+                        grammar_.parse(text)
+                    except ParseError as e:
+                        errors.append(str(e))
+                self.assertEqual(len(errors), 2)
+                self.assertEqual(errors[0], errors[1])
+
+        restored = Grammar.deserialize(fast.serialize())
+        self.assertEqual(restored.parse('x = y;'), g.parse('x = y;'))
+        self.assertRaises(ValueError, Grammar, grammar, engine='lalr_fast', compact_tables=True)
+
+    def test_compiled_actions(self):
+        # The action compiled for a production returns what its rule's action returns, for children of the kinds given
+        tok = lambda s: TokValue(s, type='T')
+        values = {
+            'token': [tok('t')],
+            'tree': [STree('kept', [tok('a'), STree('b', [])])],
+            'splice': [STree('exp', [tok('c'), STree('d', [])]), STree('exp', [STree('e', [])]), STree('exp', [])],
+            'any': [tok('u'), STree('kept', []), STree('exp', [STree('f', [])]), STree('exp', [tok('g'), tok('h')]), STree('rule', [tok('i')])],
+        }
+        rules_to_expand = set(['exp'])
+        for size in range(4):
+            for kinds in itertools.product(sorted(values), repeat=size):
+                for self_expand, auto_filter_tokens, flatten in itertools.product((False, True), repeat=3):
+                    rules_to_flatten = set(['rule']) if flatten else set()
+                    args = (STree, auto_filter_tokens, rules_to_flatten, rules_to_expand)
+                    expected = rule_action('rule', self_expand, *args)
+                    action = compile_action('rule', kinds, self_expand, *args)
+                    for children in itertools.product(*[values[kind] for kind in kinds]):
+                        self.assertEqual(action(list(children)), expected(list(children)), (kinds, self_expand, auto_filter_tokens, flatten, children))
+
+    def test_shared_grammars(self):
+        grammar = r"""start: pair (';' pair)*;
+                      pair: NAME '=' value;
+                      @value: NAME | NUMBER | '\[' value* '\]';
+                      NAME: '[a-z]+';
+                      NUMBER: '\d+';
+                      WS: '[ ]+' (%ignore);
+                   """
+        for engine in ('ply', 'lalr_fast', 'pearley'):
+            registry.clear()
+            g1 = Grammar(grammar, engine=engine, share=True)
+            g2 = Grammar(grammar, engine=engine, share=True)
+            g3 = Grammar(grammar, engine=engine, share=True, keep_empty_trees=False)
+            self.assertEqual(registry.stats(), {'hits': 1, 'misses': 2, 'grammars': 2})
+            self.assertTrue(g1._shared is g2._shared and g1._grammar is not g2._grammar)
+            self.assertTrue(g1._grammar.engine.rule_defs is g2._grammar.engine.rule_defs)
+
+            # Each has its own lexer and parse state
+            text = 'a = [1 b [2]]; c = 3'
+            tokens = g1.lex(text)
+            next(tokens)
+            self.assertRaises(ParseError, g2.parse, 'a = ')
+            self.assertEqual([t.value for t in tokens][:3], ['=', '[', '1'])
+            self.assertEqual(g1.parse(text), Grammar(grammar, engine=engine).parse(text))
+            self.assertEqual(g2.parse(text), g1.parse(text))
+
+            # Held weakly: it's built again once no Grammar uses it
+            del g1, g2
+            gc.collect()
+            self.assertEqual(registry.stats()['grammars'], 1)
+            Grammar(grammar, engine=engine, share=True)
+            self.assertEqual(registry.stats()['misses'], 3)
+
+        # A build only makes the callers of the same key wait
+        import threading
+        class Built(object):
+            pass
+        registry.clear()
+        building, release = threading.Event(), threading.Event()
+        builds = []
+        def slow_build():
+            builds.append(1)
+            building.set()
+            release.wait(30)
+            return Built()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get('slow', slow_build))) for _ in range(2)]
+        threads[0].start()
+        building.wait(30)
+        threads[1].start()
+        other = registry.get('other', Built)    # doesn't wait for 'slow'
+        self.assertFalse(release.is_set())
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(results[0] is results[1] and len(builds) == 1)
+        self.assertEqual(registry.stats(), {'hits': 1, 'misses': 2, 'grammars': 2})
+        del other
+
+    def test_start_rules(self):
+        grammar = r"""start: stmt+;
+                      @stmt: NAME '=' expr ';';
+                      ?expr: expr '\+' term | term;
+                      ?term: NAME | NUMBER | '\(' expr '\)';
+                      NAME: '[a-z]+';
+                      NUMBER: '\d+';
+                      WS: '[ ]+' (%ignore);
+                   """
+        texts = {'start': 'a = 1 + b; c = (2);', 'expr': 'a + (2 + c)', 'stmt': 'a = 1;'}
+        for engine, compact_tables in (('ply', False), ('ply', True), ('lalr_fast', False), ('pearley', False)):
+            g = Grammar(grammar, engine=engine, compact_tables=compact_tables, auto_filter_tokens=False, start=['start', 'expr', 'stmt'])
+            for start, text in texts.items():
+                single = Grammar(grammar, engine=engine, compact_tables=compact_tables, auto_filter_tokens=False, start=start)
+                self.assertEqual(g.parse(text, start=start), single.parse(text))
+            self.assertEqual(g.parse(texts['start']), g.parse(texts['start'], start='start'))
+            self.assertEqual(g.parse('x', start='expr'), STree('expr', ['x']))
+            syntax_error = Exception if engine == 'pearley' else ParseError    # pearley raises Exception
+            self.assertRaises(syntax_error, g.parse, texts['stmt'], start='expr')
+            self.assertRaises(syntax_error, g.parse, texts['expr'], start='stmt')
+            self.assertRaises(ValueError, g.parse, texts['expr'], start='term')
+
+        # One set of tables, smaller than those of a grammar for each start rule
+        states = Grammar(grammar, start=['start', 'expr', 'stmt'])._grammar.counts['states']
+        self.assertTrue(states < sum(Grammar(grammar, start=start)._grammar.counts['states'] for start in texts))
+        self.assertRaises(GrammarException, Grammar, grammar, start=['expr', 'exp'])
+        # The markers of the start rules aren't counted as tokens of the grammar
+        tokens = Grammar(grammar)._grammar.engine.table_sizes()['tokens']
+        self.assertEqual(Grammar(grammar, start=['start', 'expr', 'stmt'])._grammar.engine.table_sizes()['tokens'], tokens)
+        self.assertRaises(GrammarException, Grammar, grammar + "__start: NAME;", start=['start', 'expr'])
+
+    def test_build_async(self):
+        from multiprocessing.pool import ThreadPool
+        grammar = r"""start: NAME (',' NAME)*;
+                      NAME: '[a-z]+';
+                      WS: '[ ]+' (%ignore);
+                   """
+        expected = Grammar(grammar).parse('a, b')
+        g = Grammar.build_async(grammar)
+        self.assertEqual(g.parse('a, b'), expected)
+        self.assertEqual(pickle.loads(pickle.dumps(Grammar.build_async(grammar))).parse('a, b'), expected)
+
+        class MyTree(STree):
+            pass
+        pool = ThreadPool(2)
+        try:
+            g = Grammar.build_async(grammar, pool=pool, tree_class=MyTree)
+            self.assertEqual(g.parse('a, b'), expected)
+            self.assertTrue(isinstance(g.parse('a'), MyTree))
+            # The build's errors are raised by the first use of the grammar
+            bad = Grammar.build_async("start: foo;", pool=pool)
+            self.assertRaises(ParseError, bad.parse, 'a')
+        finally:
+            pool.close()
+        self.assertRaises(ParseError, Grammar.build_async("start: foo;").parse, 'a')
+
+    def test_reloading_grammar(self):
+        import time, shutil, tempfile
+        names = r"""start: name+; name: '[a-z]+'; WS: '[ ]+' (%ignore);"""
+        numbers = r"""start: number+; number: '\d+'; WS: '[ ]+' (%ignore);"""
+        a_b = STree('start', [STree('name', ['a']), STree('name', ['b'])])
+        one_two = STree('start', [STree('number', ['1']), STree('number', ['2'])])
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'list.g')
+        def write(text, mtime):
+            with open(filename, 'wb') as f:
+                f.write(text.encode('utf8'))
+            os.utime(filename, (mtime, mtime))  # mtimes can be too coarse to see a quick change
+        try:
+            write(names, 1000)
+            g = ReloadingGrammar(filename, interval=0)
+            self.assertEqual(g.parse('a b'), a_b)
+            self.assertFalse(g.check())
+
+            old = g.grammar
+            write(numbers, 2000)
+            self.assertTrue(g.check())
+            self.assertEqual((g.version, g.parse('1 2')), (1, one_two))
+            self.assertRaises(TokenizeError, g.parse, 'a b')
+            self.assertEqual(old.parse('a b'), a_b)    # a parse that started before keeps its grammar
+
+            # A broken file keeps the last grammar that built
+            write("start: foo;", 3000)
+            self.assertFalse(g.check())
+            self.assertTrue(isinstance(g.error, ParseError))
+            self.assertEqual(g.parse('1 2'), one_two)
+
+            # The background thread reloads by itself
+            write(numbers, 4000)
+            with ReloadingGrammar(filename, interval=0.01) as g:
+                write(names, 5000)
+                deadline = time.time() + 30
+                while g.version == 0 and time.time() < deadline:
+                    time.sleep(0.01)
+                self.assertEqual(g.parse('a b'), a_b)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_prune_unreachable(self):
+        g = Grammar(r"""start: name (',' name)*;
+                        name: NAME;
+                        unused: name '=' NUMBER;
+                        @unused_too: unused;
+                        %left: '=';
+                        NAME: '[a-z]+' (%unless IF: 'if'; );
+                        NUMBER: '[0-9]+';
+                        WS: '[ ]+' (%ignore);
+                     """)
+        self.assertEqual(sorted(g._grammar.pruned_rules), ['unused', 'unused_too'])
+        self.assertEqual(len(g._grammar.pruned_tokens), 2)     # NUMBER and '=', even though it has a precedence
+        self.assertTrue('NUMBER' in g._grammar.pruned_tokens)
+        self.assertEqual(g.parse('a, b').select('name *'), ['a', 'b'])
+        self.assertRaises(ParseError, g.parse, 'a, if')
+
+        # A lexer lexes the tokens that no rule uses
+        g = Grammar("start: A; A: 'a'; B: 'b';", just_lex=True)
+        self.assertEqual([t.type for t in g.lex('ab')], ['A', 'B'])
+        self.assertEqual(g._grammar.pruned_tokens, [])
+        self.assertEqual(analyze("start: A; A: 'a'; B: 'b';", just_lex=True)['pruned tokens'], [])
+
 def test_python_lex(code=FIB, expected=54):
     g = Grammar(_read('python.g'))
     l = list(g.lex(code))
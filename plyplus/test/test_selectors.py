@@ -2,6 +2,9 @@ from __future__ import absolute_import
 
 import unittest
 import logging
+import os
+import sys
+import subprocess
 from plyplus.plyplus import Grammar, STree
 from plyplus.selector import selector
 
@@ -121,6 +124,15 @@ class TestSelectors(unittest.TestCase):
         # Test regexp encoding, selector re-use
         assert not tree1.select('/{value}/', value='^a')
 
+    def test_lazy_grammars(self):
+        # Importing plyplus mustn't build the selector grammar, or the grammar-language parser
+        code = ('import plyplus\n'
+                'from plyplus import selector, grammar_parser\n'
+                'assert selector._selector_grammar is None and grammar_parser._parser is None\n'
+                'assert plyplus.Grammar("start: A; A: \'a\';").parse("a").select("start")\n')
+        path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        subprocess.check_call([sys.executable, '-c', code], cwd=path)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+
+import unittest
+import logging
+import pickle
+from io import StringIO
+
+from plyplus import grammars
+from plyplus.plyplus import Grammar, GrammarException
+from plyplus.strees import STree
+from plyplus.standalone import gen_standalone
+
+logging.basicConfig(level=logging.INFO)
+
+UNLESS_GRAMMAR = r"""
+start: (keyword | NAME)+;
+keyword: IF | ELSE;
+NAME: '[a-z]+'
+    (%unless
+        IF: 'if';
+        ELSE: 'else';
+    );
+WS: '[ \t]+' (%ignore);
+"""
+
+def _import_standalone(grammar):
+    out = StringIO()
+    gen_standalone(grammar, out)
+    module = {}
+    exec(compile(out.getvalue(), '<standalone>', 'exec'), module)
+    return module
+
+class MyTree(STree):
+    pass
+
+class TestStandalone(unittest.TestCase):
+    def test_serialize(self):
+        g = Grammar(UNLESS_GRAMMAR)
+        g2 = Grammar.deserialize(g.serialize())
+        text = 'if x else yy if'
+        self.assertEqual(g.parse(text), g2.parse(text))
+        self.assertEqual([t.type for t in g2.lex(text)], ['IF', 'NAME', 'ELSE', 'NAME', 'IF'])
+
+    def test_deserialize_options(self):
+        g = Grammar("start: A B; A: 'a'; B: 'b';", auto_filter_tokens=False)
+        g2 = Grammar.deserialize(g.serialize(), tree_class=MyTree)
+        r = g2.parse('ab')
+        self.assertEqual(type(r), MyTree)
+        self.assertEqual(r.tail, ['a', 'b'])
+
+    def test_wrong_version(self):
+        data = Grammar("start: A; A: 'a';").serialize()
+        data['version'] = '0.0.0'
+        self.assertRaises(GrammarException, Grammar.deserialize, data)
+
+    def test_serialize_pearley(self):
+        g = Grammar(UNLESS_GRAMMAR, engine='pearley')
+        g2 = Grammar.deserialize(g.serialize())
+        text = 'if x else yy if'
+        self.assertEqual(g.parse(text), g2.parse(text))
+
+    def test_pickle(self):
+        with grammars.open('config.g') as f:
+            g = Grammar(f, tree_class=MyTree)
+        g2 = pickle.loads(pickle.dumps(g, pickle.HIGHEST_PROTOCOL))
+        text = "[ bla bla ]\nthis = that\n\n[Section2]\nwhatever: whatever\n"
+        r = g2.parse(text)
+        self.assertEqual(type(r), MyTree)
+        self.assertEqual(r, g.parse(text))
+
+    def test_standalone(self):
+        g = Grammar(UNLESS_GRAMMAR)
+        module = _import_standalone(g)
+        text = 'else if xyz'
+        self.assertEqual(module['parse'](text), g.parse(text))
+        self.assertEqual(module['load'](tree_class=MyTree).parse(text), g.parse(text))
+
+    def test_standalone_subgrammars(self):
+        with grammars.open('config.g') as f:
+            g = Grammar(f)
+        module = _import_standalone(g)
+        text = "[ bla bla ]\nthis = that\n\n[Section2]\nwhatever: whatever\n"
+        self.assertEqual(module['parse'](text), g.parse(text))
+
+
+if __name__ == '__main__':
+    unittest.main()
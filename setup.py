@@ -1,11 +1,24 @@
 import re
+import sys
+import subprocess
 from distutils.core import setup
+from distutils.command.build_py import build_py
 
 __version__ ,= re.findall('__version__ = "(.*)"', open('plyplus/__init__.py').read())
 
+class build_py_with_tables(build_py):
+    "Also generates the tables for plyplus' own grammars, so they ship with the package"
+    def run(self):
+        build_py.run(self)
+        if not self.dry_run:
+            # Runs the copy that was just built, so the tables end up next to it
+            subprocess.check_call([sys.executable, '-m', 'plyplus.bootstrap'], cwd=self.build_lib)
+
 setup(
     name = "PlyPlus",
     version = __version__,
+    cmdclass = {'build_py': build_py_with_tables},
+
     packages = ['plyplus', 'plyplus.test', 'plyplus.grammars', 'examples', 'docs'], #find_packages(),
     #scripts = ['say_hello.py'],
 